@@ -45,6 +45,9 @@ def app_serializer(obj):
         # Perform specific serialization for aiohttp web.Application, if needed
         # For example, return a dict of routes. This is just a placeholder.
         return {"routes": list(obj.router.routes())}
+    elif callable(getattr(obj, 'status', None)):
+        # blade components (eg: spotting's model registry) report themselves
+        return obj.status()
     elif callable(obj):
         # Convert callables to their string representation
         return (
@@ -1,23 +1,27 @@
 from ..intent import Intent
 import time
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 @dataclass
 class SpottingIntentParameters:
     """
-    For now there is no specific configuration around the Spotting module
-    because it's main_address is configured trough config which is sufficient 
-    for static topology.
+    The Spotting module's main_address is configured trough config which is
+    sufficient for static topology.
+
+    `models` are the revisions of the spotting models (name: revision), the
+    spotting blade reloads in place the models which revision changed.
     """
-    pass
+    models: dict = field(default_factory=dict)
 
 async def spotting_orchestration(blade, capabilities: dict[str, str], __topology__: dict, __selfblade__) -> Intent:
-    """The spotting orchestrator has no special implementation on static top"""
+    """The spotting orchestrator forwards the models revisions on static top"""
     return Intent(
         id='{}:{}:{}'.format(time.time(), blade['host'], blade['port']),
         blade='spotting', # we never change a blade's behavior in static top
         version=capabilities['exorde-labs/exorde-swarm-client'],
         host='{}:{}'.format(blade['host'], blade['port']),
-        params=SpottingIntentParameters() # does nothing for spotting, maybe pass worker addr
+        params=SpottingIntentParameters(
+            models=blade.get('static_cluster_parameters', {}).get('models', {})
+        ) # maybe pass worker addr
     )
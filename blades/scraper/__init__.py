@@ -25,6 +25,7 @@ class Scraper:
     """
     def __init__(self):
         self.task = None
+        self.dropped = 0 # items spotting was too busy for
   
     def install_module(self, intent): # cannot fail
         """
@@ -173,26 +174,75 @@ class Scraper:
    
     async def push_data(self, data:dict, intent:dict): # CANNOT FAIL
         """
-        Pushing data should never be blocking
+        Pushing data never raises, but it blocks the scraping loop while the
+        spotting blade is busy
 
         May propagate unreachable to the orchestrator
             multiple strategies possibles:
                 - [CHOOSEN] drop the data
                 - [COMPLEX] hold the data until capability 
+
+        When the spotting blade is overloaded (429) or not ready (503) the data
+        is held and pushed again after the Retry-After it asked for : the
+        scraping loop awaits the push so the scraper slows down to the
+        spotting blade's capacity. After waiting `MAX_PUSH_WAIT` seconds in
+        total the data is dropped, a blade which never recovers does not hold
+        the scraper forever.
         """
         blade_logger.info('pushing data')
         target = intent['params']['target']
         # Assuming that 'data' is a dictionary that can be turned into JSON
+        waited = 0.0
         try:
+            item = data.get('item', data)
+            # spotting queues (lanes.py) and dedups (dedup.py) items without
+            # decoding them
+            headers = {
+                'X-Item-Domain': str(item.get('domain', '') or ''),
+                'X-Item-Url': str(item.get('url', '') or ''),
+                'X-Item-Id': str(item.get('external_id', '') or ''),
+            }
             async with ClientSession() as session:
-                async with session.post(target, json=data) as response:
-                    response_data = await response.text() 
-                    blade_logger.info(f"Status: {response.status}")
-                    blade_logger.info(f"Response: {response_data}")
+                while True:
+                    async with session.post(
+                        target, json=data, headers=headers
+                    ) as response:
+                        response_data = await response.text() 
+                        blade_logger.info(f"Status: {response.status}")
+                        blade_logger.info(f"Response: {response_data}")
+                        if response.status not in (429, 503):
+                            return
+                        retry_after = retry_after_seconds(
+                            response.headers.get('Retry-After')
+                        )
+                    if waited + retry_after > MAX_PUSH_WAIT:
+                        self.dropped += 1
+                        blade_logger.error(
+                            f"Spotting busy for {waited}s, dropping the data",
+                            extra={'logtest': {'push': {'dropped': self.dropped}}}
+                        )
+                        return
+                    blade_logger.warning(
+                        f"Spotting is busy, pushing again in {retry_after}s"
+                    )
+                    await asyncio.sleep(retry_after)
+                    waited += retry_after
         except:
             blade_logger.exception('Could not push data')
 
 
+MAX_PUSH_RETRY_AFTER = 60 # seconds, per retry
+MAX_PUSH_WAIT = 300 # seconds, in total before the data is dropped
+
+
+def retry_after_seconds(header: Union[None, str], default: float = 1) -> float:
+    """Retry-After (in seconds) or `default` when absent/invalid"""
+    try:
+        return min(max(float(header), 0.1), MAX_PUSH_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return default
+
+
 async def load_intent(request):
     """
     used by blade.py on load_intent (basicly a super)
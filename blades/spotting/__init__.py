@@ -2,48 +2,249 @@
 Spotting server waits to receive data, accumulates it and applies batch logic
 on it
 
+Models are loaded once in a `ModelRegistry` (see registry.py) and shared by
+every batch, by a background warm-up started with the blade (see
+warm_start.py) : items are refused with a 503 until it is done, a failed
+warm-up exits the blade which is restarted by multi.py. Inference runs out of
+the aiohttp loop, in the `InferenceExecutor` workers (see executor.py),
+batches go trough the stages of the spotting pipeline (see
+spotting_process.py). Items are batched by the `AdaptiveBatcher` (see
+batcher.py), pushed one by one on `/push` or many at once on `/push/bulk` (see
+bulk.py).
 """
+import time
+_import_started = time.monotonic()
+
 from aiohttp import web
+import os
 import asyncio
 import logging
 
-from .spotting_process import spotting_process
+from .spotting_process import spotting_process, spotting_pipeline
+from .registry import ModelRegistry
+from .residency import MB
+from .backends import DEFAULT_CACHE_DIRECTORY
+from .tag import InferenceConfiguration
+from .scheduler import intra_op_threads, limit_intra_op_threads
+from .cache import AnalysisCache
+from .executor import InferenceExecutor
+from .batcher import AdaptiveBatcher, Overloaded
+from .bulk import add_bulk, MAX_BODY_SIZE
+from .dedup import DedupIndex, Duplicate, header_keys
+from .lanes import DOMAIN_HEADER, FairQueue, lane_key
+from .controller import LatencyController
+from .uploader import Uploader
+from .chunking import Chunker, DEFAULT_SEGMENTATION_MODEL, DEFAULT_TOKENIZER
+from .spool import Spool, DEFAULT_SEGMENT_BYTES, DEFAULT_SPOOL_DIRECTORY
+from .warm_start import WarmStart
 
-blade_logger = logging.getLogger('blade')
+IMPORT_SECONDS = round(time.monotonic() - _import_started, 3)
 
-# Shared state and lock
-shared_data = {'items': []}
-lock = asyncio.Lock()
+blade_logger = logging.getLogger('blade')
 
-# Maximum size of the list before processing
-MAX_SIZE = 10
 async def add_data(request):
     """Scrapers push items trough this endpoint"""
     data = await request.text()
     blade_logger.info('Received new data')
 
-    async with lock:
-        shared_data['items'].append(data)
-        data_size = len(shared_data['items'])
-
-        # If the list reaches MAX_SIZE, trigger processing
-        if data_size >= MAX_SIZE:
-            # Copy the data for processing and clear the shared state
-            data_to_process = shared_data['items'].copy()
-            shared_data['items'] = []
-            # Run the data processing without holding the lock
-            asyncio.create_task(spotting_process(data_to_process))
-            return web.Response(
-                text=f"Data added and processing triggered with {data_size} items."
-            )
-
+    if not request.app['warm_start'].ready:
+        return web.Response(
+            status=503, text="Models are not ready.",
+            headers={'Retry-After': str(request.app['batcher'].retry_after())}
+        )
+    # the batcher triggers the processing when the batch is full or when it's
+    # oldest item waited long enough (see batcher.py)
+    try:
+        data_size = request.app['batcher'].add(
+            data,
+            request.content_length or len(data.encode('utf-8')),
+            lane_key(request.remote, request.headers.get(DOMAIN_HEADER, None)),
+            # the item is not decoded on the loop, see dedup.py
+            header_keys(request.headers),
+        )
+    except Duplicate:
+        return web.Response(text="Duplicate.")
+    except Overloaded as overloaded:
+        blade_logger.warning('Overloaded, retry after {}s'.format(
+            overloaded.retry_after
+        ))
+        return web.Response(
+            status=429, text="Overloaded.",
+            headers={'Retry-After': str(overloaded.retry_after)}
+        )
+    if data_size:
+        return web.Response(
+            text=f"Data added and processing triggered with {data_size} items."
+        )
     return web.Response(text="Data added.")
 
-app = web.Application()
+
+async def reload_models(app, revisions: dict[str, str]):
+    """Reloads models in place, the registry keeps serving during the reload"""
+    try:
+        reloaded = await app['inference_executor'].reload(revisions)
+        if reloaded:
+            blade_logger.info('reloaded models : {}'.format(reloaded))
+    except:
+        blade_logger.exception('An error occured while reloading models')
+
+
+async def load_intent(request):
+    """
+    used by blade.py on load_intent
+
+    the spotting intent carries the models revisions, models which revision
+    changed are reloaded in the background.
+    """
+    intent = await request.json()
+    revisions: dict[str, str] = intent['params'].get('models', None) or {}
+    if revisions:
+        asyncio.create_task(reload_models(request.app, revisions))
+    return web.json_response(request.app['blade'])
+
+app = web.Application(client_max_size=MAX_BODY_SIZE)
 
 async def spotting_on_init(app):
     blade_logger.info("Hello World !")
+    app['warm_start'] = WarmStart(IMPORT_SECONDS)
+    parameters: dict = app['blade'].get('static_cluster_parameters', {})
+    registry = ModelRegistry(
+        device=parameters.get('device', -1),
+        revisions=parameters.get('models', {}),
+        backends=parameters.get('backends', {}),
+        cache_dir=parameters.get('model_cache_dir', DEFAULT_CACHE_DIRECTORY),
+        memory_budget=(
+            parameters['model_memory_budget_mb'] * MB
+            if parameters.get('model_memory_budget_mb', None) else None
+        ),
+        eviction=parameters.get('model_eviction', 'lru'),
+        snapshots=parameters.get('model_snapshots', True),
+        shared=parameters.get('shared_weights', False),
+        latest_seconds=parameters.get('model_latest_seconds', 24 * 60 * 60),
+    )
+    app['model_registry'] = registry
+    app['inference_configuration'] = InferenceConfiguration(
+        batch_size=parameters.get('inference_batch_size', 32),
+        buckets=parameters.get('inference_buckets', 4),
+        concurrent_heads=parameters.get('concurrent_heads', 4),
+        intra_op_threads=parameters.get('intra_op_threads', None),
+    )
+    # before torch and tensorflow are imported (warm-up) so they start with it
+    limit_intra_op_threads(intra_op_threads(
+        app['inference_configuration'].concurrent_heads,
+        app['inference_configuration'].intra_op_threads,
+    ))
+    app['analysis_cache'] = AnalysisCache(
+        capacity=parameters.get('analysis_cache_size', 10000),
+        ttl_seconds=parameters.get('analysis_cache_ttl_seconds', 24 * 60 * 60),
+        path=parameters.get('analysis_cache_path', None),
+        max_disk_entries=parameters.get('analysis_cache_disk_entries', 200000),
+    )
+    if parameters.get('upload_url', None):
+        app['uploader'] = Uploader(
+            parameters['upload_url'],
+            download_url=parameters.get('download_url', None),
+            in_flight=parameters.get('upload_in_flight', 2),
+            retries=parameters.get('upload_retries', 5),
+        )
+        await app['uploader'].start()
+    if parameters.get('chunking', True):
+        app['chunker'] = Chunker(
+            max_tokens=parameters.get('chunk_max_tokens', 256),
+            segmentation_model=parameters.get(
+                'chunk_segmentation_model', DEFAULT_SEGMENTATION_MODEL
+            ),
+            tokenizer_id=parameters.get('chunk_tokenizer', DEFAULT_TOKENIZER),
+            batch_size=parameters.get('chunk_batch_size', 32),
+        )
+    # models (and the chunker) are loaded by the executor during the warm-up
+    app['inference_executor'] = InferenceExecutor(
+        registry,
+        workers=parameters.get('inference_workers', 1),
+        dispatch=parameters.get('inference_dispatch', 'least_busy'),
+        chunker=app.get('chunker', None),
+    )
+    # decode -> chunk -> tag -> merge -> serialize -> upload -> receipt
+    app['pipeline'] = spotting_pipeline(app, parameters)
+    app['pipeline'].start()
+    app['batcher'] = AdaptiveBatcher(
+        lambda items: spotting_process(items, app),
+        min_size=parameters.get('batch_min_size', 10),
+        max_size=parameters.get('batch_max_size', 256),
+        max_wait_seconds=parameters.get('batch_max_wait_seconds', 5.0),
+        latency_budget_seconds=parameters.get(
+            'batch_latency_budget_seconds', 10.0
+        ),
+        max_items=parameters.get('admission_max_items', 2000),
+        max_bytes=parameters.get('admission_max_bytes', 64 * 1024 * 1024),
+        spool=Spool(
+            parameters.get('spool_path', None) or os.path.join(
+                DEFAULT_SPOOL_DIRECTORY, app['blade'].get('name', 'spotting')
+            ),
+            parameters.get('spool_segment_bytes', DEFAULT_SEGMENT_BYTES),
+        ),
+        max_spool_items=parameters.get('spool_max_items', 100000),
+        max_spool_bytes=parameters.get('spool_max_bytes', 1024 * 1024 * 1024),
+        max_attempts=parameters.get('batch_max_attempts', 3),
+        dedup=DedupIndex(
+            ttl_seconds=parameters.get('dedup_ttl_seconds', 600),
+            memory_bytes=parameters.get('dedup_memory_bytes', 8 * 1024 * 1024),
+        ) if parameters.get('dedup', True) else None,
+        queue=FairQueue(
+            weights=parameters.get('lane_weights', {}),
+            max_share=parameters.get('lane_max_share', 0.5),
+        ),
+        max_running=parameters.get('max_running_batches', 4),
+        controller=LatencyController(
+            parameters['latency_target_p95_seconds']
+        ) if parameters.get('latency_target_p95_seconds', None) else None,
+        # the batch size sets how long tagging takes, not uploads or queues
+        processing_latency=lambda job: job.tag_seconds,
+    )
+    app['warm_start'].phases['init'] = round(
+        time.monotonic() - app['warm_start'].started, 3
+    )
+    app['warm_up'] = asyncio.create_task(warm_up(app))
+
+
+async def warm_up(app):
+    """Loads the models in the background, the blade is ready once done"""
+    warm_start: WarmStart = app['warm_start']
+    try:
+        with warm_start.phase('models'):
+            # in it's workers or in it's thread, with the chunker
+            await app['inference_executor'].start()
+        # items spooled but not processed before the last stop
+        app['batcher'].replay()
+    except asyncio.CancelledError:
+        raise
+    except:
+        warm_start.fail()
+        # /push would answer 503 forever, the blade is restarted instead
+        await app['inference_executor'].stop()
+        raise SystemExit(1)
+    executor: InferenceExecutor = app['inference_executor']
+    warm_start.done(
+        executor.workers_status if executor.workers else app['model_registry'].status()
+    )
+
+async def spotting_on_cleanup(app):
+    if not app['warm_up'].done():
+        app['warm_up'].cancel()
+        try:
+            await app['warm_up']
+        except asyncio.CancelledError:
+            pass
+    await app['batcher'].stop()
+    app['batcher'].spool.close()
+    await app['pipeline'].stop()
+    if app.get('uploader', None) is not None:
+        await app['uploader'].stop()
+    await app['inference_executor'].stop()
 
 app.on_startup.append(spotting_on_init)
+app.on_cleanup.append(spotting_on_cleanup)
 
 app.router.add_post('/push', add_data)
+app.router.add_post('/push/bulk', add_bulk)
+app['load_intent'] = load_intent
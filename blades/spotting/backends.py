@@ -0,0 +1,199 @@
+"""
+# Inference backends
+
+Spotting nodes usually have no GPU. The classification, sentiment and
+embedding models can run on a CPU-optimized backend instead of eager pytorch :
+
+    - torch     : transformers / sentence-transformers as published (default)
+    - onnx      : graph exported to ONNX and run by onnxruntime (fp32)
+    - onnx-int8 : the ONNX graph with dynamically quantized int8 weights
+
+The backend is chosen per model in the spotting blade's configuration :
+
+    static_cluster_parameters:
+      backends:
+        Emotion: onnx-int8
+        Embedding: onnx
+
+Exports and quantizations are done once and cached on disk under
+`model_cache_dir` (by repository, revision and backend). ONNX backends require
+`optimum[onnxruntime]`, which is only imported when such a backend is used.
+
+int8 trades a little accuracy for throughput, see test_backends.py for the
+tolerances against the torch fp32 scores.
+"""
+import os
+import json
+import shutil
+import logging
+import platform
+import tempfile
+import numpy as np
+
+blade_logger = logging.getLogger('blade')
+
+BACKENDS = ['torch', 'onnx', 'onnx-int8']
+DEFAULT_CACHE_DIRECTORY = os.path.join(
+    os.path.expanduser('~'), '.cache', 'exorde', 'models'
+)
+
+
+class UnknownBackend(Exception):
+    """The configured backend is not one of BACKENDS"""
+
+
+def cached_directory(spec, cache_dir: str, backend: str) -> str:
+    return os.path.join(
+        cache_dir,
+        spec.repo_id.replace('/', '__'),
+        spec.revision or 'latest',
+        backend
+    )
+
+
+def build_once(target: str, build):
+    """
+    Calls `build(directory)` if `target` is not cached yet. The build is done in
+    a temporary directory renamed when complete so that several workers
+    starting together never read a half-written export.
+    """
+    if os.path.isdir(target):
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    directory = tempfile.mkdtemp(dir=os.path.dirname(target))
+    try:
+        build(directory)
+        os.rename(directory, target)
+    except OSError:
+        if not os.path.isdir(target): # not built by another worker
+            raise
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return target
+
+
+def onnx_directory(spec, cache_dir: str, model_class) -> str:
+    """ONNX export of the model (and it's tokenizer)"""
+    from transformers import AutoTokenizer
+    def export(directory: str):
+        blade_logger.info('exporting {} to onnx'.format(spec.repo_id))
+        model_class.from_pretrained(
+            spec.repo_id, revision=spec.revision, export=True
+        ).save_pretrained(directory)
+        AutoTokenizer.from_pretrained(
+            spec.repo_id, revision=spec.revision
+        ).save_pretrained(directory)
+    return build_once(cached_directory(spec, cache_dir, 'onnx'), export)
+
+
+def onnx_int8_directory(spec, cache_dir: str, model_class) -> str:
+    """Dynamic int8 quantization of the ONNX export"""
+    from transformers import AutoTokenizer
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    source = onnx_directory(spec, cache_dir, model_class)
+    def quantize(directory: str):
+        blade_logger.info('quantizing {} to int8'.format(spec.repo_id))
+        if platform.machine() in ('arm64', 'aarch64'):
+            configuration = AutoQuantizationConfig.arm64(
+                is_static=False, per_channel=False
+            )
+        else:
+            configuration = AutoQuantizationConfig.avx2(
+                is_static=False, per_channel=False
+            )
+        ORTQuantizer.from_pretrained(source).quantize(
+            save_dir=directory, quantization_config=configuration
+        )
+        AutoTokenizer.from_pretrained(source).save_pretrained(directory)
+    return build_once(cached_directory(spec, cache_dir, 'onnx-int8'), quantize)
+
+
+def load_onnx(spec, cache_dir: str, backend: str, model_class):
+    """returns the onnxruntime model and it's tokenizer for `backend`"""
+    from transformers import AutoTokenizer
+    if backend == 'onnx':
+        directory = onnx_directory(spec, cache_dir, model_class)
+        file_name = 'model.onnx'
+    elif backend == 'onnx-int8':
+        directory = onnx_int8_directory(spec, cache_dir, model_class)
+        file_name = 'model_quantized.onnx'
+    else:
+        raise UnknownBackend(backend)
+    return (
+        model_class.from_pretrained(directory, file_name=file_name),
+        AutoTokenizer.from_pretrained(directory)
+    )
+
+
+def onnx_text_classification(spec, cache_dir: str, backend: str):
+    """text-classification pipeline running on onnxruntime"""
+    from transformers import pipeline
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    model, tokenizer = load_onnx(
+        spec, cache_dir, backend, ORTModelForSequenceClassification
+    )
+    return pipeline(
+        "text-classification",
+        model=model,
+        tokenizer=tokenizer,
+        top_k=None,
+        max_length=512,
+        padding=True,
+    )
+
+
+class OnnxSentenceEncoder:
+    """
+    `SentenceTransformer.encode` for a transformer followed by mean pooling
+    (and normalization when the sentence-transformers model has it), running
+    on onnxruntime.
+    """
+    def __init__(self, model, tokenizer, max_length: int, normalize: bool):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.normalize = normalize
+
+    def encode(self, sentences: list[str], batch_size: int = 32) -> np.ndarray:
+        embeddings: list[np.ndarray] = []
+        for start in range(0, len(sentences), batch_size):
+            features = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='np',
+            )
+            token_embeddings = np.asarray(
+                self.model(**features).last_hidden_state, dtype=np.float32
+            )
+            mask = features['attention_mask'][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+            if self.normalize:
+                pooled = pooled / np.clip(
+                    np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None
+                )
+            embeddings.append(pooled)
+        return np.concatenate(embeddings)
+
+
+def onnx_sentence_encoder(spec, cache_dir: str, backend: str):
+    from huggingface_hub import hf_hub_download
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    model, tokenizer = load_onnx(
+        spec, cache_dir, backend, ORTModelForFeatureExtraction
+    )
+    with open(hf_hub_download(
+        spec.repo_id, 'sentence_bert_config.json', revision=spec.revision
+    )) as f:
+        max_length: int = json.load(f)['max_seq_length']
+    with open(hf_hub_download(
+        spec.repo_id, 'modules.json', revision=spec.revision
+    )) as f:
+        normalize: bool = any(
+            module['type'].endswith('Normalize') for module in json.load(f)
+        )
+    return OnnxSentenceEncoder(model, tokenizer, max_length, normalize)
@@ -0,0 +1,395 @@
+"""
+# Adaptive batcher
+
+Items pushed on `/push` are accumulated and processed in batches. A batch is
+flushed when it reaches the current batch size or when it's oldest item
+waited `max_wait_seconds`, so a quiet cluster still processes it's items and
+a busy one fills bigger batches.
+
+The batch size starts at `min_size` and adapts to the processing latency of
+full batches :
+
+    latency < headroom * latency_budget  ──> size grows (x growth, <= max_size)
+    latency > latency_budget             ──> size shrinks (/ growth, >= min_size)
+
+With a `LatencyController` (see controller.py) the size is instead chosen to
+meet a p95 latency target, from a model of the latency of recent batches.
+
+The latency a batch is processed in includes the time it waits for the stages
+shared with other batches (uploads, backpressure, `max_running`), which does
+not depend on it's size. With `processing_latency` the size adapts to the
+latency that does instead, read from `process`' result (eg: the duration of
+the tag stage) ; batches it returns None for (nothing processed) do not adapt
+it. `retry_after` keeps using the whole latency.
+
+Batch sizes and waits (age of the oldest item when flushed) are reported as
+histograms on the blade's status.
+
+Admission is bounded : items are counted (with their size in bytes) from the
+moment they are added until their batch is processed. When `max_items` or
+`max_bytes` would be exceeded `add` raises `Overloaded` and `/push` answers
+429 with a Retry-After hint, so scrapers slow down to the blade's capacity
+instead of the blade growing until it is killed.
+
+With a `Spool` (see spool.py) items are appended to disk when admitted, the
+batches hold their records and are read back when processed. Waiting items are
+then on disk and count in the spool's budget (`max_spool_items`,
+`max_spool_bytes`) instead, only the items of the running batches count in
+memory. Records are marked done once their batch is processed ; the records of
+a failed batch are batched again (in the RETRY lane) up to `max_attempts`
+times before being dropped. Only a crash leaves items to replay.
+
+With a `DedupIndex` (see dedup.py) items already pushed are dropped before
+being spooled or batched.
+
+Waiting items are queued in lanes (see lanes.py), batches are assembled from
+them by weight. With `max_running` no more batches are flushed while that
+many are processed : the backlog waits in the lanes, where fairness applies,
+instead of in the pipeline's queues.
+"""
+import math
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Optional
+
+from .spool import Spool
+from .dedup import DedupIndex
+from .lanes import FairQueue, REPLAY, RETRY
+from .controller import LatencyController
+
+blade_logger = logging.getLogger('blade')
+
+
+class Histogram:
+    """counts by upper bound, the last bucket is unbounded"""
+    def __init__(self, bounds: list[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def status(self) -> dict:
+        buckets = {
+            '<={}'.format(bound): count
+            for bound, count in zip(self.bounds, self.counts)
+        }
+        buckets['>{}'.format(self.bounds[-1])] = self.counts[-1]
+        return {
+            'buckets': buckets,
+            'count': self.count,
+            'mean': round(self.total / self.count, 4) if self.count else None,
+        }
+
+
+class Overloaded(Exception):
+    """
+    The admission budget is full, retry after `retry_after` seconds. `lane` is
+    set when only the item's lane is over it's share of the budget.
+    """
+    def __init__(self, retry_after: int, lane: Optional[tuple[str, str]] = None):
+        super().__init__('retry after {}s'.format(retry_after))
+        self.retry_after = retry_after
+        self.lane = lane
+
+
+class AdaptiveBatcher:
+    def __init__(
+        self,
+        process: Callable[[list], Awaitable[Any]],
+        min_size: int = 10,
+        max_size: int = 256,
+        max_wait_seconds: float = 5.0,
+        latency_budget_seconds: float = 10.0,
+        headroom: float = 0.5,
+        growth: float = 1.5,
+        max_items: int = 2000,
+        max_bytes: int = 64 * 1024 * 1024,
+        spool: Optional[Spool] = None,
+        dedup: Optional[DedupIndex] = None,
+        queue: Optional[FairQueue] = None,
+        max_running: Optional[int] = None,
+        controller: Optional[LatencyController] = None,
+        max_spool_items: int = 100000,
+        max_spool_bytes: int = 1024 * 1024 * 1024,
+        max_attempts: int = 3,
+        processing_latency: Optional[Callable[[Any], Optional[float]]] = None,
+    ):
+        self.process = process
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.max_wait_seconds = max_wait_seconds
+        self.latency_budget_seconds = latency_budget_seconds
+        self.headroom = headroom
+        self.growth = growth
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.spool = spool
+        self.dedup = dedup
+        self.queue = queue if queue is not None else FairQueue()
+        self.max_running = max_running
+        self.controller = controller
+        self.max_spool_items = max_spool_items
+        self.max_spool_bytes = max_spool_bytes
+        self.max_attempts = max_attempts
+        self.processing_latency = processing_latency
+        self.size: int = self.min_size
+        self.admitted_items: int = 0 # in memory, waiting (no spool) & running
+        self.admitted_bytes: int = 0
+        self.spooled_items: int = 0 # on disk, waiting & running
+        self.spooled_bytes: int = 0
+        self.attempts: dict = {} # record: attempts, of the failed records
+        self.rejected: int = 0
+        self.retried: int = 0
+        self.dropped: int = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.running: set[asyncio.Task] = set()
+        self.last_latency: Optional[float] = None
+        self.last_processing_latency: Optional[float] = None
+        self.batch_sizes = Histogram([1, 10, 32, 64, 128, 256, 512, 1024])
+        self.waits = Histogram([0.1, 0.5, 1, 2, 5, 10, 30])
+
+    def retry_after(self) -> int:
+        """seconds for a batch to be processed, from the last latency"""
+        return max(1, math.ceil(self.last_latency or self.max_wait_seconds))
+
+    def add(
+        self,
+        item,
+        size: int = 0,
+        lane: tuple[str, str] = ('', ''),
+        keys: Optional[list[str]] = None,
+    ) -> int:
+        """
+        Adds an item, returns the size of the batch it triggered (0 when the
+        item is waiting for the next flush). Raises `Overloaded` when the item
+        does not fit in the admission budget (or in it's lane's share of it)
+        and `Duplicate` when it has already been pushed (see dedup.py `keys`).
+        """
+        items, used, max_items, max_bytes = self.budget()
+        # an empty budget always admits, items bigger than max_bytes pass alone
+        if items and (items + 1 > max_items or used + size > max_bytes):
+            self.rejected += 1
+            raise Overloaded(self.retry_after())
+        if self.queue.over_share(lane, max_items):
+            self.rejected += 1
+            raise Overloaded(self.retry_after(), lane)
+        if self.dedup is not None: # raises Duplicate
+            self.dedup.check(item, keys)
+        if self.spool is not None:
+            item = self.spool.append(item.encode('utf-8'))
+            size = item.length
+        return self.enqueue(item, size, lane)
+
+    def budget(self) -> tuple[int, int, int, int]:
+        """(items, bytes, max items, max bytes) of the budget waiting items use"""
+        if self.spool is not None:
+            return (
+                self.spooled_items, self.spooled_bytes,
+                self.max_spool_items, self.max_spool_bytes
+            )
+        return (
+            self.admitted_items, self.admitted_bytes, self.max_items, self.max_bytes
+        )
+
+    def replay(self) -> int:
+        """batches the items left pending in the spool by a previous process"""
+        records = self.spool.recover() if self.spool is not None else []
+        for record in records: # admitted even over the budget
+            self.enqueue(record, record.length, REPLAY)
+        return len(records)
+
+    def enqueue(self, item, size: int, lane: tuple[str, str]) -> int:
+        if self.spool is not None:
+            self.spooled_items += 1
+            self.spooled_bytes += size
+        else:
+            self.admitted_items += 1
+            self.admitted_bytes += size
+        self.queue.push(lane, item, size)
+        if self.timer is None:
+            self.arm()
+        if len(self.queue) >= self.size:
+            return self.flush(full=True)
+        return 0
+
+    def arm(self):
+        """flush when the oldest waiting item reaches `max_wait_seconds`"""
+        oldest = self.queue.oldest()
+        if oldest is None:
+            return
+        self.timer = asyncio.get_running_loop().call_later(
+            max(0, oldest + self.max_wait_seconds - time.monotonic()),
+            self.flush
+        )
+
+    def busy(self) -> bool:
+        return self.max_running is not None and len(self.running) >= self.max_running
+
+    def flush(self, full: bool = False, force: bool = False) -> int:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not len(self.queue) or (self.busy() and not force):
+            return 0 # a running batch flushes when done
+        taken = self.queue.pop(self.size)
+        items = [item for item, __size__, __enqueued__ in taken]
+        size = sum(item_size for __item__, item_size, __enqueued__ in taken)
+        self.waits.observe(time.monotonic() - min(
+            enqueued_at for __item__, __size__, enqueued_at in taken
+        ))
+        self.batch_sizes.observe(len(items))
+        task = asyncio.create_task(self.run(items, size, full))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        self.arm() # for the items left in the lanes
+        return len(items)
+
+    def drain(self):
+        """flushes the items which waited for a running batch to finish"""
+        if len(self.queue) >= self.size:
+            self.flush(full=True)
+        elif len(self.queue) and (
+            time.monotonic() - self.queue.oldest() >= self.max_wait_seconds
+        ):
+            self.flush()
+        if self.timer is None:
+            self.arm()
+
+    async def run(self, items: list, size: int, full: bool):
+        start = time.monotonic()
+        records = None
+        if self.spool is not None: # items are spool records, read in memory
+            records, items = items, self.spool.read(items)
+            self.admitted_items += len(items)
+            self.admitted_bytes += size
+        failed = False
+        try:
+            result = await self.process(items)
+        except:
+            failed = True
+            blade_logger.exception(
+                'An error occured while processing a batch of {} items'.format(
+                    len(items)
+                )
+            )
+            return
+        finally: # the budget is released once the batch is done
+            self.admitted_items -= len(items)
+            self.admitted_bytes -= size
+            if records:
+                self.spooled_items -= len(records)
+                self.spooled_bytes -= size
+                if failed:
+                    self.retry(records)
+                else:
+                    self.done(records)
+            self.running.discard(asyncio.current_task())
+            self.drain()
+        self.last_latency = time.monotonic() - start
+        latency = self.last_latency
+        if self.processing_latency is not None:
+            latency = self.processing_latency(result)
+            if latency is None:
+                return
+        self.last_processing_latency = latency
+        if self.controller is not None:
+            self.controller.observe(len(items), size, latency)
+            decided = self.controller.next_size(
+                self.size, self.min_size, self.max_size
+            )
+            if decided is not None:
+                self.resize(decided, latency)
+                return
+        if full: # only full batches tell if the size can grow
+            self.adapt(latency)
+
+    def done(self, records: list):
+        if self.attempts:
+            for record in records:
+                self.attempts.pop(record, None)
+        self.spool.done(records)
+
+    def retry(self, records: list):
+        """batches a failed batch's records again, drops them after `max_attempts`"""
+        dropped = []
+        for record in records:
+            attempts = self.attempts.pop(record, 1)
+            if attempts >= self.max_attempts:
+                dropped.append(record)
+                continue
+            self.attempts[record] = attempts + 1
+            self.enqueue(record, record.length, RETRY)
+        self.retried += len(records) - len(dropped)
+        if dropped:
+            self.dropped += len(dropped)
+            self.spool.done(dropped)
+            blade_logger.error('dropped {} items failed {} times'.format(
+                len(dropped), self.max_attempts
+            ))
+
+    def adapt(self, latency: float):
+        if latency < self.headroom * self.latency_budget_seconds:
+            self.resize(min(self.max_size, int(self.size * self.growth) + 1), latency)
+        elif latency > self.latency_budget_seconds:
+            self.resize(max(self.min_size, int(self.size / self.growth)), latency)
+
+    def resize(self, size: int, latency: float):
+        previous, self.size = self.size, size
+        if self.size != previous:
+            blade_logger.info(
+                'batch size {} -> {} (latency {:.2f}s)'.format(
+                    previous, self.size, latency
+                )
+            )
+
+    async def stop(self):
+        """processes the waiting items and waits for the running batches"""
+        while len(self.queue):
+            self.flush(force=True)
+        if self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
+    def status(self) -> dict:
+        return {
+            'size': self.size,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'max_wait_seconds': self.max_wait_seconds,
+            'waiting': len(self.queue),
+            'running': len(self.running),
+            'max_running': self.max_running,
+            'admitted_items': self.admitted_items,
+            'admitted_bytes': self.admitted_bytes,
+            'max_items': self.max_items,
+            'max_bytes': self.max_bytes,
+            'spooled_items': self.spooled_items,
+            'spooled_bytes': self.spooled_bytes,
+            'max_spool_items': self.max_spool_items,
+            'max_spool_bytes': self.max_spool_bytes,
+            'rejected': self.rejected,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'last_latency': (
+                round(self.last_latency, 4)
+                if self.last_latency is not None else None
+            ),
+            'last_processing_latency': (
+                round(self.last_processing_latency, 4)
+                if self.last_processing_latency is not None else None
+            ),
+            'spool': self.spool.status() if self.spool is not None else None,
+            'dedup': self.dedup.status() if self.dedup is not None else None,
+            'batch_sizes': self.batch_sizes.status(),
+            'waits': self.waits.status(),
+            'lanes': self.queue.status(),
+            'controller': (
+                self.controller.status() if self.controller is not None else None
+            ),
+        }
@@ -0,0 +1,260 @@
+"""
+# Spotting benchmark
+
+Measures the throughput of `tag` or of `process_batch` on a synthetic
+multilingual corpus, with the real models or the stub ones (see stubs.py) :
+
+    python -m blades.spotting.benchmark --models stub --documents 2000 \\
+        --batch-size 64 --mean-words 60 --duplicates 0.1 --output bench.json
+
+    --target tag            : `tag` called directly, per-head timings
+    --target process_batch  : `process_batch` trough the InferenceExecutor
+                              (in thread) and the analysis cache
+
+The report is a json document (docs/sec, p50/p99 batch latency, per-head
+latency, peak RSS and, with --tracemalloc, the peak of python allocations)
+with the commit and the parameters, so runs can be compared across commits.
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import subprocess
+import tracemalloc
+import numpy as np
+from datetime import datetime
+from typing import Optional
+
+from .registry import ModelRegistry
+from .residency import MB
+from .stubs import StubRegistry
+from .tag import tag, InferenceConfiguration
+
+"""
+Synthetic corpus : words of a few languages (their own scripts, to exercise
+tokenizers the way a multilingual feed does), lengths drawn from a lognormal
+distribution and a share of documents repeated from earlier ones.
+"""
+LANGUAGES = {
+    'en': "the market bitcoin rally traders price inflation bank rates report today great new",
+    'fr': "le marché hausse des prix banque centrale taux rapport aujourd'hui nouvelle grande",
+    'es': "el mercado subida precios banco central tasas informe hoy nueva gran",
+    'de': "der Markt Anstieg Preise Zentralbank Zinsen Bericht heute neue große",
+    'ru': "рынок рост цены центральный банк ставки отчёт сегодня новый большой",
+    'ja': "市場 上昇 価格 中央銀行 金利 報告 今日 新しい 大きな",
+    'zh': "市场 上涨 价格 央行 利率 报告 今天 新的 大",
+    'ar': "السوق ارتفاع الأسعار البنك المركزي الفائدة تقرير اليوم جديد كبير",
+}
+
+
+def corpus(
+    documents: int,
+    mean_words: float = 60,
+    sigma: float = 0.8,
+    duplicates: float = 0.0,
+    seed: int = 0
+) -> list[str]:
+    rng = random.Random(seed)
+    lengths = np.random.default_rng(seed).lognormal(
+        np.log(mean_words) - sigma ** 2 / 2, sigma, documents
+    )
+    result: list[str] = []
+    for length in lengths:
+        if result and rng.random() < duplicates:
+            result.append(rng.choice(result))
+            continue
+        words = LANGUAGES[rng.choice(list(LANGUAGES))].split()
+        result.append(' '.join(
+            rng.choice(words) for __i__ in range(max(1, int(length)))
+        ) + ' {}.'.format(rng.randrange(10 ** 9)))
+    return result
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    return round(float(np.percentile(values, q)), 4) if values else None
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024 # linux: KiB
+
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def processed(documents: list[str]) -> list:
+    """`Processed` items around the documents, for process_batch"""
+    from exorde.models import Processed
+    from .spotting_process import from_json
+    return [
+        from_json(Processed, {
+            'item': {
+                'created_at': '2023-10-17T00:00:00.00Z',
+                'domain': 'reddit.com',
+                'url': 'https://reddit.com/r/benchmark/{}'.format(i),
+                'content': document,
+            },
+            'translation': {'language': 'en', 'translation': document},
+            'top_keywords': [],
+            'classification': {'label': 'finance', 'score': 1.0},
+        })
+        for i, document in enumerate(documents)
+    ]
+
+
+def run_tag(registry, batches: list[list[str]], configuration) -> tuple[list, list]:
+    latencies, head_seconds = [], []
+    for batch in batches:
+        timings: dict[str, float] = {}
+        start = time.perf_counter()
+        tag(batch, registry, configuration, timings)
+        latencies.append(time.perf_counter() - start)
+        head_seconds.append(timings)
+    return latencies, head_seconds
+
+
+def run_process_batch(
+    registry, batches: list[list[str]], configuration, cache_size: int
+) -> tuple[list, list]:
+    from .cache import AnalysisCache
+    from .executor import InferenceExecutor
+    from .process_batch import process_batch
+
+    async def scenario():
+        executor = InferenceExecutor(registry, workers=0)
+        await executor.start()
+        cache = AnalysisCache(capacity=cache_size) if cache_size else None
+        latencies, head_seconds = [], []
+        try:
+            for batch in batches:
+                items = list(enumerate(processed(batch)))
+                executor.head_seconds = {}
+                start = time.perf_counter()
+                await process_batch(items, executor, configuration, cache)
+                latencies.append(time.perf_counter() - start)
+                head_seconds.append(executor.head_seconds)
+        finally:
+            await executor.stop()
+        return latencies, head_seconds
+
+    return asyncio.run(scenario())
+
+
+def benchmark(arguments) -> dict:
+    documents = corpus(
+        arguments.documents,
+        arguments.mean_words,
+        arguments.sigma,
+        arguments.duplicates,
+        arguments.seed,
+    )
+    batches = [
+        documents[start:start + arguments.batch_size]
+        for start in range(0, len(documents), arguments.batch_size)
+    ]
+    configuration = InferenceConfiguration(
+        batch_size=arguments.inference_batch_size,
+        buckets=arguments.buckets,
+        concurrent_heads=arguments.concurrent_heads,
+    )
+    residency = {
+        'memory_budget': (
+            arguments.memory_budget_mb * MB if arguments.memory_budget_mb else None
+        ),
+        'eviction': arguments.eviction,
+    }
+    if arguments.models == 'stub':
+        registry = StubRegistry(work=arguments.stub_work, **residency)
+    else:
+        registry = ModelRegistry(**residency)
+    load_start = time.perf_counter()
+    if arguments.target == 'tag': # process_batch's executor loads the models
+        registry.load()
+        registry.warm_up()
+    load_seconds = time.perf_counter() - load_start
+
+    if arguments.tracemalloc:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if arguments.target == 'tag':
+        latencies, head_seconds = run_tag(registry, batches, configuration)
+    else:
+        latencies, head_seconds = run_process_batch(
+            registry, batches, configuration, arguments.cache_size
+        )
+    wall = time.perf_counter() - start
+    traced_peak = None
+    if arguments.tracemalloc:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    heads = sorted({name for timings in head_seconds for name in timings})
+    return {
+        'commit': commit(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'parameters': vars(arguments),
+        'documents': len(documents),
+        'batches': len(batches),
+        'load_seconds': round(load_seconds, 3),
+        'wall_seconds': round(wall, 3),
+        'docs_per_second': round(len(documents) / wall, 2) if wall else None,
+        'batch_latency': {
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+            'mean': round(float(np.mean(latencies)), 4) if latencies else None,
+        },
+        'head_latency': {
+            name: {
+                'p50': percentile([t[name] for t in head_seconds if name in t], 50),
+                'p99': percentile([t[name] for t in head_seconds if name in t], 99),
+            }
+            for name in heads
+        },
+        'peak_rss_bytes': peak_rss_bytes(),
+        'tracemalloc_peak_bytes': traced_peak,
+        'residency': registry.residency.status(),
+    }
+
+
+def parse_arguments(arguments: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Spotting benchmark")
+    parser.add_argument("--target", choices=['tag', 'process_batch'], default='tag')
+    parser.add_argument("--models", choices=['stub', 'real'], default='stub')
+    parser.add_argument("--stub-work", type=int, default=1, help="stub models cost")
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=64, help="documents per batch")
+    parser.add_argument("--mean-words", type=float, default=60)
+    parser.add_argument("--sigma", type=float, default=0.8, help="lognormal length spread")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="share of repeated documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--inference-batch-size", type=int, default=32)
+    parser.add_argument("--buckets", type=int, default=4)
+    parser.add_argument("--concurrent-heads", type=int, default=4)
+    parser.add_argument("--memory-budget-mb", type=int, default=None, help="models RAM budget")
+    parser.add_argument("--eviction", choices=['lru', 'cost'], default='lru')
+    parser.add_argument("--cache-size", type=int, default=0, help="process_batch analysis cache, 0 disables it")
+    parser.add_argument("--tracemalloc", action="store_true", help="traces python allocations (slower)")
+    parser.add_argument("--output", default=None, help="json report file, stdout by default")
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    report = json.dumps(benchmark(arguments), indent=2)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
@@ -0,0 +1,153 @@
+"""
+# Bulk ingestion
+
+`/push` costs one HTTP request per item. `/push/bulk` accepts many items in a
+single request :
+
+    - body : newline-delimited JSON (one item per line) or a JSON array
+    - Content-Encoding : none, gzip or lz4 (lz4 frame format)
+
+and answers with one result per item, in the order of the body :
+
+    {"accepted": 2, "results": [
+        {"status": "accepted"},
+        {"status": "invalid", "error": "Expecting value: line 1 column 1"},
+        {"status": "duplicate"},
+        {"status": "retry", "retry_after": 3}
+    ]}
+
+Items are admitted one by one in the same batcher (and budget) as `/push`, once
+the budget is full the remaining items are answered with `retry`. When no item
+could be admitted the response is a 429 (or 503 when the models are not
+ready) with a Retry-After header.
+"""
+import json
+import zlib
+import logging
+from aiohttp import web
+from typing import Union
+
+from .batcher import Overloaded
+from .lanes import item_domain, lane_key
+from .dedup import Duplicate, item_keys
+
+blade_logger = logging.getLogger('blade')
+
+MAX_BODY_SIZE = 32 * 1024 * 1024 # decompressed, aiohttp's client_max_size
+
+
+class UnsupportedEncoding(Exception):
+    """The Content-Encoding is not one of none, gzip or lz4"""
+
+
+def decompress(body: bytes, encoding: str) -> bytes:
+    if encoding in ('', 'identity'):
+        return body
+    if encoding == 'gzip':
+        # aiohttp already inflates gzip bodies unless auto_decompress is off
+        if body[:2] != b'\x1f\x8b':
+            return body
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        result = decompressor.decompress(body, MAX_BODY_SIZE)
+        complete = decompressor.eof
+    elif encoding == 'lz4':
+        import lz4.frame
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        result = decompressor.decompress(body, max_length=MAX_BODY_SIZE)
+        complete = decompressor.eof
+    else:
+        raise UnsupportedEncoding(encoding)
+    if not complete: # truncated or bigger than MAX_BODY_SIZE once inflated
+        raise ValueError('incomplete or larger than {} bytes'.format(
+            MAX_BODY_SIZE
+        ))
+    return result
+
+
+def split_items(
+    body: bytes
+) -> list[Union[tuple[str, str, list[str]], Exception]]:
+    """
+    (json text as received by `/push`, domain, dedup keys) per item, or the
+    exception raised while parsing it. A body starting with `[` is a JSON
+    array.
+    """
+    text = body.decode('utf-8')
+    if text.lstrip().startswith('['):
+        # a broken array has no item boundaries, it fails as a whole
+        return [
+            (json.dumps(item), item_domain(item), item_keys(item))
+            for item in json.loads(text)
+        ]
+    items: list[Union[tuple[str, str, list[str]], Exception]] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as error:
+            items.append(error)
+            continue
+        items.append((line, item_domain(data), item_keys(data)))
+    return items
+
+
+async def add_bulk(request):
+    """Scrapers push many items at once trough this endpoint"""
+    batcher = request.app['batcher']
+    if not request.app['warm_start'].ready:
+        return web.Response(
+            status=503, text="Models are not ready.",
+            headers={'Retry-After': str(batcher.retry_after())}
+        )
+    try:
+        items = split_items(decompress(
+            await request.read(),
+            request.headers.get('Content-Encoding', '').strip().lower()
+        ))
+    except UnsupportedEncoding as error:
+        return web.Response(
+            status=415, text="Unsupported encoding {}.".format(error)
+        )
+    except (ValueError, zlib.error, RuntimeError) as error: # json, gzip, lz4
+        return web.Response(status=400, text="Invalid body : {}".format(error))
+
+    results: list[dict] = []
+    accepted = 0
+    retry_after = None
+    budget_full = None # retry_after, once the whole budget is full
+    full_lanes: dict[tuple[str, str], int] = {} # over their share
+    for item in items:
+        if isinstance(item, Exception):
+            results.append({'status': 'invalid', 'error': str(item)})
+            continue
+        item, domain, keys = item
+        lane = lane_key(request.remote, domain)
+        retry = budget_full if budget_full is not None else full_lanes.get(lane)
+        if retry is not None:
+            results.append({'status': 'retry', 'retry_after': retry})
+            continue
+        try:
+            # the budget is in bytes, as spooled
+            batcher.add(item, len(item.encode('utf-8')), lane, keys)
+            accepted += 1
+            results.append({'status': 'accepted'})
+        except Duplicate:
+            results.append({'status': 'duplicate'})
+        except Overloaded as overloaded:
+            retry_after = overloaded.retry_after
+            if overloaded.lane is None:
+                budget_full = retry_after
+            else:
+                full_lanes[lane] = retry_after
+            results.append({'status': 'retry', 'retry_after': retry_after})
+    blade_logger.info('Received {} items, accepted {}'.format(
+        len(items), accepted
+    ))
+    if retry_after is not None and accepted == 0:
+        return web.json_response(
+            {'accepted': accepted, 'results': results},
+            status=429,
+            headers={'Retry-After': str(retry_after)}
+        )
+    return web.json_response({'accepted': accepted, 'results': results})
@@ -0,0 +1,207 @@
+"""
+# Analysis cache
+
+Scrapers often return the same text (RSS re-polls, retweets, cross-posted
+news). The analysis of a text only depends on the text and on the models used,
+so `tag` results are cached under
+
+    sha256(model set version + normalized translation)
+
+The cache has two layers :
+    - memory: LRU of `capacity` entries
+    - disk (optional): sqlite file, evicted by TTL and by number of entries
+
+Both layers expire entries after `ttl_seconds`.
+"""
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+blade_logger = logging.getLogger('blade')
+
+
+def normalize(text: str) -> str:
+    """NFC, trimmed and with collapsed whitespaces"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+
+class AnalysisCache:
+    def __init__(
+        self,
+        capacity: int = 10000,
+        ttl_seconds: float = 24 * 60 * 60,
+        path: Optional[str] = None,
+        max_disk_entries: int = 200000,
+    ):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+        self._puts: int = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS analysis ('
+                'key TEXT PRIMARY KEY, created_at REAL NOT NULL, value TEXT NOT NULL'
+                ')'
+            )
+            self._db.execute(
+                'CREATE INDEX IF NOT EXISTS analysis_created_at '
+                'ON analysis (created_at)'
+            )
+            self._db.commit()
+            self.evict()
+
+    @staticmethod
+    def key(text: str, version: str) -> str:
+        return hashlib.sha256(
+            '{}\0{}'.format(version, normalize(text)).encode('utf-8')
+        ).hexdigest()
+
+    def _remember(self, key: str, created_at: float, analysis: dict):
+        self.memory[key] = (created_at, analysis)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        """returns the cached analysis of `keys` (missing keys are absent)"""
+        now = time.time()
+        found: dict[str, dict] = {}
+        with self._lock:
+            for key in keys:
+                entry = self.memory.get(key, None)
+                if entry is None:
+                    continue
+                created_at, analysis = entry
+                if now - created_at > self.ttl_seconds:
+                    del self.memory[key]
+                    continue
+                self.memory.move_to_end(key)
+                found[key] = analysis
+            missing = [key for key in set(keys) if key not in found]
+            if self._db is not None and missing:
+                found.update(self._read_disk(missing, now))
+            for key in keys:
+                if key in found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def _read_disk(self, keys: list[str], now: float) -> dict[str, dict]:
+        from .tag import analysis_from_dict
+        found: dict[str, dict] = {}
+        for start in range(0, len(keys), 500): # sqlite variables limit
+            chunk = keys[start:start + 500]
+            rows = self._db.execute(
+                'SELECT key, created_at, value FROM analysis '
+                'WHERE created_at >= ? AND key IN ({})'.format(
+                    ','.join('?' * len(chunk))
+                ),
+                [now - self.ttl_seconds, *chunk]
+            ).fetchall()
+            for key, created_at, value in rows:
+                analysis = analysis_from_dict(json.loads(value))
+                self._remember(key, created_at, analysis)
+                found[key] = analysis
+                self.disk_hits += 1
+        return found
+
+    def put_many(self, analysis: dict[str, dict]):
+        now = time.time()
+        with self._lock:
+            for key, value in analysis.items():
+                self._remember(key, now, value)
+            if self._db is not None and analysis:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO analysis VALUES (?, ?, ?)',
+                    [
+                        (key, now, json.dumps(value))
+                        for key, value in analysis.items()
+                    ]
+                )
+                self._db.commit()
+                self._puts += len(analysis)
+                if self._puts >= 1000: # eviction is amortized on writes
+                    self._puts = 0
+                    self._evict()
+
+    def _evict(self):
+        self._db.execute(
+            'DELETE FROM analysis WHERE created_at < ?',
+            (time.time() - self.ttl_seconds,)
+        )
+        self._db.execute(
+            'DELETE FROM analysis WHERE key IN ('
+            'SELECT key FROM analysis ORDER BY created_at DESC '
+            'LIMIT -1 OFFSET ?)',
+            (self.max_disk_entries,)
+        )
+        self._db.commit()
+
+    def evict(self):
+        """Applies TTL and size limits to the disk layer"""
+        if self._db is not None:
+            with self._lock:
+                self._evict()
+
+    def status(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else None,
+            'memory_entries': len(self.memory),
+            'disk': self.path,
+        }
+
+
+async def tag_with_cache(
+    documents: list[str],
+    executor,
+    configuration,
+    cache: Optional[AnalysisCache]
+) -> list:
+    """
+    `tag` (trough the inference executor) for the documents that are not in
+    cache, a text repeated in the same batch is tagged once. The cache's sqlite
+    reads and commits run in the loop's default executor, not on the loop.
+    """
+    if cache is None:
+        return await executor.tag(documents, configuration)
+    keys: list[str] = [
+        cache.key(text, executor.registry.version) for text in documents
+    ]
+    loop = asyncio.get_running_loop()
+    found: dict[str, dict] = await loop.run_in_executor(
+        None, cache.get_many, keys
+    )
+    to_tag: dict[str, str] = {} # key: text, ordered & unique
+    for key, text in zip(keys, documents):
+        if key not in found:
+            to_tag.setdefault(key, text)
+    if to_tag:
+        tagged = await executor.tag(list(to_tag.values()), configuration)
+        new_analysis = dict(zip(to_tag.keys(), tagged))
+        await loop.run_in_executor(None, cache.put_many, new_analysis)
+        found.update(new_analysis)
+    blade_logger.info('analysis cache : {} cached, {} tagged'.format(
+        len(documents) - len(to_tag), len(to_tag)
+    ))
+    return [found[key] for key in keys]
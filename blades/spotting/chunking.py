@@ -0,0 +1,185 @@
+"""
+# Chunking
+
+The classification pipelines truncate their input at 512 tokens, the rest of
+a long article was never analyzed. The chunk stage splits long texts at
+sentence boundaries into chunks of at most `max_tokens` tokens, each chunk
+is tagged on it's own and the chunks of an item are merged back by the merge
+stage (see merge.py).
+
+    texts ──> tokens count ──> short: one chunk (most social posts)
+                          └──> long : wtpsplit sentences (one batched call
+                                      for every long text of the batch)
+                                      └──> sentences packed into chunks
+
+Sentences longer than the budget are cut on words. The sentence model is the
+one pre-installed by install.py (`wtp-canine-s-1l`), when it can't be loaded
+texts are split on punctuation instead.
+
+Tokens are counted with the tokenizer of `tokenizer_id`, or estimated from
+the number of words when it can't be loaded.
+
+The sentence model and the tokenizer are CPU heavy, they run out of the
+aiohttp process : the inference workers load a `Chunker` from the blade's
+`parameters()` and split the texts of `split` jobs (see executor.py), the
+blade's chunker only counts the chunks (`record`).
+"""
+import re
+import time
+import logging
+from typing import Callable, Optional
+
+blade_logger = logging.getLogger('blade')
+
+DEFAULT_SEGMENTATION_MODEL = 'wtp-canine-s-1l'
+DEFAULT_TOKENIZER = 'bert-large-uncased'
+SENTENCE_END = re.compile(r'(?<=[.!?。！？])\s+')
+TOKENS_PER_WORD = 1.4 # estimate for latin languages, used without tokenizer
+
+
+def estimated_tokens(texts: list[str]) -> list[int]:
+    return [int(len(text.split()) * TOKENS_PER_WORD) + 1 for text in texts]
+
+
+def punctuation_split(texts: list[str]) -> list[list[str]]:
+    return [SENTENCE_END.split(text) for text in texts]
+
+
+def pack(
+    sentences: list[str],
+    counts: list[int],
+    max_tokens: int,
+) -> list[str]:
+    """greedy packing of consecutive sentences in chunks of `max_tokens`"""
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for sentence, count in zip(sentences, counts):
+        if not sentence.strip():
+            continue
+        if count > max_tokens:
+            # cut on words, each piece roughly fits the budget
+            words = sentence.split()
+            step = max(1, int(len(words) * max_tokens / count))
+            pieces = [
+                ' '.join(words[start:start + step])
+                for start in range(0, len(words), step)
+            ]
+        else:
+            pieces = [sentence]
+        for piece in pieces:
+            piece_count = min(count, max_tokens)
+            if current and size + piece_count > max_tokens:
+                chunks.append(' '.join(current))
+                current, size = [], 0
+            current.append(piece.strip())
+            size += piece_count
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+
+class Chunker:
+    def __init__(
+        self,
+        max_tokens: int = 256,
+        segmentation_model: str = DEFAULT_SEGMENTATION_MODEL,
+        tokenizer_id: Optional[str] = DEFAULT_TOKENIZER,
+        batch_size: int = 32,
+    ):
+        self.max_tokens = max_tokens
+        self.segmentation_model = segmentation_model
+        self.tokenizer_id = tokenizer_id
+        self.batch_size = batch_size
+        self.segmenter: Optional[Callable[[list[str]], list[list[str]]]] = None
+        self.counter: Optional[Callable[[list[str]], list[int]]] = None
+        self.texts = 0
+        self.chunked = 0 # texts split in more than one chunk
+        self.chunks = 0
+        self.segmentation_seconds = 0.0
+
+    def parameters(self) -> dict:
+        """to build the same chunker in another process"""
+        return {
+            'max_tokens': self.max_tokens,
+            'segmentation_model': self.segmentation_model,
+            'tokenizer_id': self.tokenizer_id,
+            'batch_size': self.batch_size,
+        }
+
+    def load(self):
+        """Blocking, loads the sentence model and the tokenizer"""
+        if self.segmenter is None:
+            try:
+                from wtpsplit import WtP
+                wtp = WtP(self.segmentation_model)
+                self.segmenter = lambda texts: list(
+                    wtp.split(texts, batch_size=self.batch_size)
+                )
+            except Exception:
+                blade_logger.exception(
+                    'could not load {}, splitting on punctuation'.format(
+                        self.segmentation_model
+                    )
+                )
+                self.segmenter = punctuation_split
+        if self.counter is None:
+            self.counter = estimated_tokens
+            if self.tokenizer_id:
+                try:
+                    from transformers import AutoTokenizer
+                    tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_id)
+                    self.counter = lambda texts: [
+                        len(ids) for ids in tokenizer(
+                            texts, add_special_tokens=False
+                        )['input_ids']
+                    ] if texts else []
+                except Exception:
+                    blade_logger.exception(
+                        'could not load {}, estimating tokens'.format(
+                            self.tokenizer_id
+                        )
+                    )
+
+    def split(self, texts: list[str]) -> list[list[str]]:
+        """chunks of every text, a text has at least one chunk"""
+        self.load()
+        counts = self.counter(texts)
+        long = [
+            index for index, count in enumerate(counts)
+            if count > self.max_tokens
+        ]
+        result = [[text] for text in texts]
+        segmentation_seconds = 0.0
+        if long:
+            start = time.monotonic()
+            sentences = self.segmenter([texts[index] for index in long])
+            segmentation_seconds = time.monotonic() - start
+            flat = [sentence for text in sentences for sentence in text]
+            flat_counts = iter(self.counter(flat))
+            for index, text_sentences in zip(long, sentences):
+                result[index] = pack(
+                    text_sentences,
+                    [next(flat_counts) for __s__ in text_sentences],
+                    self.max_tokens
+                ) or [texts[index]]
+        self.record(result, segmentation_seconds)
+        return result
+
+    def record(self, result: list[list[str]], segmentation_seconds: float):
+        """counts the chunks of split texts, here or in a worker"""
+        self.texts += len(result)
+        self.chunked += sum(1 for chunks in result if len(chunks) > 1)
+        self.chunks += sum(len(chunks) for chunks in result)
+        self.segmentation_seconds += segmentation_seconds
+
+    def status(self) -> dict:
+        return {
+            'max_tokens': self.max_tokens,
+            'segmentation_model': self.segmentation_model,
+            'loaded': self.segmenter is not None,
+            'texts': self.texts,
+            'chunked': self.chunked,
+            'chunks': self.chunks,
+            'segmentation_seconds': round(self.segmentation_seconds, 3),
+        }
@@ -0,0 +1,114 @@
+"""
+# Latency controller
+
+The batch size trades throughput (bigger batches amortize the models calls)
+against latency. With a `target_p95_seconds` the batcher's size is chosen by
+this controller instead of the latency budget rules (see batcher.py) :
+
+    every processed batch -> (documents, bytes, latency) observation
+    rolling model         -> latency ~ a + b * documents + c * bytes
+                             (least squares on the last `window` batches,
+                             bytes stand for the token count)
+    next size             -> the largest size which predicted latency plus
+                             the 95th percentile of the model's residuals
+                             meets the target, at the recent bytes per item
+
+Docs/sec grow with the batch size as long as the fixed cost `a` is not
+negligible, so the largest size meeting the target is the best throughput.
+The size moves by at most `max_step` (x or /) per batch so a bad fit can't
+swing it, and the model and it's decisions are reported on the status.
+"""
+import logging
+import numpy as np
+from collections import deque
+from typing import Optional
+
+blade_logger = logging.getLogger('blade')
+
+
+class LatencyController:
+    def __init__(
+        self,
+        target_p95_seconds: float,
+        window: int = 50,
+        min_observations: int = 5,
+        max_step: float = 2.0,
+        ridge: float = 1e-6,
+    ):
+        self.target_p95_seconds = target_p95_seconds
+        self.window = window
+        self.min_observations = min_observations
+        self.max_step = max_step
+        self.ridge = ridge
+        self.observations: deque = deque(maxlen=window) # (documents, bytes, latency)
+        self.coefficients: Optional[np.ndarray] = None # a, b, c
+        self.residual_p95: Optional[float] = None
+        self.decisions = 0
+        self.last_decision: Optional[dict] = None
+
+    def observe(self, documents: int, size: int, latency: float):
+        self.observations.append((documents, size, latency))
+
+    def fit(self) -> bool:
+        if len(self.observations) < self.min_observations:
+            return False
+        data = np.array(self.observations, dtype=np.float64)
+        features = np.column_stack([np.ones(len(data)), data[:, 0], data[:, 1]])
+        latencies = data[:, 2]
+        # scaled so the ridge weighs documents and bytes alike
+        scale = np.maximum(np.abs(features).max(axis=0), 1e-9)
+        scaled = features / scale
+        coefficients = np.linalg.solve(
+            scaled.T @ scaled + self.ridge * np.eye(3), scaled.T @ latencies
+        ) / scale
+        self.coefficients = np.maximum(coefficients, 0) # costs are not negative
+        residuals = latencies - features @ self.coefficients
+        self.residual_p95 = float(max(0.0, np.percentile(residuals, 95)))
+        return True
+
+    def predict(self, documents: np.ndarray, bytes_per_item: float) -> np.ndarray:
+        a, b, c = self.coefficients
+        return a + b * documents + c * documents * bytes_per_item
+
+    def next_size(self, current: int, min_size: int, max_size: int) -> Optional[int]:
+        """the next batch size, None while there is not enough observations"""
+        if not self.fit():
+            return None
+        data = np.array(self.observations, dtype=np.float64)
+        bytes_per_item = float(data[:, 1].sum() / max(1.0, data[:, 0].sum()))
+        low = max(min_size, int(current / self.max_step))
+        high = max(low, min(max_size, int(current * self.max_step) + 1))
+        sizes = np.arange(low, high + 1)
+        p95 = self.predict(sizes, bytes_per_item) + self.residual_p95
+        feasible = sizes[p95 <= self.target_p95_seconds]
+        size = int(feasible[-1]) if len(feasible) else low
+        predicted = float(self.predict(np.array([size]), bytes_per_item)[0])
+        self.decisions += 1
+        self.last_decision = {
+            'size': size,
+            'previous': current,
+            'predicted_p95_seconds': round(predicted + self.residual_p95, 4),
+            'predicted_docs_per_second': (
+                round(size / predicted, 2) if predicted > 0 else None
+            ),
+            'bytes_per_item': round(bytes_per_item, 1),
+        }
+        return size
+
+    def status(self) -> dict:
+        latencies = [latency for __d__, __s__, latency in self.observations]
+        return {
+            'target_p95_seconds': self.target_p95_seconds,
+            'observations': len(self.observations),
+            'observed_p95_seconds': (
+                round(float(np.percentile(latencies, 95)), 4) if latencies else None
+            ),
+            'model': {
+                'fixed_seconds': float(self.coefficients[0]),
+                'seconds_per_document': float(self.coefficients[1]),
+                'seconds_per_byte': float(self.coefficients[2]),
+                'residual_p95_seconds': round(self.residual_p95, 4),
+            } if self.coefficients is not None else None,
+            'decisions': self.decisions,
+            'last_decision': self.last_decision,
+        }
@@ -0,0 +1,175 @@
+"""
+# Dedup index
+
+Scrapers often push the same item (same url or same external_id on a domain)
+within minutes, eg: RSS feeds polled by several scrapers. Duplicates are
+dropped at ingestion, before entering a batch.
+
+The index is a time-bucketed Bloom filter, it's memory is fixed by
+`memory_bytes` whatever the traffic :
+
+    buckets : [ b0 | b1 | ... | bN-1 ]   each covers ttl_seconds / N
+              keys are added to the current bucket, looked up in all of them,
+              the oldest bucket is cleared and reused when time moves on
+
+An item's keys are it's url and it's external_id (scoped by domain). Items
+are not decoded on the loop to find them : `/push` items carry them in the
+`X-Item-Url` and `X-Item-Id` headers (sent by the scrapers, with
+`X-Item-Domain`) and `/push/bulk` items are already decoded. An item without
+keys (eg: from an older scraper) is keyed by a hash of it's raw text, only
+identical pushes are duplicates then.
+
+An item is a duplicate when one of it's keys is in the index. Keys are only
+remembered for `ttl_seconds` (up to one bucket more). Being a Bloom filter, a
+small share of new items can be taken for duplicates : the false positive rate
+for the current load is reported in the status and grows when more distinct
+items than `capacity` are pushed during the ttl.
+"""
+import math
+import time
+import hashlib
+import logging
+import numpy as np
+from typing import Optional
+
+from .lanes import DOMAIN_HEADER
+
+blade_logger = logging.getLogger('blade')
+
+
+class Duplicate(Exception):
+    """The item has been pushed within the dedup ttl"""
+
+
+URL_HEADER = 'X-Item-Url' # of the item pushed on `/push`
+ID_HEADER = 'X-Item-Id' # it's external_id, on the domain of X-Item-Domain
+
+
+def keys(
+    url: Optional[str], external_id: Optional[str], domain: Optional[str]
+) -> list[str]:
+    result = []
+    if url:
+        result.append('url:{}'.format(url))
+    if external_id:
+        result.append('external_id:{}:{}'.format(domain or '', external_id))
+    return result
+
+
+def item_keys(data) -> list[str]:
+    """url & external_id keys of a decoded item (Processed or Item)"""
+    item = data.get('item', data) if isinstance(data, dict) else None
+    if not isinstance(item, dict):
+        return []
+    return keys(item.get('url'), item.get('external_id'), item.get('domain'))
+
+
+def header_keys(headers) -> list[str]:
+    """url & external_id keys of an item pushed on `/push`, from it's headers"""
+    return keys(
+        headers.get(URL_HEADER), headers.get(ID_HEADER),
+        headers.get(DOMAIN_HEADER),
+    )
+
+
+def content_key(text: str) -> str:
+    return 'content:{}'.format(hashlib.blake2b(
+        text.encode('utf-8'), digest_size=16
+    ).hexdigest())
+
+
+class DedupIndex:
+    def __init__(
+        self,
+        ttl_seconds: float = 600,
+        memory_bytes: int = 8 * 1024 * 1024,
+        buckets: int = 6,
+        hashes: int = 7,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.buckets = max(1, buckets)
+        self.hashes = hashes
+        self.bits = max(64, memory_bytes * 8 // self.buckets)
+        self.filters = np.zeros((self.buckets, self.bits // 8), dtype=np.uint8)
+        self.inserted = [0] * self.buckets # keys per bucket
+        self.current = 0
+        self.rotated_at = time.monotonic()
+        self.duplicates = 0
+        self.checked = 0
+
+    @property
+    def bucket_seconds(self) -> float:
+        return self.ttl_seconds / self.buckets
+
+    @property
+    def capacity(self) -> int:
+        """distinct keys per bucket for a 1% false positive rate"""
+        return int(self.bits * math.log(2) ** 2 / -math.log(0.01))
+
+    def rotate(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        elapsed = int((now - self.rotated_at) // self.bucket_seconds)
+        for __i__ in range(min(elapsed, self.buckets)):
+            self.current = (self.current + 1) % self.buckets
+            self.filters[self.current] = 0
+            self.inserted[self.current] = 0
+        if elapsed:
+            self.rotated_at += elapsed * self.bucket_seconds
+
+    def positions(self, key: str) -> np.ndarray:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        # double hashing
+        return np.array(
+            [(first + i * second) % self.bits for i in range(self.hashes)],
+            dtype=np.int64
+        )
+
+    def contains(self, positions: np.ndarray) -> bool:
+        masks = np.left_shift(1, positions % 8).astype(np.uint8)
+        return bool(np.any(np.all(
+            self.filters[:, positions // 8] & masks, axis=1
+        )))
+
+    def add(self, positions: np.ndarray):
+        masks = np.left_shift(1, positions % 8).astype(np.uint8)
+        np.bitwise_or.at(self.filters[self.current], positions // 8, masks)
+        self.inserted[self.current] += 1
+
+    def check(self, text: str, keys: Optional[list[str]] = None):
+        """
+        Raises `Duplicate` if a key of the item is indexed, else indexes it.
+        Without `keys` the item is keyed by it's content.
+        """
+        keys = keys or [content_key(text)]
+        self.rotate()
+        self.checked += 1
+        positions = [self.positions(key) for key in keys]
+        if any(self.contains(p) for p in positions):
+            self.duplicates += 1
+            blade_logger.info('dropped duplicate item', extra={'logtest': {
+                'dedup': {'duplicates': self.duplicates, 'checked': self.checked}
+            }})
+            raise Duplicate(keys[0])
+        for p in positions:
+            self.add(p)
+
+    def false_positive_rate(self) -> float:
+        """for a new key, with the keys currently in the buckets"""
+        rates = [
+            (1 - math.exp(-self.hashes * inserted / self.bits)) ** self.hashes
+            for inserted in self.inserted
+        ]
+        return 1 - math.prod(1 - rate for rate in rates)
+
+    def status(self) -> dict:
+        return {
+            'checked': self.checked,
+            'duplicates': self.duplicates,
+            'ttl_seconds': self.ttl_seconds,
+            'memory_bytes': int(self.filters.nbytes),
+            'keys': sum(self.inserted),
+            'capacity': self.capacity * self.buckets,
+            'false_positive_rate': round(self.false_positive_rate(), 6),
+        }
@@ -0,0 +1,461 @@
+"""
+# Inference executor
+
+`tag` is fully synchronous and takes seconds per batch, running it on the
+aiohttp loop stalls `/push` and scrapers time out. The executor runs `tag` out
+of the loop :
+
+    - workers > 0 : N long-lived worker processes, each one loads it's own
+                    `ModelRegistry` once. Batches are sent trough a queue per
+                    worker (to the least busy one or round-robin, see
+                    DISPATCHES) and results come back on a shared queue read
+                    by a background task.
+    - workers = 0 : a single dedicated thread of the blade's process, using
+                    the blade's registry (torch & tensorflow release the GIL
+                    during kernels but the loop still shares the process).
+
+In both cases `await executor.tag(documents, configuration)` is the interface.
+With a `Chunker` (see chunking.py) the workers (or the thread) also load it and
+`await executor.split(texts)` chunks texts there, the sentence model and the
+tokenizer do not run on the loop either.
+
+Workers are watched : a worker which died (segfault, OOM kill) is respawned
+and the batches it had in flight, still held by the executor, are sent again
+to a ready worker. A batch which killed `max_attempts` workers fails with an
+`InferenceError` instead of killing them all. A worker which can't start (eg:
+a model fails to load, or the worker dies while loading) is respawned with
+an exponential backoff, after
+`max_startup_failures` failures in a row it is given up and the executor is
+failed (see status) : it's batches fail with an `InferenceError`.
+
+The blade's registry (`app['model_registry']`) stays the reference for the
+models versions ; with workers it holds no model and it's `ready` flag mirrors
+the readiness of the workers.
+"""
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+import itertools
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from .registry import ModelRegistry
+from .chunking import Chunker
+
+blade_logger = logging.getLogger('blade')
+
+
+DISPATCHES = ('least_busy', 'round_robin')
+
+
+class InferenceError(Exception):
+    """`tag` raised in a worker, the message holds the worker's traceback"""
+
+
+class UnknownDispatch(Exception):
+    """The dispatch is not one of `DISPATCHES`"""
+
+
+@dataclass
+class PendingJob:
+    future: asyncio.Future
+    worker_id: int
+    message: tuple # (kind, job_id, payload), sent again if the worker dies
+    attempts: int = 1
+
+
+def worker_main(
+    worker_id: int,
+    registry_parameters: dict,
+    chunker_parameters: Optional[dict],
+    tasks,
+    results,
+): # runs in the worker process
+    from .tag import tag
+    registry = ModelRegistry(**registry_parameters)
+    chunker = Chunker(**chunker_parameters) if chunker_parameters else None
+    try:
+        registry.load()
+        registry.warm_up()
+        if chunker is not None:
+            chunker.load()
+    except:
+        results.put(('error', worker_id, None, traceback.format_exc()))
+        return
+    results.put(('ready', worker_id, None, registry.status()))
+    while True:
+        message = tasks.get()
+        if message is None: # stop
+            return
+        kind, job_id, payload = message
+        try:
+            if kind == 'tag':
+                documents, configuration = payload
+                timings: dict[str, float] = {}
+                analysis = tag(documents, registry, configuration, timings)
+                results.put(('result', worker_id, job_id, (analysis, timings)))
+            elif kind == 'split':
+                seconds = chunker.segmentation_seconds
+                chunks = chunker.split(payload)
+                results.put(('result', worker_id, job_id, (
+                    chunks, chunker.segmentation_seconds - seconds
+                )))
+            elif kind == 'reload':
+                registry.reload(payload)
+                results.put(('ready', worker_id, job_id, registry.status()))
+        except:
+            results.put(('error', worker_id, job_id, traceback.format_exc()))
+
+
+class InferenceExecutor:
+    def __init__(
+        self,
+        registry: ModelRegistry,
+        workers: int = 1,
+        dispatch: str = 'least_busy',
+        max_attempts: int = 2,
+        watch_seconds: float = 1.0,
+        max_startup_failures: int = 5,
+        max_backoff_seconds: float = 60.0,
+        chunker: Optional[Chunker] = None,
+    ):
+        if dispatch not in DISPATCHES:
+            raise UnknownDispatch(dispatch)
+        self.registry = registry
+        self.chunker = chunker
+        self.workers = workers
+        self.dispatch = dispatch
+        self.max_attempts = max_attempts
+        self.watch_seconds = watch_seconds
+        self.max_startup_failures = max_startup_failures
+        self.max_backoff_seconds = max_backoff_seconds
+        self.context = None
+        self.processes: list = []
+        self.tasks: list = [] # one queue per worker
+        self.results = None
+        self.in_flight: dict[int, int] = {} # worker_id: jobs
+        self.ready_workers: set[int] = set()
+        self.restarts: dict[int, int] = {}
+        self.startup_failures: dict[int, int] = {} # in a row, by worker
+        self.respawn_at: dict[int, float] = {} # backoff of the failing workers
+        self.failed_workers: set[int] = set() # given up
+        self.starting: set[int] = set() # spawned, neither ready nor failed yet
+        self.workers_status: dict[int, Any] = {}
+        self.jobs = itertools.count()
+        self.turns = itertools.count() # round-robin
+        self.pending: dict[int, PendingJob] = {}
+        self.collector: Optional[asyncio.Task] = None
+        self.watcher: Optional[asyncio.Task] = None
+        self.stopping = False
+        self.ready_event: Optional[asyncio.Event] = None
+        self.failure: Optional[str] = None
+        self.head_seconds: dict[str, float] = {} # of the last batch
+        # reads the results queue, or runs `tag` when workers = 0
+        self.thread = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='spotting-inference'
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self.registry.ready
+
+    def registry_parameters(self) -> dict:
+        return {
+            'device': self.registry.device,
+            'revisions': {
+                name: spec.revision
+                for name, spec in self.registry.specs.items()
+                if spec.revision
+            },
+            'backends': {
+                name: spec.backend
+                for name, spec in self.registry.specs.items()
+            },
+            'cache_dir': self.registry.cache_dir,
+            'memory_budget': self.registry.residency.budget,
+            'eviction': self.registry.residency.policy,
+            'snapshots': self.registry.snapshots,
+            'shared': self.registry.shared,
+            'latest_seconds': self.registry.latest_seconds,
+        }
+
+    async def start(self):
+        """Loads the models (in workers or in thread) and waits for them"""
+        loop = asyncio.get_running_loop()
+        if self.workers == 0:
+            await loop.run_in_executor(self.thread, self.registry.load)
+            await loop.run_in_executor(self.thread, self.registry.warm_up)
+            if self.chunker is not None:
+                await loop.run_in_executor(self.thread, self.chunker.load)
+            return
+        # models libraries do not support being forked once initialized
+        self.context = multiprocessing.get_context('spawn')
+        self.results = self.context.Queue()
+        self.ready_event = asyncio.Event()
+        self.tasks = [None] * self.workers
+        self.processes = [None] * self.workers
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+            self.in_flight[worker_id] = 0
+            self.restarts[worker_id] = 0
+        self.collector = asyncio.create_task(self.collect())
+        # a worker killed while loading (OOM, segfault) never reports
+        self.watcher = asyncio.create_task(self.watch())
+        await self.ready_event.wait()
+        if self.failure:
+            raise InferenceError(self.failure)
+
+    def spawn(self, worker_id: int):
+        """starts a worker, with a new queue : the old one may be corrupted"""
+        tasks = self.context.Queue()
+        process = self.context.Process(
+            target=worker_main,
+            args=(
+                worker_id,
+                self.registry_parameters(),
+                self.chunker.parameters() if self.chunker is not None else None,
+                tasks,
+                self.results,
+            ),
+            name='spotting-worker-{}'.format(worker_id),
+            daemon=True,
+        )
+        process.start()
+        self.tasks[worker_id] = tasks
+        self.processes[worker_id] = process
+        self.starting.add(worker_id)
+
+    async def watch(self):
+        """Respawns the workers which died, the failing ones after a backoff"""
+        while not self.stopping:
+            await asyncio.sleep(self.watch_seconds)
+            for worker_id, process in enumerate(self.processes):
+                if (
+                    self.stopping
+                    or process.is_alive()
+                    or worker_id in self.failed_workers
+                ):
+                    continue
+                if worker_id in self.starting: # died before being ready
+                    self.startup_failed(
+                        worker_id, 'exit code {}'.format(process.exitcode)
+                    )
+                    continue
+                if time.monotonic() < self.respawn_at.get(worker_id, 0):
+                    continue
+                self.respawn(worker_id, process.exitcode)
+
+    def respawn(self, worker_id: int, exitcode: Optional[int] = None):
+        self.restarts[worker_id] += 1
+        self.ready_workers.discard(worker_id)
+        blade_logger.error(
+            'spotting worker {} died (exit code {}), respawning'.format(
+                worker_id, exitcode
+            ),
+            extra={'logtest': {'executor': {'restarts': self.restarts}}}
+        )
+        self.spawn(worker_id)
+        for job_id, job in list(self.pending.items()):
+            if job.worker_id != worker_id:
+                continue
+            if job.attempts >= self.max_attempts:
+                del self.pending[job_id]
+                self.in_flight[worker_id] -= 1
+                if not job.future.done():
+                    job.future.set_exception(InferenceError(
+                        'the batch killed {} workers'.format(job.attempts)
+                    ))
+                continue
+            job.attempts += 1
+            # batches go to a ready worker, reloads stay on their worker
+            target = (
+                self.pick() if job.message[0] in ('tag', 'split') else worker_id
+            )
+            self.in_flight[worker_id] -= 1
+            self.in_flight[target] += 1
+            job.worker_id = target
+            self.tasks[target].put(job.message)
+
+    def startup_failed(self, worker_id: int, payload: str):
+        """a worker could not start, it's respawn is delayed or given up"""
+        if worker_id not in self.starting: # already counted (error & exit)
+            return
+        self.starting.discard(worker_id)
+        self.ready_workers.discard(worker_id)
+        if not self.ready_event.is_set(): # during `start`, which raises
+            self.failure = payload
+            self.ready_event.set()
+            return
+        failures = self.startup_failures.get(worker_id, 0) + 1
+        self.startup_failures[worker_id] = failures
+        if failures < self.max_startup_failures:
+            backoff = min(
+                self.max_backoff_seconds, self.watch_seconds * 2 ** failures
+            )
+            self.respawn_at[worker_id] = time.monotonic() + backoff
+            blade_logger.error(
+                'spotting worker {} could not start, respawn in {}s : {}'.format(
+                    worker_id, backoff, payload
+                )
+            )
+            return
+        self.failed_workers.add(worker_id)
+        self.failure = payload
+        blade_logger.error(
+            'spotting worker {} could not start {} times, given up : {}'.format(
+                worker_id, failures, payload
+            ),
+            extra={'logtest': {'executor': {'failed_workers': sorted(
+                self.failed_workers
+            )}}}
+        )
+        for job_id, job in list(self.pending.items()):
+            if job.worker_id != worker_id:
+                continue
+            del self.pending[job_id]
+            self.in_flight[worker_id] -= 1
+            if not job.future.done():
+                job.future.set_exception(InferenceError(payload))
+
+    def pick(self) -> int:
+        """worker for the next batch, among the ready ones if any"""
+        candidates = sorted(self.ready_workers) or [
+            worker_id for worker_id in range(self.workers)
+            if worker_id not in self.failed_workers
+        ]
+        if not candidates:
+            raise InferenceError(self.failure)
+        if self.dispatch == 'round_robin':
+            return candidates[next(self.turns) % len(candidates)]
+        return min(candidates, key=self.in_flight.get)
+
+    async def collect(self):
+        """Resolves the pending jobs with the results sent by the workers"""
+        loop = asyncio.get_running_loop()
+        while True:
+            kind, worker_id, job_id, payload = await loop.run_in_executor(
+                self.thread, self.results.get
+            )
+            if kind == 'stopped':
+                return
+            if kind == 'error' and job_id is None: # a worker could not start
+                self.startup_failed(worker_id, payload)
+                continue
+            if kind == 'ready':
+                self.workers_status[worker_id] = payload
+                # the cache keys on the commits the workers resolved
+                self.registry.resolved.update(payload.get('resolved', {}))
+                self.ready_workers.add(worker_id)
+                self.starting.discard(worker_id)
+                self.startup_failures[worker_id] = 0
+                if len(self.workers_status) == self.workers:
+                    self.registry.ready = True
+                    self.ready_event.set()
+            if job_id is None or job_id not in self.pending:
+                if kind == 'error':
+                    blade_logger.error(
+                        'spotting worker {} : {}'.format(worker_id, payload)
+                    )
+                continue
+            job = self.pending.pop(job_id)
+            self.in_flight[job.worker_id] -= 1
+            if job.future.done(): # cancelled
+                continue
+            if kind == 'error':
+                job.future.set_exception(InferenceError(payload))
+            else:
+                job.future.set_result(payload)
+
+    def submit(self, worker_id: int, kind: str, payload) -> asyncio.Future:
+        job_id = next(self.jobs)
+        future = asyncio.get_running_loop().create_future()
+        message = (kind, job_id, payload)
+        self.pending[job_id] = PendingJob(future, worker_id, message)
+        self.in_flight[worker_id] += 1
+        self.tasks[worker_id].put(message)
+        return future
+
+    async def tag(self, documents: list[str], configuration) -> list:
+        if self.workers == 0:
+            from .tag import tag
+            timings: dict[str, float] = {}
+            analysis = await asyncio.get_running_loop().run_in_executor(
+                self.thread,
+                tag, documents, self.registry, configuration, timings
+            )
+        else:
+            analysis, timings = await self.submit(
+                self.pick(), 'tag', (documents, configuration)
+            )
+        self.head_seconds = timings
+        blade_logger.info(
+            'tagged {} documents'.format(len(documents)),
+            extra={'logtest': {'head_seconds': timings}}
+        )
+        return analysis
+
+    async def split(self, texts: list[str]) -> list[list[str]]:
+        """chunks of every text (see Chunker.split), out of the loop"""
+        if self.workers == 0:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.thread, self.chunker.split, texts
+            )
+        chunks, segmentation_seconds = await self.submit(
+            self.pick(), 'split', texts
+        )
+        self.chunker.record(chunks, segmentation_seconds)
+        return chunks
+
+    async def reload(self, revisions: dict[str, str]) -> list[str]:
+        """Reloads the models which revision changed, in every worker"""
+        loop = asyncio.get_running_loop()
+        if self.workers == 0:
+            return await loop.run_in_executor(
+                self.thread, self.registry.reload, revisions
+            )
+        reloaded = self.registry.reload(revisions) # specs only
+        if reloaded:
+            await asyncio.gather(*[
+                self.submit(worker_id, 'reload', revisions)
+                for worker_id in range(self.workers)
+                if worker_id not in self.failed_workers
+            ])
+        return reloaded
+
+    async def stop(self):
+        self.stopping = True
+        if self.watcher is not None:
+            self.watcher.cancel()
+        for tasks in self.tasks:
+            if tasks is not None:
+                tasks.put(None)
+        if self.results is not None: # unblocks the collector
+            self.results.put(('stopped', None, None, None))
+        processes = [process for process in self.processes if process is not None]
+        # joins block, the loop keeps serving meanwhile
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(None, process.join, 5) for process in processes
+        ])
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        self.thread.shutdown(wait=False, cancel_futures=True)
+
+    def status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'workers': self.workers,
+            'dispatch': self.dispatch,
+            'ready_workers': sorted(self.ready_workers),
+            'restarts': self.restarts,
+            'startup_failures': self.startup_failures,
+            'failed_workers': sorted(self.failed_workers),
+            'failure': self.failure,
+            'in_flight': self.in_flight,
+            'workers_status': self.workers_status,
+            'head_seconds': self.head_seconds,
+        }
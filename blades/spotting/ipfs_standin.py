@@ -0,0 +1,65 @@
+"""
+# IPFS stand-in
+
+A local HTTP stand-in for the IPFS gateway used by the uploader, so the upload
+stage can be benchmarked offline :
+
+    POST /add           stores the (json) body, answers {"cid": ...}
+    GET  /ipfs/{cid}    the stored body
+
+Bodies are kept in memory (up to `--keep` of them), gzip bodies are inflated
+by aiohttp. `--latency` delays every response and `--failure-rate` answers 503
+to a share of the uploads, to benchmark the uploader's pipelining and retries.
+
+    python blades/spotting/ipfs_standin.py --port 8090 --latency 0.2
+"""
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from aiohttp import web
+
+
+def standin_app(
+    latency: float = 0.0, failure_rate: float = 0.0, keep: int = 1000
+) -> web.Application:
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    store: OrderedDict[str, bytes] = OrderedDict()
+
+    async def add(request):
+        body = await request.read()
+        await asyncio.sleep(latency)
+        if random.random() < failure_rate:
+            return web.Response(status=503)
+        cid = 'bafy' + hashlib.sha256(body).hexdigest()[:52]
+        store[cid] = body
+        while len(store) > keep:
+            store.popitem(last=False)
+        return web.json_response({'cid': cid})
+
+    async def get(request):
+        await asyncio.sleep(latency)
+        body = store.get(request.match_info['cid'])
+        if body is None:
+            return web.Response(status=404)
+        return web.Response(body=body, content_type='application/json')
+
+    app.router.add_post('/add', add)
+    app.router.add_get('/ipfs/{cid}', get)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local IPFS gateway stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--keep", type=int, default=1000)
+    args = parser.parse_args()
+    web.run_app(
+        standin_app(args.latency, args.failure_rate, args.keep),
+        host=args.host,
+        port=args.port,
+    )
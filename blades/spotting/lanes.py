@@ -0,0 +1,168 @@
+"""
+# Lanes
+
+A single FIFO lets one chatty scraper (eg: a high volume social module) fill
+every batch while the news scrapers wait. Waiting items are instead queued in
+one lane per source (scraper host, item domain) and batches are assembled
+from the lanes by weighted fair queuing :
+
+    lane  reddit.com   (w=1) : r1 r2 r3 r4 r5 r6 ...
+    lane  reuters.com  (w=4) : n1 n2
+                                         batch: r1 n1 n2 r2 r3 ...
+
+Each item gets a virtual finish tag (the lane's previous tag, or the queue's
+virtual time if later, plus 1 / weight) and batches take the smallest tags :
+a lane gets a share of the batches proportional to it's weight while it has
+items, an idle lane does not bank credit.
+
+Items are not decoded to find their lane : `/push` reads the domain from the
+`X-Item-Domain` header (sent by the scrapers) and `/push/bulk` from the items
+it already decodes (see bulk.py).
+
+A lane may not hold more than `max_share` of the admission budget, the next
+items of a lane over it's share are refused (429) while the other lanes are
+still admitted. Depth, rejections and queueing latency are reported per lane.
+"""
+import time
+import heapq
+from collections import deque
+from typing import Optional
+
+REPLAY = ('', 'replay') # lane of the items replayed from the spool
+RETRY = ('', 'retry') # lane of the items of failed batches
+
+
+DOMAIN_HEADER = 'X-Item-Domain' # of the item pushed on `/push`
+
+
+def item_domain(data) -> str:
+    """domain of a decoded item, '' when it has none"""
+    item = data.get('item', data) if isinstance(data, dict) else None
+    return str(item.get('domain', '') or '') if isinstance(item, dict) else ''
+
+
+def lane_key(host: Optional[str], domain: Optional[str]) -> tuple[str, str]:
+    """(scraper host, item domain) of a pushed item"""
+    return (host or '', domain or '')
+
+
+class Lane:
+    def __init__(self, key: tuple[str, str], weight: float):
+        self.key = key
+        self.weight = weight
+        self.items: deque = deque() # (tag, item, size, enqueued_at)
+        self.finish = 0.0 # tag of the last item pushed
+        self.pushed = 0
+        self.served = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.active = time.monotonic()
+
+    def status(self) -> dict:
+        return {
+            'weight': self.weight,
+            'depth': len(self.items),
+            'pushed': self.pushed,
+            'served': self.served,
+            'rejected': self.rejected,
+            'mean_wait': (
+                round(self.wait_total / self.served, 4) if self.served else None
+            ),
+            'max_wait': round(self.wait_max, 4),
+        }
+
+
+class FairQueue:
+    def __init__(
+        self,
+        weights: Optional[dict[str, float]] = None, # by domain or host
+        default_weight: float = 1.0,
+        max_share: float = 1.0,
+        idle_seconds: float = 600,
+    ):
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.max_share = max_share
+        self.idle_seconds = idle_seconds
+        self.lanes: dict[tuple[str, str], Lane] = {}
+        self.heads: list = [] # (tag, key) of the first item of each lane
+        self.virtual_time = 0.0
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def lane(self, key: tuple[str, str]) -> Lane:
+        if key not in self.lanes:
+            host, domain = key
+            weight = self.weights.get(
+                domain, self.weights.get(host, self.default_weight)
+            )
+            self.lanes[key] = Lane(key, max(weight, 1e-3))
+        return self.lanes[key]
+
+    def over_share(self, key: tuple[str, str], max_items: int) -> bool:
+        lane = self.lanes.get(key, None)
+        if lane is None or self.max_share >= 1:
+            return False
+        if len(lane.items) + 1 > self.max_share * max_items:
+            lane.rejected += 1
+            return True
+        return False
+
+    def push(self, key: tuple[str, str], item, size: int):
+        lane = self.lane(key)
+        now = time.monotonic()
+        lane.finish = max(lane.finish, self.virtual_time) + 1 / lane.weight
+        if not lane.items:
+            heapq.heappush(self.heads, (lane.finish, key))
+        lane.items.append((lane.finish, item, size, now))
+        lane.pushed += 1
+        lane.active = now
+        self.length += 1
+
+    def oldest(self) -> Optional[float]:
+        """enqueue time of the oldest waiting item"""
+        return min(
+            (lane.items[0][3] for lane in self.lanes.values() if lane.items),
+            default=None
+        )
+
+    def pop(self, count: int) -> list[tuple]:
+        """up to `count` (item, size, enqueued_at) by smallest finish tag"""
+        now = time.monotonic()
+        result = []
+        while self.heads and len(result) < count:
+            tag, key = heapq.heappop(self.heads)
+            lane = self.lanes[key]
+            __tag__, item, size, enqueued_at = lane.items.popleft()
+            self.virtual_time = tag
+            wait = now - enqueued_at
+            lane.served += 1
+            lane.wait_total += wait
+            lane.wait_max = max(lane.wait_max, wait)
+            if lane.items:
+                heapq.heappush(self.heads, (lane.items[0][0], key))
+            result.append((item, size, enqueued_at))
+        self.length -= len(result)
+        self.prune(now)
+        return result
+
+    def prune(self, now: float):
+        """forgets the lanes idle for `idle_seconds`"""
+        for key in [
+            key for key, lane in self.lanes.items()
+            if not lane.items and now - lane.active > self.idle_seconds
+        ]:
+            del self.lanes[key]
+
+    def status(self) -> dict:
+        return {
+            'max_share': self.max_share,
+            'waiting': self.length,
+            'lanes': {
+                '{}/{}'.format(*key): lane.status()
+                for key, lane in self.lanes.items()
+            },
+        }
@@ -0,0 +1,204 @@
+"""
+# Columnar merge
+
+Items longer than the models inputs are analyzed in several chunks which are
+merged back into one `ProcessedItem` (see `process_batch.merge_chunks` for the
+rules, which this module implements identically).
+
+Instead of building lists and calling `np.median` per field and per item, the
+chunks of every item of a batch are packed in one matrix per analysis group
+(emotion, text_type, age...) and the grouped medians are computed for all the
+items at once :
+
+    chunks (sorted by item) ──> matrix (n_chunks, n_fields)
+                                 └─> sort each column inside it's item
+                                      └─> middle value(s) of each item
+
+The embedding of a merged item is the chunk's embedding closest to the median
+of the item's embeddings.
+"""
+import logging
+import numpy as np
+from collections import Counter
+from exorde.models import (
+    ProcessedItem,
+    ProtocolAnalysis,
+    Classification,
+    Keywords,
+    LanguageScore,
+    Sentiment,
+    Embedding,
+    SourceType,
+    TextType,
+    Emotion,
+    Irony,
+    Age,
+    Gender,
+)
+
+# analysis group: (type, fields), fields are None for scalar groups
+GROUPS: dict[str, tuple[type, tuple[str, ...]]] = {
+    "gender": (Gender, ("male", "female")),
+    "sentiment": (Sentiment, None),
+    "text_type": (TextType, (
+        "assumption", "anecdote", "none", "definition", "testimony", "other",
+        "study",
+    )),
+    "emotion": (Emotion, (
+        "love", "admiration", "joy", "approval", "caring", "excitement",
+        "gratitude", "desire", "anger", "optimism", "disapproval", "grief",
+        "annoyance", "pride", "curiosity", "neutral", "disgust",
+        "disappointment", "realization", "fear", "relief", "confusion",
+        "remorse", "embarrassment", "surprise", "sadness", "nervousness",
+    )),
+    "language_score": (LanguageScore, None),
+    "irony": (Irony, ("irony", "non_irony")),
+    "age": (Age, (
+        "below_twenty", "twenty_thirty", "thirty_forty", "forty_more",
+    )),
+}
+
+
+def Most_Common(lst):
+    data = Counter(lst)
+    return data.most_common(1)[0][0]
+
+
+def grouped_median(
+    matrix: np.ndarray, groups: np.ndarray, starts: np.ndarray, counts: np.ndarray
+) -> np.ndarray:
+    """
+    Median of each column of `matrix` for each group of rows. Rows of a group
+    are contiguous, `groups` is the (sorted) group of each row.
+    Returns a (n_groups, n_columns) matrix, equal to `np.median` per group.
+    """
+    order = np.argsort(matrix, axis=0, kind='stable')
+    # stable sort by group keeps the values sorted inside each group
+    order = np.take_along_axis(
+        order,
+        np.argsort(groups[order], axis=0, kind='stable'),
+        axis=0
+    )
+    ordered = np.take_along_axis(matrix, order, axis=0)
+    upper = ordered[starts + counts // 2]
+    lower = ordered[starts + (counts - 1) // 2]
+    odd = (counts % 2 == 1)[:, None]
+    return np.where(odd, upper, (lower + upper) / 2)
+
+
+def closest_to_centroid(
+    embeddings: np.ndarray,
+    groups: np.ndarray,
+    starts: np.ndarray,
+    counts: np.ndarray
+) -> np.ndarray:
+    """index (in rows) of the first embedding closest to it's group median"""
+    centroids = grouped_median(embeddings, groups, starts, counts)
+    differences = embeddings - centroids[groups]
+    # row by row like the 1-D np.linalg.norm (sqrt of a dot) of merge_chunks :
+    # the axis=1 norm sums in another order and equidistant chunks (eg: any 2
+    # chunks) would tie differently
+    distances = np.sqrt(np.array(
+        [row.dot(row) for row in differences], dtype=np.float64
+    ))
+    minimums = np.minimum.reduceat(distances, starts)
+    candidates = np.where(
+        distances == minimums[groups], np.arange(len(distances)), len(distances)
+    )
+    return np.minimum.reduceat(candidates, starts)
+
+
+def pack(chunks: list[ProcessedItem], group: str) -> np.ndarray:
+    __type__, fields = GROUPS[group]
+    if fields is None:
+        return np.array(
+            [[getattr(chunk.analysis, group)] for chunk in chunks],
+            dtype=np.float64
+        )
+    return np.array([
+        [getattr(chunk.analysis, group)[field] for field in fields]
+        for chunk in chunks
+    ], dtype=np.float64)
+
+
+def unpack(group: str, row: np.ndarray):
+    group_type, fields = GROUPS[group]
+    if fields is None:
+        return group_type(row[0])
+    return group_type(**{field: row[i] for i, field in enumerate(fields)})
+
+
+def merge_all(items: list[list[ProcessedItem]]) -> list[ProcessedItem]:
+    """
+    Merges the chunks of every item of a batch, single chunk items are
+    returned as they are.
+    """
+    multi = [chunks for chunks in items if len(chunks) > 1]
+    if not multi:
+        return [chunks[0] for chunks in items]
+    try:
+        merged = iter(merge_multi(multi))
+    except Exception as e:
+        logging.exception(f"[Merging items chunks] ERROR:\n {e}")
+        raise(e)
+    return [
+        next(merged) if len(chunks) > 1 else chunks[0] for chunks in items
+    ]
+
+
+def merge_multi(multi: list[list[ProcessedItem]]) -> list[ProcessedItem]:
+    logging.info(
+        f"[Item merging] Merging {sum(len(item) for item in multi)} chunks "
+        f"of {len(multi)} items."
+    )
+    chunks: list[ProcessedItem] = [chunk for item in multi for chunk in item]
+    counts = np.array([len(item) for item in multi])
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    groups = np.repeat(np.arange(len(multi)), counts)
+
+    medians: dict[str, np.ndarray] = {
+        group: grouped_median(pack(chunks, group), groups, starts, counts)
+        for group in GROUPS
+    }
+    closest = closest_to_centroid(
+        np.array(
+            [chunk.analysis.embedding for chunk in chunks], dtype=np.float64
+        ),
+        groups, starts, counts
+    )
+
+    merged: list[ProcessedItem] = []
+    for index, item in enumerate(multi):
+        categories = [chunk.analysis.classification for chunk in item]
+        top_keywords_aggregated = list()
+        for chunk in item:
+            top_keywords_aggregated.extend(chunk.analysis.top_keywords)
+        merged.append(ProcessedItem(
+            item=item[0].item,
+            analysis=ProtocolAnalysis(
+                classification=Classification(
+                    label=Most_Common([x.label for x in categories]),
+                    score=max([x.score for x in categories]),
+                ),
+                top_keywords=Keywords(list(set(top_keywords_aggregated))),
+                language_score=unpack(
+                    "language_score", medians["language_score"][index]
+                ),
+                gender=unpack("gender", medians["gender"][index]),
+                sentiment=unpack("sentiment", medians["sentiment"][index]),
+                embedding=Embedding(
+                    chunks[closest[index]].analysis.embedding
+                ),
+                source_type=SourceType(
+                    Most_Common([chunk.analysis.source_type for chunk in item])
+                ),
+                text_type=unpack("text_type", medians["text_type"][index]),
+                emotion=unpack("emotion", medians["emotion"][index]),
+                irony=unpack("irony", medians["irony"][index]),
+                age=unpack("age", medians["age"][index]),
+            ),
+            collection_client_version=item[0].collection_client_version,
+            collection_module=item[0].collection_module,
+            collected_at=item[0].collected_at,
+        ))
+    return merged
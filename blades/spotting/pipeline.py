@@ -0,0 +1,127 @@
+"""
+# Pipeline
+
+A pipeline is a chain of stages connected by bounded queues :
+
+    submit ──> [queue] stage 1 (N tasks) ──> [queue] stage 2 (M tasks) ──> ...
+
+Each stage runs `concurrency` tasks reading it's queue, so a slow stage (eg:
+upload) only holds it's own tasks while the others keep working on the next
+batches. Queues are bounded : when a stage is saturated the stages before it
+wait to hand over their result, up to `submit`.
+
+`await pipeline.process(payload)` returns the result of the last stage (or
+raises the exception of the stage that failed). Each stage reports it's queue
+depth and it's latencies.
+"""
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from .batcher import Histogram
+
+blade_logger = logging.getLogger('blade')
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[Any], Any]
+    concurrency: int = 1
+    queue_size: int = 2
+    blocking: bool = False # `run` is synchronous and runs in a thread
+
+
+class StageMetrics:
+    def __init__(self):
+        self.running = 0
+        self.processed = 0
+        self.errors = 0
+        self.last_latency: Optional[float] = None
+        self.latencies = Histogram([0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60])
+
+
+class Pipeline:
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+        self.queues: list[asyncio.Queue] = []
+        self.tasks: list[asyncio.Task] = []
+        self.metrics: dict[str, StageMetrics] = {
+            stage.name: StageMetrics() for stage in stages
+        }
+
+    def start(self):
+        self.queues = [
+            asyncio.Queue(maxsize=stage.queue_size) for stage in self.stages
+        ]
+        for index, stage in enumerate(self.stages):
+            for __i__ in range(max(1, stage.concurrency)):
+                self.tasks.append(asyncio.create_task(self.work(index)))
+
+    async def process(self, payload) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[0].put((payload, future))
+        return await future
+
+    async def execute(self, stage: Stage, payload) -> Any:
+        if stage.blocking:
+            return await asyncio.to_thread(stage.run, payload)
+        return await stage.run(payload)
+
+    async def work(self, index: int):
+        stage = self.stages[index]
+        metrics = self.metrics[stage.name]
+        queue = self.queues[index]
+        while True:
+            payload, future = await queue.get()
+            if future.done(): # cancelled by the caller
+                continue
+            metrics.running += 1
+            start = time.monotonic()
+            try:
+                result = await self.execute(stage, payload)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as error:
+                metrics.errors += 1
+                blade_logger.exception('stage {} failed'.format(stage.name))
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            finally:
+                metrics.running -= 1
+            metrics.last_latency = time.monotonic() - start
+            metrics.latencies.observe(metrics.last_latency)
+            metrics.processed += 1
+            if index + 1 == len(self.stages):
+                if not future.done():
+                    future.set_result(result)
+            else: # waits when the next stage is saturated
+                await self.queues[index + 1].put((result, future))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def status(self) -> dict:
+        return {
+            stage.name: {
+                'concurrency': stage.concurrency,
+                'depth': self.queues[index].qsize() if self.queues else 0,
+                'running': self.metrics[stage.name].running,
+                'processed': self.metrics[stage.name].processed,
+                'errors': self.metrics[stage.name].errors,
+                'last_latency': (
+                    round(self.metrics[stage.name].last_latency, 4)
+                    if self.metrics[stage.name].last_latency is not None
+                    else None
+                ),
+                'latencies': self.metrics[stage.name].latencies.status(),
+            }
+            for index, stage in enumerate(self.stages)
+        }
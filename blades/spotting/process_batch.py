@@ -1,6 +1,7 @@
 import logging
 from importlib import metadata
 from datetime import datetime
+from typing import Optional
 import numpy as np
 from exorde.models import (
     Domain,
@@ -29,16 +30,17 @@ from exorde.models import (
 )
 from exorde_data import Url
 
-from .tag import tag
-from collections import Counter
-
-
-def Most_Common(lst):
-    data = Counter(lst)
-    return data.most_common(1)[0][0]
+from .tag import InferenceConfiguration
+from .cache import AnalysisCache, tag_with_cache
+from .executor import InferenceExecutor
+from .merge import Most_Common, merge_all
 
 
 def merge_chunks(chunks: list[ProcessedItem]) -> ProcessedItem:
+    """
+    Merges the chunks of one item, batches are merged by `merge.merge_all`
+    which is equivalent and vectorized over all the items.
+    """
     try:
         ## Check if chunks is a list of 1 item, if so, just return it as is
         if len(chunks) == 1:
@@ -220,15 +222,10 @@ def get_source_type(item: ProtocolItem) -> SourceType:
     return SourceType("news")
 
 
-async def process_batch(
-    batch: list[tuple[int, Processed]], static_configuration
-) -> Batch:
-    lab_configuration: dict = static_configuration["lab_configuration"]
-    logging.info(f"running batch for {len(batch)}")
-    analysis_results: list[Analysis] = tag(
-        [processed.translation.translation for (__id__, processed) in batch],
-        lab_configuration,
-    )
+def processed_items(
+    batch: list[tuple[int, Processed]], analysis_results: list[Analysis]
+) -> dict[int, list[ProcessedItem]]:
+    """ProcessedItem of every chunk, grouped by item id"""
     complete_processes: dict[int, list[ProcessedItem]] = {}
     for (id, processed), analysis in zip(batch, analysis_results):
         prot_item: ProtocolItem = ProtocolItem(
@@ -274,10 +271,37 @@ async def process_batch(
         if not complete_processes.get(id, {}):
             complete_processes[id] = []
         complete_processes[id].append(completed)
-    aggregated = []
-    for __key__, values in complete_processes.items():
-        merged_ = merge_chunks(values)
-        if merged_ is not None:
-            aggregated.append(merged_)
+    return complete_processes
+
+
+def merge_batch(complete_processes: dict[int, list[ProcessedItem]]) -> Batch:
+    aggregated = merge_all(list(complete_processes.values()))
     result_batch: Batch = Batch(items=aggregated, kind=BatchKindEnum.SPOTTING)
     return result_batch
+
+
+async def tag_batch(
+    batch: list[tuple[int, Processed]],
+    executor: InferenceExecutor,
+    configuration: Optional[InferenceConfiguration] = None,
+    cache: Optional[AnalysisCache] = None
+) -> list[Analysis]:
+    logging.info(f"running batch for {len(batch)}")
+    # only cache misses are sent to `tag`, which runs out of the loop
+    return await tag_with_cache(
+        [processed.translation.translation for (__id__, processed) in batch],
+        executor,
+        configuration,
+        cache,
+    )
+
+
+async def process_batch(
+    batch: list[tuple[int, Processed]],
+    executor: InferenceExecutor,
+    configuration: Optional[InferenceConfiguration] = None,
+    cache: Optional[AnalysisCache] = None
+) -> Batch:
+    """tag, build & merge in one go, the pipeline runs them as stages"""
+    analysis_results = await tag_batch(batch, executor, configuration, cache)
+    return merge_batch(processed_items(batch, analysis_results))
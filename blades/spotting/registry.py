@@ -0,0 +1,427 @@
+"""
+# Model registry
+
+The spotting blade uses a dozen of models (transformers pipelines, a sentence
+encoder, keras heads and the VADER lexicons). Building them is more expensive
+than running them on a small batch so they are loaded once per process and
+kept resident in the registry.
+
+    on_startup -> registry.load() -> registry.warm_up() -> ready
+    tag()      -> registry.get(name)
+
+With a `memory_budget` only the models fitting in the budget are kept
+resident, the others are loaded on demand by `get` (see residency.py). With
+`shared` the weights are mapped from a store shared by the processes of the
+host (see shared_weights.py).
+
+Models are described by `ModelSpec`, the `revision` of a spec is its version.
+When the orchestrator sends new revisions (see spotting intent) the registry
+reloads the changed models in place: the new model is built next to the old
+one and swapped once ready so batches in flight are never left without model.
+"""
+import gc
+import os
+import json
+import time
+import importlib
+import hashlib
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Optional, Union
+
+from . import backends
+from .backends import BACKENDS, DEFAULT_CACHE_DIRECTORY, UnknownBackend
+from .residency import MB, Residency, resident_bytes
+from .snapshots import (
+    SAVERS, hub_file, resolve_latest, save_snapshot, snapshot_directory
+)
+from . import shared_weights
+
+blade_logger = logging.getLogger('blade')
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    name: str                       # key used by `tag`
+    repo_id: str                    # hugging face repository
+    kind: str                       # which loader builds it (see LOADERS)
+    filename: Optional[str] = None  # for single-file models (keras heads)
+    revision: Optional[str] = None  # version, None means latest
+    backend: str = 'torch'          # inference backend (see backends.py)
+    footprint: int = 100 * MB       # approximate RAM once loaded
+
+
+SPOTTING_MODELS: list[ModelSpec] = [
+    ModelSpec(
+        "Embedding", "sentence-transformers/all-MiniLM-L6-v2",
+        "sentence_transformer", footprint=120 * MB
+    ),
+    ModelSpec(
+        "Emotion", "SamLowe/roberta-base-go_emotions", "text-classification",
+        footprint=550 * MB
+    ),
+    ModelSpec(
+        "Irony", "cardiffnlp/twitter-roberta-base-irony", "text-classification",
+        footprint=550 * MB
+    ),
+    ModelSpec(
+        "LanguageScore", "salesken/query_wellformedness_score",
+        "text-classification", footprint=550 * MB
+    ),
+    ModelSpec(
+        "TextType", "marieke93/MiniLM-evidence-types", "text-classification",
+        footprint=150 * MB
+    ),
+    ModelSpec( # financial distilroberta
+        "fdb",
+        "mrm8488/distilroberta-finetuned-financial-news-sentiment-analysis",
+        "text-classification", footprint=350 * MB
+    ),
+    ModelSpec( # distilbert sentiment
+        "gdb", "lxyuan/distilbert-base-multilingual-cased-sentiments-student",
+        "text-classification", footprint=580 * MB
+    ),
+    ModelSpec(
+        "vader", "ExordeLabs/SentimentDetection", "vader", footprint=20 * MB
+    ),
+    ModelSpec(
+        "tokenizer", "bert-large-uncased", "tokenizer", footprint=10 * MB
+    ),
+    ModelSpec(
+        "Age", "ExordeLabs/AgeDetection", "keras", "ageDetection.h5",
+        footprint=60 * MB
+    ),
+    ModelSpec(
+        "Gender", "ExordeLabs/GenderDetection", "keras", "genderDetection.h5",
+        footprint=60 * MB
+    ),
+]
+
+# labels of the custom keras heads, by output index
+MAPPINGS: dict[str, dict[int, str]] = {
+    "Gender": {0: "Female", 1: "Male"},
+    "Age": {0: "<20", 1: "20<30", 2: "30<40", 3: ">=40"},
+}
+
+
+class ModelRegistryNotReady(Exception):
+    """
+    A model has been requested before the registry was loaded. `tag` should
+    never be called before `on_startup` completed the registry's warm-up.
+    """
+
+
+"""
+Loaders build one model from it's spec. Imports are done in the loaders so
+that the registry can be imported without the heavy dependencies.
+"""
+def load_sentence_transformer(spec: ModelSpec, registry):
+    if spec.backend != 'torch':
+        return backends.onnx_sentence_encoder(
+            spec, registry.cache_dir, spec.backend
+        )
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(spec.repo_id, revision=spec.revision)
+
+
+def load_text_classification(spec: ModelSpec, registry):
+    if spec.backend != 'torch':
+        return backends.onnx_text_classification(
+            spec, registry.cache_dir, spec.backend
+        )
+    from transformers import pipeline
+    return pipeline(
+        "text-classification",
+        model=spec.repo_id,
+        revision=spec.revision,
+        top_k=None,
+        device=registry.device,
+        max_length=512,
+        padding=True,
+    )
+
+
+def load_tokenizer(spec: ModelSpec, registry):
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(spec.repo_id, revision=spec.revision)
+
+
+def load_vader(spec: ModelSpec, registry):
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    emoji_lexicon = hub_file(
+        spec, "emoji_unic_lexicon.json", registry.cache_dir, registry.snapshots
+    )
+    loughran_dict = hub_file(
+        spec, "loughran_dict.json", registry.cache_dir, registry.snapshots
+    )
+    with open(emoji_lexicon) as f:
+        unic_emoji_dict = json.load(f)
+    with open(loughran_dict) as f:
+        Loughran_dict = json.load(f)
+    sentiment_analyzer = SentimentIntensityAnalyzer()
+    sentiment_analyzer.lexicon.update(Loughran_dict)
+    sentiment_analyzer.lexicon.update(unic_emoji_dict)
+    return sentiment_analyzer
+
+
+def load_keras(spec: ModelSpec, registry):
+    import tensorflow as tf
+    from .keras_layers import TokenAndPositionEmbedding, TransformerBlock
+    model_file = hub_file(
+        spec, spec.filename, registry.cache_dir, registry.snapshots
+    )
+    return tf.keras.models.load_model(
+        model_file,
+        custom_objects={
+            "TokenAndPositionEmbedding": TokenAndPositionEmbedding,
+            "TransformerBlock": TransformerBlock,
+        },
+    )
+
+
+# imported (and timed) before the models are loaded
+LIBRARIES = {
+    "sentence_transformer": ("torch", "sentence_transformers"),
+    "text-classification": ("torch", "transformers"),
+    "tokenizer": ("transformers",),
+    "vader": ("vaderSentiment.vaderSentiment",),
+    "keras": ("tensorflow",),
+}
+
+
+LOADERS = {
+    "sentence_transformer": load_sentence_transformer,
+    "text-classification": load_text_classification,
+    "tokenizer": load_tokenizer,
+    "vader": load_vader,
+    "keras": load_keras,
+}
+
+
+class ModelRegistry:
+    """
+    Holds every model used by `tag`.
+
+    The registry is filled by the blade's `on_startup` and is then read-only
+    for `tag` ; only `reload` replaces models, one reference at a time. With a
+    `memory_budget` (bytes) `get` also loads and evicts models on demand.
+    """
+    def __init__(
+        self,
+        specs: list[ModelSpec] = SPOTTING_MODELS,
+        device: Union[int, str] = -1,
+        revisions: Optional[dict[str, str]] = None,
+        backends: Optional[dict[str, str]] = None,
+        cache_dir: str = DEFAULT_CACHE_DIRECTORY,
+        memory_budget: Optional[int] = None,
+        eviction: str = 'lru',
+        snapshots: bool = True,
+        shared: bool = False,
+        latest_seconds: float = 24 * 60 * 60,
+    ):
+        revisions = revisions or {}
+        backends = backends or {}
+        for name, backend in backends.items():
+            if backend not in BACKENDS:
+                raise UnknownBackend('{}: {}'.format(name, backend))
+        self.specs: dict[str, ModelSpec] = {
+            spec.name: replace(
+                spec,
+                revision=revisions.get(spec.name, None),
+                backend=backends.get(spec.name, spec.backend),
+            )
+            for spec in specs
+        }
+        self.device = device
+        self.cache_dir = cache_dir
+        self.snapshots = snapshots
+        self.shared = shared # weights mapped from the shared store
+        self.latest_seconds = latest_seconds # models without revision
+        self.mappings = MAPPINGS
+        self.models: dict[str, Any] = {}
+        self.ready: bool = False
+        self.load_seconds: dict[str, float] = {}
+        self.import_seconds: dict[str, float] = {}
+        self.sources: dict[str, str] = {} # hub | snapshot
+        self.resolved: dict[str, str] = {} # commit of the models without revision
+        self.shared_bytes: dict[str, int] = {}
+        self.warm_up_seconds: Optional[float] = None
+        self.residency = Residency(memory_budget, eviction)
+        self._lock = threading.Lock() # reload & load are not concurrent
+
+    def import_libraries(self):
+        """imports the libraries of the models, timed for the startup report"""
+        modules = sorted({
+            module for spec in self.specs.values()
+            for module in LIBRARIES.get(spec.kind, ())
+        })
+        for module in modules:
+            if module in self.import_seconds:
+                continue
+            start = time.monotonic()
+            importlib.import_module(module)
+            self.import_seconds[module] = round(time.monotonic() - start, 3)
+
+    def _load_one(self, spec: ModelSpec):
+        start = time.monotonic()
+        if spec.revision is None: # pinned, it's snapshot & exports by commit
+            spec = resolve_latest(spec, self.cache_dir, self.latest_seconds)
+            if spec.revision is not None:
+                self.resolved[spec.name] = spec.revision
+        snapshot = (
+            self.snapshots and spec.backend == 'torch' and spec.kind in SAVERS
+        )
+        directory = snapshot_directory(spec, self.cache_dir)
+        if snapshot and os.path.isdir(directory):
+            model = LOADERS[spec.kind](
+                replace(spec, repo_id=directory, revision=None), self
+            )
+            self.sources[spec.name] = 'snapshot'
+        else:
+            model = LOADERS[spec.kind](spec, self)
+            self.sources[spec.name] = 'hub'
+            if snapshot:
+                save_snapshot(spec, model, self.cache_dir)
+        if self.shared and spec.backend == 'torch':
+            try:
+                self.shared_bytes[spec.name] = shared_weights.share(
+                    spec, model, self.cache_dir
+                )
+            except Exception: # keeps it's private weights
+                blade_logger.exception('could not share {}'.format(spec.name))
+        self.load_seconds[spec.name] = round(time.monotonic() - start, 3)
+        blade_logger.info('loaded {} ({}, {}) from {} in {}s'.format(
+            spec.name,
+            spec.revision or 'latest',
+            spec.backend,
+            self.sources[spec.name],
+            self.load_seconds[spec.name]
+        ))
+        return model
+
+    def _make_resident(self, spec: ModelSpec):
+        """evicts models until `spec` fits in the budget, then loads it"""
+        victims = self.residency.victims(spec.footprint)
+        for name in victims:
+            del self.models[name] # heads using it keep their reference
+            self.residency.evict(name)
+        if victims:
+            gc.collect()
+        before = resident_bytes()
+        model = self._load_one(spec)
+        after = resident_bytes()
+        measured = after - before if before is not None and after is not None else 0
+        self.models[spec.name] = model
+        self.residency.admit(
+            spec.name,
+            max(spec.footprint, measured),
+            self.load_seconds.get(spec.name, 0.0)
+        )
+        return model
+
+    def load(self):
+        """
+        Blocking, loads every model that is not already loaded and fits in
+        the memory budget, the others will be loaded on demand.
+        """
+        self.import_libraries()
+        with self._lock:
+            for name, spec in self.specs.items():
+                if name not in self.models and self.residency.fits(spec.footprint):
+                    self._make_resident(spec)
+
+    def warm_up(self):
+        """
+        Runs a dummy document trough `tag` so lazy initializations (graph
+        tracing, tokenizers caches, thread pools) are not paid by the first
+        batch. Marks the registry as ready.
+        """
+        from .tag import tag
+        start = time.monotonic()
+        tag(["Exorde spotting warm-up."], self)
+        self.warm_up_seconds = round(time.monotonic() - start, 3)
+        self.ready = True
+        blade_logger.info(
+            'model registry is ready (warm-up {}s)'.format(self.warm_up_seconds)
+        )
+
+    def finvader(self):
+        """finvader's scorer, a function of the package rather than a model"""
+        from finvader import finvader
+        return finvader
+
+    def get(self, name: str):
+        try:
+            model = self.models[name]
+            self.residency.touch(name)
+            return model
+        except KeyError:
+            if self.residency.budget is None or name not in self.specs:
+                raise ModelRegistryNotReady(name)
+        with self._lock:
+            if name in self.models: # loaded by a concurrent head
+                self.residency.touch(name)
+                return self.models[name]
+            return self._make_resident(self.specs[name])
+
+    def reload(self, revisions: dict[str, str]) -> list[str]:
+        """
+        Reloads models for which `revisions` differ from the loaded ones and
+        returns their names. Old models keep serving until the swap.
+
+        A registry that holds no model (eg: the front process when inference
+        runs in workers, see executor.py) only updates it's specs.
+        """
+        with self._lock:
+            changed: list[ModelSpec] = [
+                replace(spec, revision=revisions[name])
+                for name, spec in self.specs.items()
+                if name in revisions and revisions[name] != spec.revision
+            ]
+            if not changed:
+                return []
+            for spec in changed:
+                if spec.name in self.models:
+                    model = self._load_one(spec)
+                    # swap, in-flight batches keep their reference to the old one
+                    self.models[spec.name] = model
+                self.specs[spec.name] = spec
+        if self.models:
+            self.warm_up()
+        return [spec.name for spec in changed]
+
+    @property
+    def version(self) -> str:
+        """
+        identifies the model set, changes when a model is reloaded or when a
+        model without revision resolves to a new commit
+        """
+        return hashlib.sha256(json.dumps(sorted(
+            [
+                spec.name, spec.repo_id,
+                spec.revision or self.resolved.get(spec.name, ''), spec.backend
+            ]
+            for spec in self.specs.values()
+        )).encode('utf-8')).hexdigest()[:16]
+
+    def status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'version': self.version,
+            'models': {
+                name: spec.revision or 'latest'
+                for name, spec in self.specs.items()
+            },
+            'backends': {
+                name: spec.backend for name, spec in self.specs.items()
+            },
+            'loaded': list(self.models.keys()),
+            'load_seconds': self.load_seconds,
+            'import_seconds': self.import_seconds,
+            'sources': self.sources,
+            'resolved': self.resolved,
+            'shared_bytes': self.shared_bytes,
+            'warm_up_seconds': self.warm_up_seconds,
+            'residency': self.residency.status(),
+        }
@@ -0,0 +1,121 @@
+"""
+# Model residency
+
+By default every model stays resident in the registry (a bit more than 3GB
+of RAM for the spotting models). With a `memory_budget` the registry keeps as
+many models as fit in the budget and loads the others on demand, evicting
+resident ones when needed :
+
+    get(name) -> resident ? -> touch, return
+              -> load it, evict until it fits (lru | cost), return
+
+    lru  : evicts the least recently used model
+    cost : evicts the model which is the cheapest to reload per byte freed
+           (load seconds / footprint), the least recently used on a tie
+
+A model's footprint is the estimate of it's spec or, when larger, the growth
+of the process RSS measured while loading it. An evicted model is only freed
+once the heads still running with it are done : the budget can be exceeded
+for the duration of a batch.
+"""
+import os
+import time
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+blade_logger = logging.getLogger('blade')
+
+MB = 1024 * 1024
+EVICTION_POLICIES = ('lru', 'cost')
+
+
+class UnknownEvictionPolicy(Exception):
+    """The eviction policy is not one of `EVICTION_POLICIES`"""
+
+
+def resident_bytes() -> Optional[int]:
+    """RSS of the process, None when it can't be read (non-linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@dataclass
+class Resident:
+    footprint: int          # bytes
+    load_seconds: float
+    last_used: float
+
+
+class Residency:
+    def __init__(self, budget: Optional[int] = None, policy: str = 'lru'):
+        if policy not in EVICTION_POLICIES:
+            raise UnknownEvictionPolicy(policy)
+        self.budget = budget # bytes, None keeps every model resident
+        self.policy = policy
+        self.residents: dict[str, Resident] = {}
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def used(self) -> int:
+        return sum(resident.footprint for resident in self.residents.values())
+
+    def fits(self, footprint: int) -> bool:
+        return self.budget is None or self.used + footprint <= self.budget
+
+    def touch(self, name: str):
+        resident = self.residents.get(name, None)
+        if resident is not None:
+            resident.last_used = time.monotonic()
+
+    def admit(self, name: str, footprint: int, load_seconds: float):
+        self.residents[name] = Resident(footprint, load_seconds, time.monotonic())
+        self.loads += 1
+
+    def victims(self, footprint: int, keep: tuple[str, ...] = ()) -> list[str]:
+        """residents to evict, in order, so that `footprint` more bytes fit"""
+        if self.budget is None:
+            return []
+        if self.policy == 'lru':
+            key = lambda name: self.residents[name].last_used
+        else:
+            key = lambda name: (
+                self.residents[name].load_seconds
+                / max(1, self.residents[name].footprint),
+                self.residents[name].last_used
+            )
+        result = []
+        available = self.budget - self.used
+        for name in sorted(
+            [name for name in self.residents if name not in keep], key=key
+        ):
+            if available >= footprint:
+                break
+            result.append(name)
+            available += self.residents[name].footprint
+        return result
+
+    def evict(self, name: str):
+        resident = self.residents.pop(name)
+        self.evictions += 1
+        blade_logger.info(
+            'evicted {} ({}MB)'.format(name, resident.footprint // MB),
+            extra={'logtest': {'residency': {'evictions': self.evictions}}}
+        )
+
+    def status(self) -> dict:
+        return {
+            'budget_bytes': self.budget,
+            'policy': self.policy,
+            'used_bytes': self.used,
+            'resident': {
+                name: resident.footprint
+                for name, resident in self.residents.items()
+            },
+            'loads': self.loads,
+            'evictions': self.evictions,
+        }
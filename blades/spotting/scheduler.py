@@ -0,0 +1,132 @@
+"""
+# Heads scheduler
+
+The heads of `tag` (Emotion, Irony, LanguageScore, TextType, embedding,
+sentiment, Age/Gender) are independent, torch and tensorflow release the GIL
+during their kernels so they can run concurrently on a bounded thread pool.
+
+Heads are a dependency graph :
+
+    tokenize ──> Age
+             └─> Gender
+    Embedding, Emotion, Irony, LanguageScore, TextType, Sentiment
+
+A head starts as soon as it's dependencies are done and receives their
+results. So concurrent heads do not oversubscribe the CPU, the intra-op
+threads of torch and tensorflow are limited to the CPUs / `concurrent_heads`
+(or `intra_op_threads`). Both settings are process-wide, not per thread : they
+are applied once per process (before the libraries are imported when possible,
+trough OMP_NUM_THREADS and TF_NUM_INTRAOP_THREADS) and every head shares them.
+"""
+import os
+import sys
+import time
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Optional
+
+
+@dataclass
+class Head:
+    name: str
+    run: Callable[[dict[str, Any]], Any] # receives it's dependencies results
+    depends_on: tuple[str, ...] = field(default_factory=tuple)
+
+
+class CyclicHeads(Exception):
+    """Remaining heads depend on heads that can never run"""
+
+
+_intra_op_threads: Optional[int] = None
+
+
+def intra_op_threads(concurrent_heads: int, threads: Optional[int] = None) -> int:
+    return threads or max(1, (os.cpu_count() or 1) // max(1, concurrent_heads))
+
+
+def limit_intra_op_threads(threads: int):
+    """sets the intra-op threads of torch and tensorflow, once per process"""
+    global _intra_op_threads
+    if _intra_op_threads == threads:
+        return
+    _intra_op_threads = threads
+    # read when the libraries are imported, by this process or it's workers
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    torch = sys.modules.get('torch', None)
+    if torch is not None:
+        torch.set_num_threads(threads)
+    tensorflow = sys.modules.get('tensorflow', None)
+    if tensorflow is not None:
+        try:
+            tensorflow.config.threading.set_intra_op_parallelism_threads(threads)
+        except RuntimeError: # already initialized, from TF_NUM_INTRAOP_THREADS
+            pass
+
+
+_pools: dict[int, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def heads_pool(size: int) -> ThreadPoolExecutor:
+    """pools live as long as the process, one per size"""
+    with _pools_lock:
+        if size not in _pools:
+            _pools[size] = ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix='spotting-head'
+            )
+        return _pools[size]
+
+
+def run_heads(
+    heads: list[Head],
+    concurrent_heads: int,
+    threads: Optional[int] = None,
+) -> tuple[dict[str, Any], dict[str, float]]:
+    """
+    Runs `heads` following their dependencies on at most `concurrent_heads`
+    threads, returns their results and their wall times (in seconds).
+    """
+    limit_intra_op_threads(intra_op_threads(concurrent_heads, threads))
+    results: dict[str, Any] = {}
+    seconds: dict[str, float] = {}
+
+    def execute(head: Head):
+        start = time.perf_counter()
+        result = head.run({name: results[name] for name in head.depends_on})
+        seconds[head.name] = round(time.perf_counter() - start, 4)
+        return result
+
+    if concurrent_heads <= 1: # sequential, in the calling thread
+        remaining = list(heads)
+        while remaining:
+            runnable = [
+                head for head in remaining
+                if all(name in results for name in head.depends_on)
+            ]
+            if not runnable:
+                raise CyclicHeads([head.name for head in remaining])
+            for head in runnable:
+                results[head.name] = execute(head)
+                remaining.remove(head)
+        return results, seconds
+
+    pool = heads_pool(concurrent_heads)
+    waiting = list(heads)
+    running = {}
+    while waiting or running:
+        for head in [
+            head for head in waiting
+            if all(name in results for name in head.depends_on)
+        ]:
+            running[pool.submit(execute, head)] = head
+            waiting.remove(head)
+        if not running:
+            raise CyclicHeads([head.name for head in waiting])
+        done, __pending__ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            # raises the head's exception, the other heads keep running
+            # but their results are discarded
+            results[running.pop(future).name] = future.result()
+    return results, seconds
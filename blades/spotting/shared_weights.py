@@ -0,0 +1,145 @@
+"""
+# Shared weights
+
+Several spotting blades (or inference workers) on one host each hold a
+private copy of every model, several GB per replica. With `shared_weights`
+the weights of the torch models are instead memory-mapped read-only from a
+local store, the replicas share the same physical pages (the page cache of
+the store's files) and only allocate their activations :
+
+    first replica : model loaded -> it's state dict written to the store
+                    (safetensors format, `model_cache_dir`/<repo>/<rev>/shared)
+    every replica : model loaded -> each tensor of the state dict replaced by
+                    a read-only view of the store's file (np.memmap)
+
+Replicas share the store trough the same `model_cache_dir` (a shared volume
+with docker). The store is written once per revision (atomically, see
+backends.build_once) and it's files are read without the safetensors package.
+Tensors of a dtype numpy can't map (bfloat16) stay private. The keras heads
+are small and are not shared, nor are the onnx backends (onnxruntime owns
+their weights). A replica still holds a private copy while it loads a model.
+"""
+import os
+import json
+import struct
+import logging
+import warnings
+import numpy as np
+
+from .backends import build_once, cached_directory
+
+blade_logger = logging.getLogger('blade')
+
+# safetensors dtype names
+DTYPES = {
+    'F64': np.float64,
+    'F32': np.float32,
+    'F16': np.float16,
+    'I64': np.int64,
+    'I32': np.int32,
+    'I16': np.int16,
+    'I8': np.int8,
+    'U8': np.uint8,
+    'BOOL': np.bool_,
+}
+NAMES = {np.dtype(dtype): name for name, dtype in DTYPES.items()}
+ALIGNMENT = 64 # tensors offsets, so every view is aligned
+
+
+def write_safetensors(path: str, arrays: dict[str, np.ndarray]):
+    header: dict = {}
+    offset = 0
+    for name, array in arrays.items():
+        start = -(-offset // ALIGNMENT) * ALIGNMENT
+        header[name] = {
+            'dtype': NAMES[array.dtype],
+            'shape': list(array.shape),
+            'data_offsets': [start, start + array.nbytes],
+        }
+        offset = start + array.nbytes
+    encoded = json.dumps(header).encode('utf-8')
+    encoded += b' ' * (-(8 + len(encoded)) % ALIGNMENT) # data starts aligned
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        data_start = f.tell()
+        for name, array in arrays.items():
+            f.seek(data_start + header[name]['data_offsets'][0])
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def map_safetensors(path: str) -> dict[str, np.ndarray]:
+    """read-only views of the tensors of a safetensors file"""
+    with open(path, 'rb') as f:
+        (size,) = struct.unpack('<Q', f.read(8))
+        header: dict = json.loads(f.read(size))
+    header.pop('__metadata__', None)
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+    data_start = 8 + size
+    result = {}
+    for name, entry in header.items():
+        if entry['dtype'] not in DTYPES:
+            continue
+        start, end = entry['data_offsets']
+        result[name] = mapped[data_start + start:data_start + end].view(
+            DTYPES[entry['dtype']]
+        ).reshape(entry['shape'])
+    return result
+
+
+def torch_modules(model) -> list:
+    """the torch modules holding the weights of a loaded model"""
+    import torch
+    if isinstance(model, torch.nn.Module):
+        return [model] # sentence encoder
+    module = getattr(model, 'model', None) # transformers pipeline
+    return [module] if isinstance(module, torch.nn.Module) else []
+
+
+def shared_directory(spec, cache_dir: str) -> str:
+    return cached_directory(spec, cache_dir, 'shared')
+
+
+def share(spec, model, cache_dir: str) -> int:
+    """
+    Replaces the weights of `model` by views of the shared store, writes the
+    store if needed. Returns the number of shared bytes.
+    """
+    import torch
+    modules = torch_modules(model)
+    if not modules:
+        return 0
+
+    def write(directory: str):
+        for index, module in enumerate(modules):
+            arrays = {}
+            for name, tensor in module.state_dict().items():
+                array = tensor.detach().cpu().contiguous()
+                if array.dtype == torch.bfloat16:
+                    continue
+                arrays[name] = array.numpy()
+            write_safetensors(
+                os.path.join(directory, '{}.safetensors'.format(index)), arrays
+            )
+
+    directory = build_once(shared_directory(spec, cache_dir), write)
+    shared = 0
+    for index, module in enumerate(modules):
+        arrays = map_safetensors(
+            os.path.join(directory, '{}.safetensors'.format(index))
+        )
+        with warnings.catch_warnings(): # views are not writable, never written
+            warnings.simplefilter('ignore', UserWarning)
+            for name, tensor in module.state_dict(keep_vars=True).items():
+                array = arrays.get(name, None)
+                if array is None or tuple(array.shape) != tuple(tensor.shape):
+                    continue
+                mapped = torch.from_numpy(array)
+                if mapped.dtype != tensor.dtype:
+                    continue
+                tensor.data = mapped
+                shared += array.nbytes
+    blade_logger.info('{} shares {}MB of weights'.format(
+        spec.name, shared // (1024 * 1024)
+    ))
+    return shared
@@ -0,0 +1,117 @@
+"""
+# Model snapshots
+
+Loading a model from the hugging face hub resolves it's revision online (and
+downloads it the first time) before building it. Once loaded, models are
+saved as local snapshots under `model_cache_dir` and the next starts load
+them from disk without any hub lookup :
+
+    - transformers pipelines, tokenizers : save_pretrained (safetensors)
+    - sentence encoder                   : SentenceTransformer.save
+    - keras heads, vader lexicons        : the downloaded files are copied
+
+Snapshots are by repository and revision, a new revision (see reload) gets
+it's own snapshot. Only the torch backend is snapshotted, onnx exports are
+already cached on disk by backends.py.
+
+A model without revision (latest) is pinned to the hub's current commit
+before loading, so it's snapshot (and exports) are by commit too and a new
+commit on the hub is picked up. The commit is remembered in `latest.json`
+next to the snapshots and resolved again once older than `latest_seconds`,
+the remembered one is kept while the hub can't be reached.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+from dataclasses import replace
+
+from .backends import build_once, cached_directory
+
+blade_logger = logging.getLogger('blade')
+
+SAVERS = {
+    "text-classification": lambda model, directory: model.save_pretrained(
+        directory, safe_serialization=True
+    ),
+    "tokenizer": lambda model, directory: model.save_pretrained(directory),
+    "sentence_transformer": lambda model, directory: model.save(directory),
+}
+
+
+def snapshot_directory(spec, cache_dir: str) -> str:
+    return cached_directory(spec, cache_dir, 'snapshot')
+
+
+def write_atomically(target: str, data: bytes):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(target))
+    with os.fdopen(descriptor, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, target) # atomic, workers may write it together
+
+
+def resolve_latest(spec, cache_dir: str, latest_seconds: float):
+    """the spec pinned to the hub's current commit when it has no revision"""
+    if spec.revision is not None:
+        return spec
+    pointer = os.path.join(
+        cache_dir, spec.repo_id.replace('/', '__'), 'latest.json'
+    )
+    known = None
+    try:
+        with open(pointer) as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if known and time.time() - known['resolved_at'] < latest_seconds:
+        return replace(spec, revision=known['sha'])
+    try:
+        from huggingface_hub import HfApi
+        sha = HfApi().model_info(spec.repo_id).sha
+    except Exception:
+        if known is None: # never resolved, loaded as latest
+            blade_logger.warning('could not resolve {}'.format(spec.repo_id))
+            return spec
+        blade_logger.warning('could not resolve {}, keeping {}'.format(
+            spec.repo_id, known['sha']
+        ))
+        return replace(spec, revision=known['sha'])
+    write_atomically(pointer, json.dumps(
+        {'sha': sha, 'resolved_at': time.time()}
+    ).encode('utf-8'))
+    return replace(spec, revision=sha)
+
+
+def save_snapshot(spec, model, cache_dir: str):
+    """Errors are logged, the model is loaded from the hub next time"""
+    try:
+        build_once(
+            snapshot_directory(spec, cache_dir),
+            lambda directory: SAVERS[spec.kind](model, directory)
+        )
+    except Exception:
+        blade_logger.exception('could not snapshot {}'.format(spec.name))
+
+
+def hub_file(spec, filename: str, cache_dir: str, snapshots: bool = True) -> str:
+    """local path of a file of the spec's repository, downloaded once"""
+    from huggingface_hub import hf_hub_download
+    if not snapshots:
+        return hf_hub_download(
+            repo_id=spec.repo_id, filename=filename, revision=spec.revision
+        )
+    target = os.path.join(snapshot_directory(spec, cache_dir), filename)
+    if os.path.isfile(target):
+        return target
+    downloaded = hf_hub_download(
+        repo_id=spec.repo_id, filename=filename, revision=spec.revision
+    )
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(target))
+    os.close(descriptor)
+    shutil.copyfile(downloaded, temporary)
+    os.replace(temporary, target) # atomic, workers may copy it together
+    return target
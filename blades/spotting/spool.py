@@ -0,0 +1,197 @@
+"""
+# Spool
+
+Accepted items are appended to a durable spool before being batched, so a
+crash or a restart of the blade (which multi.py does freely) does not lose the
+buffered items or the batches in flight.
+
+The spool is a directory of append-only segments, each a fixed size file
+mapped in memory. A record is :
+
+    | length (u32) | crc32 (u32) | state (u8) | payload (length bytes) |
+
+    state : 0 pending, 1 done
+
+Appending is a copy into the mapping (the kernel writes it back), the batcher
+only keeps the small `Record` references and batches are read from the
+mapping when they are processed, so pending items live in the page cache
+rather than in the python heap. Once a batch is processed it's records are
+marked done in place ; a sealed segment with no pending record is deleted
+and the active one is rewound.
+
+On startup the segments left by the previous process are scanned and their
+pending records replayed.
+
+Writes survive the process being killed, not the host losing power (segments
+are not fsync'ed on every append).
+"""
+import os
+import mmap
+import zlib
+import struct
+import logging
+from typing import NamedTuple, Optional
+
+blade_logger = logging.getLogger('blade')
+
+HEADER = struct.Struct('<IIB')
+END = b'\x00' * 4 # zero length, no record after
+PENDING, DONE = 0, 1
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DEFAULT_SPOOL_DIRECTORY = os.path.join(
+    os.path.expanduser('~'), '.cache', 'exorde', 'spool'
+)
+
+
+class Record(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+
+
+class Segment:
+    def __init__(self, path: str, size: Optional[int] = None):
+        self.path = path
+        with open(path, 'a+b') as f:
+            if size is not None:
+                f.truncate(size)
+            self.mm = mmap.mmap(f.fileno(), 0)
+        self.size = len(self.mm)
+        self.end = 0 # write offset
+        self.pending = 0
+
+    def fits(self, length: int) -> bool:
+        return self.end + HEADER.size + length <= self.size
+
+    def append(self, payload: bytes) -> int:
+        offset = self.end
+        HEADER.pack_into(
+            self.mm, offset, len(payload), zlib.crc32(payload), PENDING
+        )
+        start = offset + HEADER.size
+        self.mm[start:start + len(payload)] = payload
+        self.end = start + len(payload)
+        if self.end + len(END) <= self.size:
+            self.mm[self.end:self.end + len(END)] = END
+        self.pending += 1
+        return offset
+
+    def read(self, offset: int, length: int) -> str:
+        """decodes the payload straight from the mapping"""
+        start = offset + HEADER.size
+        with memoryview(self.mm) as view:
+            return str(view[start:start + length], 'utf-8')
+
+    def done(self, offset: int):
+        self.mm[offset + HEADER.size - 1] = DONE
+        self.pending -= 1
+
+    def scan(self) -> list[tuple[int, int]]:
+        """(offset, length) of the pending records, stops at the first invalid one"""
+        records = []
+        offset = 0
+        while offset + HEADER.size <= self.size:
+            length, crc, state = HEADER.unpack_from(self.mm, offset)
+            start = offset + HEADER.size
+            if length == 0 or start + length > self.size:
+                break
+            if zlib.crc32(self.mm[start:start + length]) != crc:
+                break # torn write
+            if state == PENDING:
+                records.append((offset, length))
+            offset = start + length
+        self.end = offset
+        self.pending = len(records)
+        return records
+
+    def rewind(self):
+        self.end = 0
+        self.mm[0:len(END)] = END
+
+    def close(self):
+        self.mm.close()
+
+
+class Spool:
+    def __init__(self, path: str, segment_bytes: int = DEFAULT_SEGMENT_BYTES):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.segments: dict[int, Segment] = {}
+        self.active: Optional[int] = None
+        self.replayed: int = 0
+        os.makedirs(path, exist_ok=True)
+
+    def segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.path, 'segment-{:08d}.spool'.format(segment_id))
+
+    def recover(self) -> list[Record]:
+        """Opens the segments left on disk and returns their pending records"""
+        records: list[Record] = []
+        for name in sorted(os.listdir(self.path)):
+            if not (name.startswith('segment-') and name.endswith('.spool')):
+                continue
+            segment_id = int(name[len('segment-'):-len('.spool')])
+            segment = Segment(self.segment_path(segment_id))
+            self.segments[segment_id] = segment
+            records.extend(
+                Record(segment_id, offset, length)
+                for offset, length in segment.scan()
+            )
+            self.release(segment_id)
+        self.replayed = len(records)
+        if records:
+            blade_logger.info('replaying {} spooled items'.format(len(records)))
+        return records
+
+    def append(self, payload: bytes) -> Record:
+        segment = self.segments.get(self.active)
+        if segment is None or not segment.fits(len(payload)):
+            previous = self.active
+            self.active = max(self.segments, default=-1) + 1
+            segment = Segment(
+                self.segment_path(self.active),
+                max(self.segment_bytes, HEADER.size + len(payload) + len(END))
+            )
+            self.segments[self.active] = segment
+            if previous is not None: # sealed
+                self.release(previous)
+        return Record(self.active, segment.append(payload), len(payload))
+
+    def read(self, records: list[Record]) -> list[str]:
+        return [
+            self.segments[record.segment].read(record.offset, record.length)
+            for record in records
+        ]
+
+    def done(self, records: list[Record]):
+        """Marks processed records, releases the segments they emptied"""
+        for record in records:
+            self.segments[record.segment].done(record.offset)
+        for segment_id in {record.segment for record in records}:
+            self.release(segment_id)
+
+    def release(self, segment_id: int):
+        segment = self.segments[segment_id]
+        if segment.pending:
+            return
+        if segment_id == self.active:
+            segment.rewind()
+            return
+        segment.close()
+        os.remove(segment.path)
+        del self.segments[segment_id]
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.mm.flush()
+            segment.close()
+        self.segments = {}
+
+    def status(self) -> dict:
+        return {
+            'path': self.path,
+            'segments': len(self.segments),
+            'pending': sum(s.pending for s in self.segments.values()),
+            'disk_bytes': sum(s.size for s in self.segments.values()),
+            'replayed': self.replayed,
+        }
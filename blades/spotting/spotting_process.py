@@ -1,20 +1,222 @@
+"""
+# Spotting process
 
-import logging, asyncio
+A batch of pushed items goes trough the spotting pipeline (see pipeline.py) :
+
+    decode ──> chunk ──> tag ──> merge ──> serialize ──> upload ──> receipt
+
+    - decode    : json texts to `Processed` items, invalid items are dropped
+    - chunk     : (item id, Processed) to analyze, one per chunk, long texts
+                  are split at sentence boundaries by `app['chunker']`
+                  (see chunking.py), in the inference workers
+    - tag       : analysis of the chunks (cache, then InferenceExecutor), timed
+                  in `tag_seconds` which the batch size adapts to
+    - merge     : chunks merged back into one ProcessedItem per item, `Batch`
+    - serialize : the Batch's fields encoded to json, it's items are encoded
+                  one by one by the uploader while it streams them
+    - upload    : the serialized batch sent by `app['uploader']` (uploader.py)
+    - receipt   : the transaction of the upload by `app['transaction']`
+
+Pushed items are expected to be translated and keyword-extracted `Processed`
+items. Upload and transaction are optional components, their stages are
+skipped when the app has none.
+
+Each stage's concurrency is configured in `pipeline_concurrency` (eg: upload:
+4), queues between stages hold `pipeline_queue_size` batches.
+"""
+import json
+import time
+import logging
+import typing
+from enum import Enum
+from dataclasses import dataclass, field
+from typing import Any, Optional, Union
+from exorde.models import Processed, Batch
+
+from .pipeline import Pipeline, Stage
+from .process_batch import tag_batch, processed_items, merge_batch
+from .uploader import SerializedBatch
 
 blade_logger = logging.getLogger('blade')
 
 
-async def spotting_process(batch):
-    blade_logger.info("starting spotting process")
+def from_json(annotation, value):
+    """
+    Rebuilds the typed (MadType) value of `annotation` from it's json
+    representation, following the annotations of nested dicts.
+    """
+    if value is None:
+        return None
+    origin = typing.get_origin(annotation)
+    if origin is Union:
+        for argument in typing.get_args(annotation):
+            if argument is type(None):
+                continue
+            try:
+                return from_json(argument, value)
+            except (TypeError, ValueError, KeyError):
+                pass
+        raise TypeError('{} is not compatible with {}'.format(value, annotation))
+    if origin is list:
+        (argument,) = typing.get_args(annotation)
+        return [from_json(argument, x) for x in value]
+    if not isinstance(annotation, type):
+        return value
+    if issubclass(annotation, dict) and getattr(annotation, '__annotations__', None):
+        hints = annotation.__annotations__
+        return annotation(**{
+            key: from_json(hints[key], x) if key in hints else x
+            for key, x in value.items()
+        })
+    return annotation(value)
+
+
+@dataclass
+class Job:
+    items: list[str] # json texts, as pushed
+    processed: list[Processed] = field(default_factory=list)
+    invalid: int = 0
+    chunks: list[tuple[int, Processed]] = field(default_factory=list)
+    analysis: list = field(default_factory=list)
+    tag_seconds: Optional[float] = None # None when there was nothing to tag
+    batch: Optional[Batch] = None
+    payload: Optional[SerializedBatch] = None
+    upload: Any = None # uploader's result
+    receipt: Any = None
+
+
+def decode(job: Job) -> Job:
+    for text in job.items:
+        try:
+            job.processed.append(from_json(Processed, json.loads(text)))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            job.invalid += 1
+    if job.invalid:
+        blade_logger.warning('dropped {} invalid items'.format(job.invalid))
+    return job
+
+
+def with_text(processed: Processed, text: str) -> Processed:
+    """the same Processed, for one chunk of it's translation"""
+    translation = processed.translation
+    return Processed(**{
+        **processed,
+        'translation': type(translation)(
+            language=translation.language, translation=text
+        ),
+    })
+
+
+def chunk_items(job: Job, chunks: Optional[list[list[str]]] = None) -> Job:
+    """`chunks` of every item's translation, one chunk per item without"""
+    if chunks is None:
+        job.chunks = [(id, processed) for id, processed in enumerate(job.processed)]
+        return job
+    for id, (processed, texts) in enumerate(zip(job.processed, chunks)):
+        if len(texts) == 1:
+            job.chunks.append((id, processed))
+        else:
+            job.chunks.extend((id, with_text(processed, text)) for text in texts)
+    return job
+
+
+def merge(job: Job) -> Job:
+    job.batch = merge_batch(processed_items(job.chunks, job.analysis))
+    return job
 
-    await process_batch(batch)
 
-    # upload_to_ipfs
-        # download the uploaded file
-        # count number of items
-        # if != 0 next
+def json_default(value):
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError('{} is not serializable'.format(type(value)))
 
-    # transaction
 
-    # get receipt
+def encode_item(item) -> bytes:
+    return json.dumps(item, default=json_default).encode('utf-8')
+
+
+def serialize(job: Job) -> Job:
+    """items are encoded one by one when the uploader streams them"""
+    job.payload = SerializedBatch(
+        items=job.batch['items'],
+        fields={
+            key: json.dumps(value, default=json_default)
+            for key, value in job.batch.items() if key != 'items'
+        },
+        encode=encode_item,
+    )
+    return job
+
+
+DEFAULT_CONCURRENCY = {
+    'decode': 1,
+    'chunk': 1,
+    'tag': 1,
+    'merge': 1,
+    'serialize': 1,
+    'upload': 2,
+    'receipt': 1,
+}
+
+
+def spotting_pipeline(app, parameters: dict) -> Pipeline:
+    async def tag(job: Job) -> Job:
+        if job.chunks:
+            start = time.monotonic()
+            job.analysis = await tag_batch(
+                job.chunks,
+                app['inference_executor'],
+                app['inference_configuration'],
+                app['analysis_cache'],
+            )
+            job.tag_seconds = time.monotonic() - start
+        return job
+
+    async def chunk(job: Job) -> Job:
+        if app.get('chunker', None) is None or not job.processed:
+            return chunk_items(job)
+        return chunk_items(job, await app['inference_executor'].split([
+            processed.translation.translation for processed in job.processed
+        ]))
+
+    async def upload(job: Job) -> Job:
+        if app.get('uploader', None) is None:
+            blade_logger.debug('no uploader, the batch is not uploaded')
+        elif job.batch['items']:
+            job.upload = await app['uploader'].upload(job.payload)
+        return job
+
+    async def receipt(job: Job) -> Job:
+        if app.get('transaction', None) is not None and job.upload is not None:
+            job.receipt = await app['transaction'].send(job.upload)
+        return job
+
+    concurrency: dict = {
+        **DEFAULT_CONCURRENCY,
+        # a batch is chunked and tagged by one inference worker
+        'chunk': max(1, parameters.get('inference_workers', 1)),
+        'tag': max(1, parameters.get('inference_workers', 1)),
+        'upload': parameters.get('upload_in_flight', 2),
+        **parameters.get('pipeline_concurrency', {}),
+    }
+    queue_size: int = parameters.get('pipeline_queue_size', 2)
+
+    def stage(name: str, run, blocking: bool = False) -> Stage:
+        return Stage(name, run, concurrency[name], queue_size, blocking)
+
+    return Pipeline([
+        stage('decode', decode, blocking=True),
+        stage('chunk', chunk),
+        stage('tag', tag),
+        stage('merge', merge, blocking=True),
+        stage('serialize', serialize, blocking=True),
+        stage('upload', upload),
+        stage('receipt', receipt),
+    ])
+
+
+async def spotting_process(batch: list[str], app) -> Job:
+    blade_logger.info("starting spotting process")
+    job = await app['pipeline'].process(Job(batch))
     blade_logger.info("spotting process complete")
+    return job
@@ -0,0 +1,175 @@
+"""
+# Stub models
+
+Tiny models with the interface of the spotting models (see registry.py), to
+run `tag` and `process_batch` without downloading or loading the real ones
+(nor finvader and it's lexicons) : benchmarks of the batching, scheduling and merging code, and tests.
+
+Their cost grows with the number of tokens like the real models (hashed
+token embeddings and a projection), their scores are deterministic for a
+given text.
+"""
+import zlib
+import numpy as np
+from types import SimpleNamespace
+from typing import Optional
+
+from .registry import ModelRegistry, ModelSpec, SPOTTING_MODELS
+from .tag import EMOTION_LABELS, TEXT_TYPE_LABELS
+
+VOCABULARY = 30000
+DIMENSION = 64
+
+
+def token_ids(text: str) -> list[int]:
+    return [zlib.crc32(token.encode('utf-8')) % VOCABULARY for token in text.split()]
+
+
+_table = np.random.default_rng(0).standard_normal(
+    (VOCABULARY, DIMENSION)
+).astype(np.float32)
+
+
+def features(ids_batch: list[list[int]], work: int) -> np.ndarray:
+    """mean of the token embeddings, `work` projections per token"""
+    result = np.zeros((len(ids_batch), DIMENSION), dtype=np.float32)
+    for row, ids in enumerate(ids_batch):
+        tokens = _table[ids or [0]]
+        for __i__ in range(work):
+            tokens = np.tanh(tokens @ _table[:DIMENSION])
+        result[row] = tokens.mean(axis=0)
+    return result
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class StubEncoder:
+    def __init__(self, dimension: int = 384, work: int = 2):
+        self.projection = np.random.default_rng(1).standard_normal(
+            (DIMENSION, dimension)
+        ).astype(np.float32)
+        self.work = work
+
+    def encode(self, sentences: list[str], batch_size: int = 32) -> np.ndarray:
+        embeddings = features([token_ids(s) for s in sentences], self.work)
+        embeddings = embeddings @ self.projection
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+class StubClassifier:
+    """text-classification pipeline with top_k=None"""
+    def __init__(self, labels: list[str], work: int = 2, seed: int = 2):
+        self.labels = labels
+        self.model = SimpleNamespace(config=SimpleNamespace(
+            id2label=dict(enumerate(labels))
+        ))
+        self.weights = np.random.default_rng(seed).standard_normal(
+            (DIMENSION, len(labels))
+        ).astype(np.float32)
+        self.work = work
+
+    def __call__(self, texts: list[str], batch_size: int = 1) -> list[list[dict]]:
+        scores = softmax(features([token_ids(t) for t in texts], self.work) @ self.weights)
+        return [
+            sorted(
+                [
+                    {"label": label, "score": float(score)}
+                    for label, score in zip(self.labels, row)
+                ],
+                key=lambda y: y["score"],
+                reverse=True
+            )
+            for row in scores
+        ]
+
+
+class StubTokenizer:
+    pad_token_id = 0
+
+    def __call__(
+        self,
+        documents: list[str],
+        add_special_tokens: bool = True,
+        max_length: Optional[int] = None,
+        truncation: bool = False,
+        return_attention_mask: bool = True,
+    ) -> dict:
+        input_ids = []
+        for document in documents:
+            ids = [1 + i for i in token_ids(document)]
+            if add_special_tokens:
+                ids = [VOCABULARY + 1] + ids + [VOCABULARY + 2]
+            if truncation and max_length:
+                ids = ids[:max_length]
+            input_ids.append(ids)
+        return {"input_ids": input_ids}
+
+
+class StubKeras:
+    """custom keras head, accepts any padded length"""
+    def __init__(self, classes: int, work: int = 1, seed: int = 3):
+        self.weights = np.random.default_rng(seed).standard_normal(
+            (DIMENSION, classes)
+        ).astype(np.float32)
+        self.work = work
+
+    def predict(self, x: np.ndarray, verbose: int = 0, batch_size: int = 32) -> np.ndarray:
+        ids = [[i % VOCABULARY for i in row if i] for row in np.asarray(x).tolist()]
+        return softmax(features(ids, self.work) @ self.weights).astype(np.float32)
+
+
+class StubVader:
+    def polarity_scores(self, text: str) -> dict:
+        return {"compound": float(np.tanh((zlib.crc32(text.encode()) % 200 - 100) / 50))}
+
+
+def stub_finvader(text: str, **__options__) -> float:
+    """finvader's compound score, without it's lexicons"""
+    return float(np.tanh((zlib.crc32(text[::-1].encode()) % 200 - 100) / 50))
+
+
+SENTIMENT_LABELS = ["negative", "neutral", "positive"]
+EMOTION_MODEL_LABELS = [label for __field__, label in EMOTION_LABELS] + ["amusement"]
+
+
+def stub_model(name: str, work: int):
+    if name == "Embedding":
+        return StubEncoder(work=work)
+    if name == "Emotion":
+        return StubClassifier(EMOTION_MODEL_LABELS, work)
+    if name == "Irony":
+        return StubClassifier(["non_irony", "irony"], work)
+    if name == "LanguageScore":
+        return StubClassifier(["LABEL_0", "LABEL_1"], work)
+    if name == "TextType":
+        return StubClassifier([label for __field__, label in TEXT_TYPE_LABELS], work)
+    if name in ("gdb", "fdb"):
+        return StubClassifier(SENTIMENT_LABELS, work, seed=4 if name == "gdb" else 5)
+    if name == "vader":
+        return StubVader()
+    if name == "tokenizer":
+        return StubTokenizer()
+    if name == "Age":
+        return StubKeras(4, work)
+    if name == "Gender":
+        return StubKeras(2, work)
+    raise KeyError(name)
+
+
+class StubRegistry(ModelRegistry):
+    """`ModelRegistry` which loads stub models, `work` scales their cost"""
+    def __init__(self, specs: list[ModelSpec] = SPOTTING_MODELS, work: int = 1, **kwargs):
+        super().__init__(specs, **kwargs)
+        self.work = work
+
+    def _load_one(self, spec: ModelSpec):
+        return stub_model(spec.name, self.work)
+
+    def import_libraries(self):
+        pass
+
+    def finvader(self):
+        return stub_finvader
@@ -1,14 +1,11 @@
-import json
-import pandas as pd
+import math
+import weakref
 import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Optional
 from madtypes import MadType
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
-from finvader import finvader
-from huggingface_hub import hf_hub_download
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import tensorflow as tf
-import swifter # note, mandatory due to side-effect by import, might want to investigate
+
+from .scheduler import Head, run_heads
 
 
 class LanguageScore(float, metaclass=MadType):
@@ -99,51 +96,304 @@ class Analysis(dict, metaclass=MadType):
 
 
 
-class TokenAndPositionEmbedding(tf.keras.layers.Layer):
-    def __init__(self, maxlen, vocab_size, embed_dim, **__kwargs__):
-        super().__init__()
-        self.token_emb = tf.keras.layers.Embedding(
-            input_dim=vocab_size, output_dim=embed_dim
-        )
-        self.pos_emb = tf.keras.layers.Embedding(
-            input_dim=maxlen, output_dim=embed_dim
-        )
+def analysis_from_dict(data: dict) -> Analysis:
+    """Rebuilds an `Analysis` from it's json representation"""
+    return Analysis(
+        language_score=LanguageScore(data["language_score"]),
+        sentiment=Sentiment(data["sentiment"]),
+        embedding=Embedding(data["embedding"]),
+        gender=Gender(**data["gender"]),
+        text_type=TextType(**data["text_type"]),
+        emotion=Emotion(**data["emotion"]),
+        irony=Irony(**data["irony"]),
+        age=Age(**data["age"]),
+    )
 
-    def call(self, x):
-        maxlen = tf.shape(x)[-1]
-        positions = tf.range(start=0, limit=maxlen, delta=1)
-        positions = self.pos_emb(positions)
-        x = self.token_emb(x)
-        return x + positions
 
+@dataclass
+class InferenceConfiguration:
+    """
+    Batching and scheduling of the model calls in `tag`, configured from the
+    spotting blade's `static_cluster_parameters` (inference_batch_size,
+    inference_buckets, concurrent_heads, intra_op_threads)
+    """
+    batch_size: int = 32    # maximum documents per model call
+    buckets: int = 4        # length groups per batch, keeps the padding small
+    concurrent_heads: int = 4   # heads running together, 1 is sequential
+    intra_op_threads: Optional[int] = None # per process, cpus / concurrent_heads
 
-class TransformerBlock(tf.keras.layers.Layer):
-    def __init__(self, embed_dim, num_heads, ff_dim, rate=0.1, **__kwargs__):
-        super().__init__()
-        self.att = tf.keras.layers.MultiHeadAttention(
-            num_heads=num_heads, key_dim=embed_dim
-        )
-        self.ffn = tf.keras.Sequential(
-            [
-                tf.keras.layers.Dense(ff_dim, activation="relu"),
-                tf.keras.layers.Dense(embed_dim),
-            ]
-        )
-        self.layernorm1 = tf.keras.layers.LayerNormalization(epsilon=1e-6)
-        self.layernorm2 = tf.keras.layers.LayerNormalization(epsilon=1e-6)
-        self.dropout1 = tf.keras.layers.Dropout(rate)
-        self.dropout2 = tf.keras.layers.Dropout(rate)
 
-    def call(self, inputs, training):
-        attn_output = self.att(inputs, inputs)
-        attn_output = self.dropout1(attn_output, training=training)
-        out1 = self.layernorm1(inputs + attn_output)
-        ffn_output = self.ffn(out1)
-        ffn_output = self.dropout2(ffn_output, training=training)
-        return self.layernorm2(out1 + ffn_output)
+def length_buckets(
+    lengths: list[int], batch_size: int, buckets: int
+) -> list[list[int]]:
+    """
+    Groups the inputs indexes in `buckets` groups of similar length and
+    splits each group in sub-batches of at most `batch_size` inputs.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    group_size = max(1, math.ceil(len(order) / max(1, buckets)))
+    result: list[list[int]] = []
+    for start in range(0, len(order), group_size):
+        group = order[start:start + group_size]
+        for sub_start in range(0, len(group), max(1, batch_size)):
+            result.append(group[sub_start:sub_start + max(1, batch_size)])
+    return result
+
+
+def batched_inference(
+    infer: Callable[[list], list],
+    inputs: list,
+    configuration: InferenceConfiguration
+) -> list:
+    """
+    Runs `infer` once per length bucket and returns it's outputs in the
+    original order of `inputs` (texts or token ids, bucketed by `len`)
+    """
+    results: list = [None] * len(inputs)
+    for indexes in length_buckets(
+        [len(x) for x in inputs],
+        configuration.batch_size,
+        configuration.buckets
+    ):
+        outputs = infer([inputs[i] for i in indexes])
+        for i, output in zip(indexes, outputs):
+            results[i] = output
+    return results
+
+
+def batched_scores(
+    infer: Callable[[list], np.ndarray],
+    inputs: list,
+    configuration: InferenceConfiguration
+) -> np.ndarray:
+    """
+    `batched_inference` for an `infer` returning one row per input, written
+    in place into a single float32 matrix (allocated with the first bucket)
+    """
+    scores: Optional[np.ndarray] = None
+    for indexes in length_buckets(
+        [len(x) for x in inputs],
+        configuration.batch_size,
+        configuration.buckets
+    ):
+        outputs = np.asarray(infer([inputs[i] for i in indexes]))
+        if scores is None:
+            scores = np.empty((len(inputs), outputs.shape[1]), dtype=np.float32)
+        scores[indexes] = outputs
+    return scores
+
+
+def classify(pipe) -> Callable[[list[str]], list]:
+    """text-classification pipeline as a batched `infer`"""
+    # a list input returns one list of {label, score} per document
+    return lambda texts: pipe(texts, batch_size=len(texts))
+
+
+def pipeline_labels(pipe) -> tuple[str, ...]:
+    """labels of a text-classification pipeline, in the model's order"""
+    id2label = pipe.model.config.id2label
+    return tuple(id2label[i] for i in range(len(id2label)))
+
+
+def classify_scores(pipe, labels: tuple[str, ...]) -> Callable[[list[str]], np.ndarray]:
+    """`classify` returning a float32 matrix with one column per label"""
+    index = {label: i for i, label in enumerate(labels)}
+    def infer(texts: list[str]) -> np.ndarray:
+        scores = np.zeros((len(texts), len(labels)), dtype=np.float32)
+        for row, prediction in enumerate(classify(pipe)(texts)):
+            for y in prediction:
+                scores[row, index[y["label"]]] = y["score"]
+        return scores
+    return infer
+
+
+@dataclass
+class LabelScores:
+    """Scores of a head, one float32 row per document and one column per label"""
+    labels: tuple[str, ...]
+    scores: np.ndarray
+
+    def columns(self, labels: tuple[str, ...]) -> np.ndarray:
+        """the scores of `labels`, in that order"""
+        index = {label: i for i, label in enumerate(self.labels)}
+        return self.scores[:, [index[label] for label in labels]]
+
+
+"""
+Analysis fields of the label heads : (field, label)
+"""
+TEXT_TYPE_LABELS = (
+    ("assumption", "Assumption"),
+    ("anecdote", "Anecdote"),
+    ("none", "None"),
+    ("definition", "Definition"),
+    ("testimony", "Testimony"),
+    ("other", "Other"),
+    ("study", "Statistics/Study"),
+)
+EMOTION_LABELS = tuple((emotion, emotion) for emotion in (
+    "love", "admiration", "joy", "approval", "caring", "excitement",
+    "gratitude", "desire", "anger", "optimism", "disapproval", "grief",
+    "annoyance", "pride", "curiosity", "neutral", "disgust", "disappointment",
+    "realization", "fear", "relief", "confusion", "remorse", "embarrassment",
+    "surprise", "sadness", "nervousness",
+))
+IRONY_LABELS = (("irony", "irony"), ("non_irony", "non_irony"))
+AGE_LABELS = (
+    ("below_twenty", "<20"),
+    ("twenty_thirty", "20<30"),
+    ("thirty_forty", "30<40"),
+    ("forty_more", ">=40"),
+)
+
+
+def label_rows(head: LabelScores, labels: tuple[tuple[str, str], ...]) -> list[dict]:
+    """one {field: score} per document, converted to python floats at once"""
+    fields = [field for field, __label__ in labels]
+    return [
+        dict(zip(fields, row))
+        for row in head.columns(tuple(label for __field__, label in labels)).tolist()
+    ]
+
+
+MAX_LENGTH = 512 # input size of the custom keras heads
+
 
+def pad_input_ids(
+    input_ids: list[list[int]], length: int, pad_token_id: int
+) -> np.ndarray:
+    """Right pads token ids to `length` in a single int32 matrix"""
+    padded = np.full((len(input_ids), length), pad_token_id, dtype=np.int32)
+    for row, ids in enumerate(input_ids):
+        padded[row, :len(ids)] = ids
+    return padded
 
-def tag(documents: list[str], lab_configuration):
+
+_dynamic_padding = weakref.WeakKeyDictionary() # model: bool
+
+
+def allows_dynamic_padding(model, tokenizer) -> bool:
+    """
+    The custom heads are fed inputs padded to MAX_LENGTH. Padding only to the
+    longest sequence of a bucket is used when the model accepts shorter inputs
+    and scores them the same, which is probed once per loaded model.
+    """
+    if model not in _dynamic_padding:
+        ids = tokenizer(
+            ["Exorde dynamic padding probe."],
+            add_special_tokens=True,
+            max_length=MAX_LENGTH,
+            truncation=True,
+            return_attention_mask=False,
+        )["input_ids"]
+        try:
+            short = model.predict(
+                pad_input_ids(ids, len(ids[0]), tokenizer.pad_token_id),
+                verbose=0
+            )
+            full = model.predict(
+                pad_input_ids(ids, MAX_LENGTH, tokenizer.pad_token_id),
+                verbose=0
+            )
+            _dynamic_padding[model] = bool(np.allclose(short, full, atol=1e-5))
+        except Exception:
+            _dynamic_padding[model] = False
+    return _dynamic_padding[model]
+
+
+"""
+# Sentiment ensemble
+
+Sentiment is a weighted ensemble of four sub-models :
+    - gdb: distilbert multilingual sentiment
+    - fdb: financial distilroberta
+    - vader: VADER with the Loughran & emoji lexicons
+    - finvader: financial VADER
+
+Each sub-model is computed once per document and both compounded scores are
+derived from those components with array math. Rounding is kept on python's
+`round` so the scores are the same as when they were computed per document.
+"""
+def _round(values: np.ndarray, digits: int) -> np.ndarray:
+    return np.array([round(value, digits) for value in values.tolist()])
+
+
+def distil_sentiment(predictions: list[list[dict]]) -> np.ndarray:
+    """positive - negative of a batch of sentiment pipeline predictions"""
+    scores = np.array([
+        [
+            {e["label"]: e["score"] for e in prediction}[label]
+            for label in ("negative", "positive")
+        ]
+        for prediction in predictions
+    ], dtype=np.float64).reshape(-1, 2)
+    return _round(_round(scores[:, 1], 3) - _round(scores[:, 0], 3), 3)
+
+
+SENTIMENT_COMPONENTS = ("gdb", "fdb", "vader", "finvader")
+
+
+def sentiment_component(
+    name: str,
+    documents: list[str],
+    registry,
+    configuration: InferenceConfiguration
+) -> np.ndarray:
+    if name in ("gdb", "fdb"):
+        return distil_sentiment(batched_inference(
+            classify(registry.get(name)), documents, configuration
+        ))
+    if name == "vader":
+        sentiment_analyzer = registry.get("vader")
+        return _round(np.array([
+            sentiment_analyzer.polarity_scores(text)["compound"]
+            for text in documents
+        ], dtype=np.float64), 2)
+    if name == "finvader":
+        finvader = registry.finvader()
+        return _round(np.array([
+            finvader(
+                text,
+                use_sentibignomics = True,
+                use_henry = True,
+                indicator = 'compound'
+            ) for text in documents
+        ], dtype=np.float64), 2)
+    raise KeyError(name)
+
+
+def compounded_financial_sentiment(components: dict[str, np.ndarray]) -> np.ndarray:
+    #  70% financial distil roberta model + 30% fin_vader_score
+    return _round(0.70 * components["fdb"] + 0.30 * components["finvader"], 2)
+
+
+def compounded_sentiment(
+    components: dict[str, np.ndarray], financial: np.ndarray
+) -> np.ndarray:
+    """
+    weights of gdb, vader & compounded financial sentiment depend on how
+    financial the document is (abs of the compounded financial sentiment)
+    """
+    strength = np.abs(financial)
+    conditions = [strength >= 0.6, strength >= 0.4, strength >= 0.1]
+    # if strength < 0.1, so no apparent financial component
+    gdb_weight = np.select(conditions, [0.30, 0.40, 0.60], 0.60)
+    vader_weight = np.select(conditions, [0.10, 0.20, 0.25], 0.40)
+    financial_weight = np.select(conditions, [0.60, 0.40, 0.15], 0.0)
+    return _round(
+        gdb_weight * components["gdb"]
+        + vader_weight * components["vader"]
+        + financial_weight * financial,
+        2
+    )
+
+
+def tag(
+    documents: list[str],
+    registry,
+    configuration: Optional[InferenceConfiguration] = None,
+    timings: Optional[dict[str, float]] = None,
+):
     """
     Analyzes and tags a list of text documents using various NLP models and techniques.
 
@@ -154,311 +404,139 @@ def tag(documents: list[str], lab_configuration):
 
     Args:
         documents (list): A list of text documents (strings) to be analyzed and tagged.
-        nlp: model
-        device: device
-        mappings: labels
+        registry: loaded ModelRegistry (see registry.py) holding every model
+        configuration: how documents are batched trough the models (defaults
+            to InferenceConfiguration())
+        timings: if provided, filled with the wall time of each head
 
     Returns:
-        list: A list of dictionaries, where each dictionary represents a single input text and
+        list: A list of Analysis, where each Analysis represents a single input text and
               contains various processed data like embeddings, text classifications, sentiment, etc.,
-              as key-value pairs.
+              as key-value pairs. Heads results are kept in float32 matrices (see LabelScores)
+              until the Analysis are built.
     """
-    nlp = lab_configuration["nlp"]
-    device = lab_configuration["device"]
-    mappings = lab_configuration["mappings"]
-
-    def predict(text, pipe, tag, mappings):
-        preds = pipe.predict(text, verbose=0)[0]
-        result = []
-        for i in range(len(preds)):
-            result.append((mappings[tag][i], float(preds[i])))
-        return result
+    configuration = configuration or InferenceConfiguration()
+    mappings = registry.mappings
+    tokenizer = registry.get("tokenizer")
+
+    def predict(custom_model, length=None):
+        # one predict per bucket, `length` None pads to the bucket's longest
+        def infer(input_ids):
+            return custom_model.predict(
+                pad_input_ids(
+                    input_ids,
+                    length or max(len(ids) for ids in input_ids),
+                    tokenizer.pad_token_id
+                ),
+                verbose=0,
+                batch_size=len(input_ids),
+            )
+        return infer
 
     # get text content attribute from all items
     for doc in documents:
         assert isinstance(doc, str)
-
-    # Create an empty DataFrame
-    tmp = pd.DataFrame()
-
-    # Add the original text documents
-    tmp["Translation"] = documents
-
-    assert tmp["Translation"] is not None
-    assert len(tmp["Translation"]) > 0
-
-    # Compute sentence embeddings
-    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-    tmp["Embedding"] = tmp["Translation"].swifter.apply(
-        lambda x: list(model.encode(x).astype(float))
-    )
-
-    # Text classification pipelines
-    text_classification_models = [
-        ("Emotion", "SamLowe/roberta-base-go_emotions"),
-        ("Irony", "cardiffnlp/twitter-roberta-base-irony"),
-        ("LanguageScore", "salesken/query_wellformedness_score"),
-        ("TextType", "marieke93/MiniLM-evidence-types"),
-    ]
-    for col_name, model_name in text_classification_models:
-        pipe = pipeline(
-            "text-classification",
-            model=model_name,
-            top_k=None,
-            device=device,
-            max_length=512,
-            padding=True,
-        )
-        tmp[col_name] = tmp["Translation"].swifter.apply(
-            lambda x: [(y["label"], float(y["score"])) for y in pipe(x)[0]]
-        )
-        del pipe  # free ram for latest pipe
-
-    # Tokenization for custom models
-    tokenizer = AutoTokenizer.from_pretrained("bert-large-uncased")
-    tmp["Embedded"] = tmp["Translation"].swifter.apply(
-        lambda x: np.array(
-            tokenizer.encode_plus(
-                x,
-                add_special_tokens=True,
-                max_length=512,
-                truncation=True,
-                padding="max_length",
-                return_attention_mask=False,
-                return_tensors="tf",
-            )["input_ids"][0]
-        ).reshape(1, -1)
-    )
-
-    # Sentiment analysis using VADER
-    emoji_lexicon = hf_hub_download(
-        repo_id="ExordeLabs/SentimentDetection",
-        filename="emoji_unic_lexicon.json",
-    )
-    loughran_dict = hf_hub_download(
-        repo_id="ExordeLabs/SentimentDetection", filename="loughran_dict.json"
-    )
-    with open(emoji_lexicon) as f:
-        unic_emoji_dict = json.load(f)
-    with open(loughran_dict) as f:
-        Loughran_dict = json.load(f)
-    sentiment_analyzer = SentimentIntensityAnalyzer()
-    sentiment_analyzer.lexicon.update(Loughran_dict)
-    sentiment_analyzer.lexicon.update(unic_emoji_dict)
-
-    
-    ############################
-    # financial distilroberta
-    fdb_tokenizer = AutoTokenizer.from_pretrained(
-        "mrm8488/distilroberta-finetuned-financial-news-sentiment-analysis"
-    )
-    fdb_model = AutoModelForSequenceClassification.from_pretrained(
-        "mrm8488/distilroberta-finetuned-financial-news-sentiment-analysis"
-    )
-    ############################
-    # distilbert sentiment
-    gdb_tokenizer = AutoTokenizer.from_pretrained(
-        "lxyuan/distilbert-base-multilingual-cased-sentiments-student"
-    )
-    gdb_model = AutoModelForSequenceClassification.from_pretrained(
-        "lxyuan/distilbert-base-multilingual-cased-sentiments-student"
-    )
-    ############################
-
-    fdb_pipe = pipeline(
-        "text-classification",
-        model=fdb_model,
-        tokenizer=fdb_tokenizer,
-        top_k=None, 
-        max_length=512,
-        padding=True,
-    )
-
-    gdb_pipe = pipeline(
-        "text-classification",
-        model=gdb_model,
-        tokenizer=gdb_tokenizer,
-        top_k=None, 
-        max_length=512,
-        padding=True,
-    )
-
-    def vader_sentiment(text):
-        # predict financial sentiment 
-        return round(sentiment_analyzer.polarity_scores(text)["compound"],2)
-    
-    def fin_vader_sentiment(text):
-        # predict general sentiment 
-        return round(finvader(text, 
-                        use_sentibignomics = True, 
-                        use_henry = True, 
-                        indicator = 'compound' ),2)
-
-    def fdb_sentiment(text):
-        prediction = fdb_pipe(text)
-        fdb_sentiment_dict = {}
-        for e in prediction[0]:
-            if e["label"] == "negative":
-                fdb_sentiment_dict["negative"] = round(e["score"],3)
-            elif e["label"] == "neutral":
-                fdb_sentiment_dict["neutral"] =  round(e["score"],3)
-            elif e["label"] == "positive":
-                fdb_sentiment_dict["positive"] =  round(e["score"],3)
-        # compounded score
-        fdb_compounded_score = round((fdb_sentiment_dict["positive"] - fdb_sentiment_dict["negative"]),3)
-        return fdb_compounded_score
-
-    def gdb_sentiment(text):
-        # predict general sentiment 
-        prediction = gdb_pipe(text)
-        gen_distilbert_sent = {}
-        for e in prediction[0]:
-            if e["label"] == "negative":
-                gen_distilbert_sent["negative"] = round(e["score"],3)
-            elif e["label"] == "neutral":
-                gen_distilbert_sent["neutral"] =  round(e["score"],3)
-            elif e["label"] == "positive":
-                gen_distilbert_sent["positive"] =  round(e["score"],3)
-        # compounded score
-        gdb_score = round((gen_distilbert_sent["positive"] - gen_distilbert_sent["negative"]),3)
-        return gdb_score
-    
-    def compounded_financial_sentiment(text):
-        #  65% financial distil roberta model + 35% fin_vader_score
-        fin_vader_sent = fin_vader_sentiment(text)
-        fin_distil_score = fdb_sentiment(text)
-        fin_compounded_score = round((0.70 * fin_distil_score + 0.30 * fin_vader_sent),2)
-        return fin_compounded_score
-        
-    def compounded_sentiment(text):
-        # compounded_total_score: gen_distilbert_sentiment * 60% + vader_sentiment * 20% + compounded_fin_sentiment * 20%
-        gen_distilbert_sentiment = gdb_sentiment(text)
-        vader_sent = vader_sentiment(text)
-        compounded_fin_sentiment = compounded_financial_sentiment(text)
-        if abs(compounded_fin_sentiment) >= 0.6:
-            compounded_total_score = round((0.30 * gen_distilbert_sentiment + 0.10 * vader_sent + 0.60 * compounded_fin_sentiment),2)
-        elif abs(compounded_fin_sentiment) >= 0.4:
-            compounded_total_score = round((0.40 * gen_distilbert_sentiment + 0.20 * vader_sent + 0.40 * compounded_fin_sentiment),2)
-        elif abs(compounded_fin_sentiment) >= 0.1:
-            compounded_total_score = round((0.60 * gen_distilbert_sentiment + 0.25 * vader_sent + 0.15 * compounded_fin_sentiment),2)
-        else:  # if abs(compounded_fin_sentiment) < 0.1, so no apparent financial component
-            compounded_total_score = round((0.60 * gen_distilbert_sentiment + 0.40 * vader_sent),2)
-        return compounded_total_score
-
-    # sentiment swifter apply compounded_sentiment
-    tmp["Sentiment"] = tmp["Translation"].swifter.apply(compounded_sentiment)
-    
-    # financial sentiment swifter apply compounded_financial_sentiment
-    tmp["FinancialSentiment"] = tmp["Translation"].swifter.apply(compounded_financial_sentiment)
-
-    # Custom model pipelines
-    custom_model_data = [
-        ("Age", "ExordeLabs/AgeDetection", "ageDetection.h5"),
-        ("Gender", "ExordeLabs/GenderDetection", "genderDetection.h5"),
-        # (
-        #     "HateSpeech",
-        #     "ExordeLabs/HateSpeechDetection",
-        #     "hateSpeechDetection.h5",
-        # ),
-    ]
-
-    for col_name, repo_id, file_name in custom_model_data:
-        model_file = hf_hub_download(repo_id=repo_id, filename=file_name)
-        custom_model = tf.keras.models.load_model(
-            model_file,
-            custom_objects={
-                "TokenAndPositionEmbedding": TokenAndPositionEmbedding,
-                "TransformerBlock": TransformerBlock,
-            },
-        )
-        tmp[col_name] = tmp["Embedded"].swifter.apply(
-            lambda x: predict(x, custom_model, col_name, mappings)
-        )
-        del custom_model  # free ram for latest custom_model
-
-    del tmp["Embedded"]
-    # The output is a list of dictionaries, where each dictionary represents a single input text and contains
-    # various processed data like embeddings, text classifications, sentiment, etc., as key-value pairs.
-    # Update the items with processed data
-    tmp = tmp.to_dict(orient="records")
-
-    _out = []
-    for i in range(len(tmp)):
-        language_score = LanguageScore(tmp[i]["LanguageScore"][0][1])
-
-        sentiment = Sentiment(tmp[i]["Sentiment"])
-
-        embedding = Embedding(tmp[i]["Embedding"])
-
-        gender = Gender(
-            male=tmp[i]["Gender"][0][1], female=tmp[i]["Gender"][1][1]
-        )
-
-        types = {item[0]: item[1] for item in tmp[i]["TextType"]}
-        text_type = TextType(
-            assumption=types["Assumption"],
-            anecdote=types["Anecdote"],
-            none=types["None"],
-            definition=types["Definition"],
-            testimony=types["Testimony"],
-            other=types["Other"],
-            study=types["Statistics/Study"],
+    assert len(documents) > 0
+
+    """Heads, see scheduler.py"""
+    def embedding_head(__dependencies__):
+        # Compute sentence embeddings
+        model = registry.get("Embedding")
+        return batched_scores(
+            lambda texts: model.encode(texts, batch_size=len(texts)),
+            documents,
+            configuration
         )
 
-        emotions = {item[0]: item[1] for item in tmp[i]["Emotion"]}
-        emotion = Emotion(
-            love=emotions["love"],
-            admiration=emotions["admiration"],
-            joy=emotions["joy"],
-            approval=emotions["approval"],
-            caring=emotions["caring"],
-            excitement=emotions["excitement"],
-            gratitude=emotions["gratitude"],
-            desire=emotions["desire"],
-            anger=emotions["anger"],
-            optimism=emotions["optimism"],
-            disapproval=emotions["disapproval"],
-            grief=emotions["grief"],
-            annoyance=emotions["annoyance"],
-            pride=emotions["pride"],
-            curiosity=emotions["curiosity"],
-            neutral=emotions["neutral"],
-            disgust=emotions["disgust"],
-            disappointment=emotions["disappointment"],
-            realization=emotions["realization"],
-            fear=emotions["fear"],
-            relief=emotions["relief"],
-            confusion=emotions["confusion"],
-            remorse=emotions["remorse"],
-            embarrassment=emotions["embarrassment"],
-            surprise=emotions["surprise"],
-            sadness=emotions["sadness"],
-            nervousness=emotions["nervousness"],
+    def classification_head(col_name):
+        # Text classification pipelines
+        def run(__dependencies__):
+            pipe = registry.get(col_name)
+            labels = pipeline_labels(pipe)
+            return LabelScores(labels, batched_scores(
+                classify_scores(pipe, labels), documents, configuration
+            ))
+        return run
+
+    def tokenize_head(__dependencies__):
+        # Tokenization for custom models, done once for the batch and shared
+        # by every head (padding is applied per bucket)
+        return tokenizer(
+            documents,
+            add_special_tokens=True,
+            max_length=MAX_LENGTH,
+            truncation=True,
+            return_attention_mask=False,
+        )["input_ids"]
+
+    def sentiment_head(name):
+        # Sentiment ensemble, every sub-model runs once per document
+        return lambda __dependencies__: sentiment_component(
+            name, documents, registry, configuration
         )
 
-        ironies = {item[0]: item[1] for item in tmp[i]["Irony"]}
-
-        irony = Irony(irony=ironies["irony"], non_irony=ironies["non_irony"])
-
-        ages = {item[0]: item[1] for item in tmp[i]["Age"]}
-
-        age = Age(
-            below_twenty=ages["<20"],
-            twenty_thirty=ages["20<30"],
-            thirty_forty=ages["30<40"],
-            forty_more=ages[">=40"],
-        )
-
-        analysis = Analysis(
-            language_score=language_score,
-            sentiment=sentiment,
-            embedding=embedding,
-            gender=gender,
-            text_type=text_type,
-            emotion=emotion,
-            irony=irony,
-            age=age,
+    def custom_head(col_name):
+        # Custom model pipelines
+        def run(dependencies):
+            custom_model = registry.get(col_name)
+            length = (
+                None if allows_dynamic_padding(custom_model, tokenizer)
+                else MAX_LENGTH
+            )
+            mapping = mappings[col_name]
+            return LabelScores(
+                tuple(mapping[i] for i in range(len(mapping))),
+                batched_scores(
+                    predict(custom_model, length),
+                    dependencies["tokenize"],
+                    configuration
+                )
+            )
+        return run
+
+    classifications = ["Emotion", "Irony", "LanguageScore", "TextType"]
+    results, seconds = run_heads(
+        [
+            Head("Embedding", embedding_head),
+            *[Head(name, classification_head(name)) for name in classifications],
+            *[Head(name, sentiment_head(name)) for name in SENTIMENT_COMPONENTS],
+            Head("tokenize", tokenize_head),
+            Head("Age", custom_head("Age"), ("tokenize",)),
+            Head("Gender", custom_head("Gender"), ("tokenize",)),
+        ],
+        configuration.concurrent_heads,
+        configuration.intra_op_threads,
+    )
+    if timings is not None:
+        timings.update(seconds)
+
+    components = {name: results[name] for name in SENTIMENT_COMPONENTS}
+    sentiments = compounded_sentiment(
+        components, compounded_financial_sentiment(components)
+    ).tolist()
+
+    # every head is converted to python floats in bulk, then the Analysis
+    # are assembled per document
+    embeddings = results["Embedding"].tolist()
+    # top score of the LanguageScore model
+    language_scores = results["LanguageScore"].scores.max(axis=1).tolist()
+    # Gender is positional, in the order of the mapping's indexes
+    genders = results["Gender"].scores[:, :2].tolist()
+    text_types = label_rows(results["TextType"], TEXT_TYPE_LABELS)
+    emotions = label_rows(results["Emotion"], EMOTION_LABELS)
+    ironies = label_rows(results["Irony"], IRONY_LABELS)
+    ages = label_rows(results["Age"], AGE_LABELS)
+
+    return [
+        Analysis(
+            language_score=LanguageScore(language_scores[i]),
+            sentiment=Sentiment(sentiments[i]),
+            embedding=Embedding(embeddings[i]),
+            gender=Gender(male=genders[i][0], female=genders[i][1]),
+            text_type=TextType(**text_types[i]),
+            emotion=Emotion(**emotions[i]),
+            irony=Irony(**ironies[i]),
+            age=Age(**ages[i]),
         )
-
-        _out.append(analysis)
-    return _out
+        for i in range(len(documents))
+    ]
@@ -0,0 +1,81 @@
+import os
+import pytest
+import numpy as np
+
+pytest.importorskip("optimum.onnxruntime")
+
+# the models are downloaded from the hugging face hub, opt-in
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('SPOTTING_NETWORK_TESTS'),
+    reason='network test, set SPOTTING_NETWORK_TESTS=1 to run it'
+)
+
+from blades.spotting.registry import ModelRegistry, SPOTTING_MODELS
+
+"""
+Parity of the CPU backends with the torch fp32 models, the int8 tolerance is
+the accuracy we accept to trade for throughput.
+"""
+TOLERANCES = {
+    'onnx': 1e-3,
+    'onnx-int8': 0.1,
+}
+
+DOCUMENTS = [
+    "Bitcoin rallied 10% after the ETF approval, traders are euphoric.",
+    "The central bank kept rates unchanged, citing persistent inflation.",
+    "I can't believe they cancelled the show, what a great decision...",
+    "Photosynthesis converts light energy into chemical energy.",
+]
+
+
+def scores(pipe) -> np.ndarray:
+    """label-sorted scores of a text-classification pipeline"""
+    return np.array([
+        [y["score"] for y in sorted(prediction, key=lambda y: y["label"])]
+        for prediction in pipe(DOCUMENTS, batch_size=len(DOCUMENTS))
+    ])
+
+
+@pytest.mark.parametrize("backend", ['onnx', 'onnx-int8'])
+@pytest.mark.parametrize("name", ['fdb', 'Irony'])
+def test_text_classification_parity(tmp_path, backend, name):
+    specs = [spec for spec in SPOTTING_MODELS if spec.name == name]
+    reference = ModelRegistry(specs, cache_dir=str(tmp_path / 'reference'))
+    candidate = ModelRegistry(
+        specs, backends={name: backend}, cache_dir=str(tmp_path)
+    )
+    reference.load()
+    candidate.load()
+    assert np.abs(
+        scores(reference.get(name)) - scores(candidate.get(name))
+    ).max() <= TOLERANCES[backend]
+
+
+@pytest.mark.parametrize("backend", ['onnx', 'onnx-int8'])
+def test_embedding_parity(tmp_path, backend):
+    specs = [spec for spec in SPOTTING_MODELS if spec.name == 'Embedding']
+    reference = ModelRegistry(specs, cache_dir=str(tmp_path / 'reference'))
+    candidate = ModelRegistry(
+        specs, backends={'Embedding': backend}, cache_dir=str(tmp_path)
+    )
+    reference.load()
+    candidate.load()
+    expected = reference.get('Embedding').encode(DOCUMENTS)
+    result = candidate.get('Embedding').encode(DOCUMENTS)
+    assert result.shape == expected.shape
+    assert np.abs(result - expected).max() <= TOLERANCES[backend]
+
+
+def test_export_is_cached(tmp_path):
+    specs = [spec for spec in SPOTTING_MODELS if spec.name == 'Irony']
+    ModelRegistry(
+        specs, backends={'Irony': 'onnx-int8'}, cache_dir=str(tmp_path)
+    ).load()
+    exported = sorted(p.name for p in tmp_path.glob('*/*/*'))
+    assert exported == ['onnx', 'onnx-int8']
+    # a second registry reuses the cached export
+    ModelRegistry(
+        specs, backends={'Irony': 'onnx-int8'}, cache_dir=str(tmp_path)
+    ).load()
+    assert sorted(p.name for p in tmp_path.glob('*/*/*')) == exported
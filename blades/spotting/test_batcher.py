@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+
+from blades.spotting.batcher import AdaptiveBatcher, Overloaded
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_flushes_when_full():
+    batches = []
+    async def process(items):
+        batches.append(items)
+
+    async def scenario():
+        batcher = AdaptiveBatcher(process, min_size=3, max_wait_seconds=60)
+        assert [batcher.add(i) for i in range(4)] == [0, 0, 3, 0]
+        await batcher.stop()
+        return batcher
+
+    batcher = run(scenario)
+    assert batches == [[0, 1, 2], [3]]
+    assert batcher.status()['batch_sizes']['count'] == 2
+
+
+def test_flushes_on_deadline():
+    batches = []
+    async def process(items):
+        batches.append(items)
+
+    async def scenario():
+        batcher = AdaptiveBatcher(process, min_size=100, max_wait_seconds=0.05)
+        batcher.add('item')
+        await asyncio.sleep(0.1)
+        assert batches == [['item']]
+        assert batcher.waits.count == 1
+
+    run(scenario)
+
+
+def test_size_follows_latency():
+    latency = {'seconds': 0.0}
+    async def process(items):
+        await asyncio.sleep(latency['seconds'])
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=2, max_size=8, max_wait_seconds=60,
+            latency_budget_seconds=0.05, growth=2
+        )
+        for __i__ in range(2): # fast full batches, grows up to max_size
+            for i in range(batcher.size):
+                batcher.add(i)
+            await asyncio.gather(*batcher.running)
+        assert batcher.size == 8
+        latency['seconds'] = 0.1 # over budget, shrinks
+        for i in range(batcher.size):
+            batcher.add(i)
+        await asyncio.gather(*batcher.running)
+        assert batcher.size == 4
+
+    run(scenario)
+
+
+def test_size_follows_the_processing_latency():
+    async def process(items):
+        await asyncio.sleep(0.1) # a slow upload, over budget
+        return 0.001 if items[0] else None # fast tagging, or nothing tagged
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=2, max_size=8, max_wait_seconds=60,
+            latency_budget_seconds=0.05, growth=2,
+            processing_latency=lambda seconds: seconds,
+        )
+        for i in range(batcher.size):
+            batcher.add(True)
+        await asyncio.gather(*batcher.running)
+        assert batcher.size == 5 # grows despite the whole latency
+        assert batcher.last_latency >= 0.1
+        assert batcher.last_processing_latency == 0.001
+        for i in range(batcher.size):
+            batcher.add(False)
+        await asyncio.gather(*batcher.running)
+        assert batcher.size == 5 # nothing to adapt to
+        assert batcher.retry_after() == 1
+
+    run(scenario)
+
+
+def test_admission_budget():
+    done = asyncio.Event()
+    async def process(items):
+        await done.wait()
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=2, max_wait_seconds=60, max_items=3, max_bytes=25
+        )
+        batcher.add('a', 10)
+        batcher.add('b', 10)
+        with pytest.raises(Overloaded): # bytes
+            batcher.add('c', 10)
+        batcher.add('c', 5)
+        with pytest.raises(Overloaded): # items
+            batcher.add('d', 1)
+        done.set()
+        await asyncio.gather(*batcher.running) # releases a and b
+        batcher.add('d', 1)
+        assert batcher.admitted_items == 2
+        assert batcher.status()['rejected'] == 2
+
+    run(scenario)
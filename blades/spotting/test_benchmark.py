@@ -0,0 +1,15 @@
+from blades.spotting.benchmark import benchmark, corpus, parse_arguments
+
+
+def test_corpus():
+    documents = corpus(200, mean_words=20, duplicates=0.5, seed=1)
+    assert len(documents) == 200
+    assert 50 < len(documents) - len(set(documents)) < 150
+    assert corpus(200, mean_words=20, duplicates=0.5, seed=1) == documents
+
+
+def test_benchmark_with_stub_models():
+    report = benchmark(parse_arguments(['--documents', '40', '--batch-size', '16']))
+    assert report['documents'] == 40 and report['batches'] == 3
+    assert report['docs_per_second'] > 0
+    assert {'Embedding', 'Emotion', 'Age', 'Gender'} <= set(report['head_latency'])
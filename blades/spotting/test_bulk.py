@@ -0,0 +1,97 @@
+import gzip
+import json
+import asyncio
+import pytest
+from types import SimpleNamespace
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from blades.spotting.batcher import AdaptiveBatcher
+from blades.spotting.bulk import add_bulk, decompress, split_items
+
+ITEMS = [{'url': 'https://x.com/{}'.format(i), 'content': 'gm'} for i in range(3)]
+
+
+def test_split_items():
+    ndjson = '\n'.join(json.dumps(item) for item in ITEMS) + '\n{broken\n\n'
+    items = split_items(ndjson.encode())
+    assert [json.loads(item) for item, __domain__, __keys__ in items[:3]] == ITEMS
+    assert isinstance(items[3], ValueError)
+    assert [
+        json.loads(item)
+        for item, __domain__, __keys__ in split_items(json.dumps(ITEMS).encode())
+    ] == ITEMS
+    news = {'item': {'domain': 'reuters.com', 'external_id': 'n1'}}
+    assert split_items(json.dumps(news).encode()) == [
+        (json.dumps(news), 'reuters.com', ['external_id:reuters.com:n1'])
+    ]
+
+
+def test_decompress():
+    body = json.dumps(ITEMS).encode()
+    assert decompress(gzip.compress(body), 'gzip') == body
+    assert decompress(body, 'gzip') == body # already inflated by aiohttp
+    with pytest.raises(ValueError):
+        decompress(gzip.compress(body)[:-8], 'gzip')
+
+
+def test_decompress_lz4():
+    lz4_frame = pytest.importorskip('lz4.frame')
+    body = json.dumps(ITEMS).encode()
+    assert decompress(lz4_frame.compress(body), 'lz4') == body
+
+
+def test_bulk_results():
+    batches = []
+    async def process(items):
+        batches.append(items)
+
+    async def scenario():
+        app = web.Application()
+        app['warm_start'] = SimpleNamespace(ready=True)
+        app['batcher'] = AdaptiveBatcher(
+            process, min_size=10, max_wait_seconds=60, max_items=2
+        )
+        app.router.add_post('/push/bulk', add_bulk)
+        async with TestClient(TestServer(app)) as client:
+            body = '\n'.join(
+                [json.dumps(ITEMS[0]), 'nope', json.dumps(ITEMS[1]), json.dumps(ITEMS[2])]
+            )
+            response = await client.post('/push/bulk', data=body)
+            assert response.status == 200
+            result = await response.json()
+            assert result['accepted'] == 2
+            assert [r['status'] for r in result['results']] == [
+                'accepted', 'invalid', 'accepted', 'retry'
+            ]
+            response = await client.post(
+                '/push/bulk',
+                data=gzip.compress(json.dumps(ITEMS).encode()),
+                headers={'Content-Encoding': 'gzip'}
+            )
+            assert response.status == 429 # budget is full
+            assert 'Retry-After' in response.headers
+            await app['batcher'].stop()
+        assert [json.loads(item) for item in batches[0]] == ITEMS[:2]
+
+    asyncio.run(scenario())
+
+
+def test_bulk_budget_counts_bytes():
+    async def process(items):
+        pass
+
+    async def scenario():
+        app = web.Application()
+        app['warm_start'] = SimpleNamespace(ready=True)
+        app['batcher'] = AdaptiveBatcher(process, min_size=10, max_wait_seconds=60)
+        app.router.add_post('/push/bulk', add_bulk)
+        item = json.dumps({'content': 'café ☕'}, ensure_ascii=False)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post('/push/bulk', data=item.encode())
+            assert (await response.json())['accepted'] == 1
+            assert app['batcher'].admitted_bytes == len(item.encode('utf-8'))
+            assert app['batcher'].admitted_bytes > len(item)
+            await app['batcher'].stop()
+
+    asyncio.run(scenario())
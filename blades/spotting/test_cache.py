@@ -0,0 +1,101 @@
+import asyncio
+
+from blades.spotting import cache as cache_module
+from blades.spotting.cache import AnalysisCache, tag_with_cache
+from blades.spotting.registry import ModelRegistry, ModelSpec
+from blades.spotting.stubs import StubRegistry
+from blades.spotting.tag import tag
+
+
+class Clock:
+    def __init__(self, monkeypatch, now: float = 1000.0):
+        self.now = now
+        monkeypatch.setattr(cache_module.time, 'time', lambda: self.now)
+
+
+def test_memory_evicts_the_least_recently_used():
+    cache = AnalysisCache(capacity=2)
+    cache.put_many({'a': {'v': 1}, 'b': {'v': 2}})
+    assert cache.get_many(['a']) == {'a': {'v': 1}} # b is now the oldest
+    cache.put_many({'c': {'v': 3}})
+    assert list(cache.memory) == ['a', 'c']
+    assert cache.get_many(['a', 'b', 'c']) == {'a': {'v': 1}, 'c': {'v': 3}}
+    assert cache.status()['hits'] == 3 and cache.status()['misses'] == 1
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    cache = AnalysisCache(ttl_seconds=60, path=str(tmp_path / 'cache.db'))
+    cache.put_many({'a': {'v': 1}})
+    clock.now += 30
+    assert cache.get_many(['a']) == {'a': {'v': 1}}
+    clock.now += 31
+    assert cache.get_many(['a']) == {}
+    assert 'a' not in cache.memory
+    cache.evict() # the disk layer too
+    assert cache._db.execute('SELECT COUNT(*) FROM analysis').fetchone() == (0,)
+
+
+def test_disk_keeps_the_newest_entries(tmp_path, monkeypatch):
+    clock = Clock(monkeypatch)
+    path = str(tmp_path / 'cache.db')
+    cache = AnalysisCache(path=path, max_disk_entries=2)
+    for key in 'abc':
+        clock.now += 1
+        cache.put_many({key: {'v': key}})
+    cache.evict()
+    keys = cache._db.execute('SELECT key FROM analysis').fetchall()
+    assert sorted(key for key, in keys) == ['b', 'c']
+
+
+def test_key_includes_the_model_set_version():
+    assert AnalysisCache.key(' a  text', 'v1') == AnalysisCache.key('a text', 'v1')
+    assert AnalysisCache.key('a text', 'v1') != AnalysisCache.key('a text', 'v2')
+    registry = ModelRegistry([
+        ModelSpec('Emotion', 'org/emotion', 'text-classification')
+    ])
+    latest = registry.version
+    registry.resolved['Emotion'] = 'c1' # latest resolved to a commit
+    assert registry.version != latest
+    resolved = registry.version
+    registry.resolved['Emotion'] = 'c2' # a new commit on the hub
+    assert registry.version not in (latest, resolved)
+    pinned = ModelRegistry(
+        [ModelSpec('Emotion', 'org/emotion', 'text-classification')],
+        revisions={'Emotion': 'c2'}
+    )
+    assert pinned.version == registry.version
+
+
+class CountingExecutor:
+    """`tag` over the stub models, in the loop, counting the tagged texts"""
+    def __init__(self):
+        self.registry = StubRegistry()
+        self.registry.load()
+        self.tagged: list[str] = []
+
+    async def tag(self, documents, configuration):
+        self.tagged.extend(documents)
+        return tag(documents, self.registry, configuration)
+
+
+def test_tag_with_cache(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    executor = CountingExecutor()
+    documents = ['first text', 'second text', 'first  text']
+
+    async def scenario(cache):
+        return await tag_with_cache(documents, executor, None, cache)
+
+    result = asyncio.run(scenario(AnalysisCache(path=path)))
+    assert executor.tagged == ['first text', 'second text'] # repeated once
+    assert result[0] == result[2]
+    # a restarted blade reads the analysis from disk
+    restarted = AnalysisCache(path=path)
+    assert asyncio.run(scenario(restarted)) == result
+    assert executor.tagged == ['first text', 'second text']
+    assert restarted.status()['disk_hits'] == 2
+    # new models, nothing is reused
+    executor.registry.resolved['Emotion'] = 'c1'
+    asyncio.run(scenario(restarted))
+    assert len(executor.tagged) == 4
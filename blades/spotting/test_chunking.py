@@ -0,0 +1,32 @@
+from blades.spotting.chunking import Chunker, estimated_tokens, pack, punctuation_split
+
+
+def chunker(max_tokens: int) -> Chunker:
+    result = Chunker(max_tokens=max_tokens)
+    result.segmenter = punctuation_split
+    result.counter = lambda texts: [len(text.split()) for text in texts]
+    return result
+
+
+def test_pack():
+    sentences = ['a b c.', 'd e.', 'f g h i.', 'j.']
+    assert pack(sentences, [3, 2, 4, 1], 5) == ['a b c. d e.', 'f g h i. j.']
+    # a sentence over the budget is cut on words
+    assert pack(['a b c d e f g h.'], [8], 4) == ['a b c d', 'e f g h.']
+
+
+def test_split_long_texts_only():
+    splitter = chunker(6)
+    long = 'One two three four. Five six seven. Eight nine ten eleven twelve.'
+    result = splitter.split(['Short text.', long])
+    assert result[0] == ['Short text.']
+    assert result[1] == [
+        'One two three four.', 'Five six seven.', 'Eight nine ten eleven twelve.'
+    ]
+    assert all(count <= 6 for count in splitter.counter(result[1]))
+    assert splitter.status()['chunked'] == 1
+    assert splitter.status()['chunks'] == 4
+
+
+def test_estimated_tokens():
+    assert estimated_tokens(['a b c d e', '']) == [8, 1]
@@ -0,0 +1,70 @@
+import asyncio
+import random
+
+from blades.spotting.batcher import AdaptiveBatcher
+from blades.spotting.controller import LatencyController
+
+
+def latency(documents: int, rng: random.Random) -> float:
+    return 0.5 + 0.01 * documents + rng.uniform(0, 0.1)
+
+
+def test_converges_to_the_target():
+    rng = random.Random(0)
+    controller = LatencyController(target_p95_seconds=2.0)
+    size = 10
+    assert controller.next_size(size, 1, 1000) is None # no model yet
+    for __i__ in range(40):
+        controller.observe(size, size * 500, latency(size, rng))
+        size = controller.next_size(size, 1, 1000) or size + rng.randint(1, 20)
+    # 0.5 + 0.01 * size + noise <= 2.0
+    assert 130 <= size <= 150
+    status = controller.status()
+    assert abs(status['model']['seconds_per_document'] * 1 +
+               status['model']['seconds_per_byte'] * 500 - 0.01) < 0.002
+    assert status['last_decision']['predicted_p95_seconds'] <= 2.0
+
+
+def test_batcher_follows_the_controller():
+    async def process(items):
+        await asyncio.sleep(0.001 * len(items))
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=4, max_size=64, max_wait_seconds=60,
+            controller=LatencyController(0.02, min_observations=3)
+        )
+        for __i__ in range(12):
+            for i in range(batcher.size):
+                batcher.add(i, 100)
+            await asyncio.gather(*batcher.running)
+        return batcher
+
+    batcher = asyncio.run(scenario())
+    assert 4 < batcher.size < 64 # grew, then held by the 20ms target
+    assert batcher.status()['controller']['decisions'] > 0
+
+
+def test_controller_observes_the_processing_latency():
+    async def process(items):
+        await asyncio.sleep(0.05) # waits for an upload
+        return 0.001 * len(items)
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=4, max_size=64, max_wait_seconds=60,
+            controller=LatencyController(0.02, min_observations=3),
+            processing_latency=lambda seconds: seconds,
+        )
+        for __i__ in range(3):
+            for i in range(batcher.size):
+                batcher.add(i, 100)
+            await asyncio.gather(*batcher.running)
+        return batcher
+
+    batcher = asyncio.run(scenario())
+    observations = list(batcher.controller.observations)
+    assert len(observations) == 3 and batcher.last_latency >= 0.05
+    assert all( # not the upload's wait
+        latency == 0.001 * documents for documents, __s__, latency in observations
+    )
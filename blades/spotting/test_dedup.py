@@ -0,0 +1,63 @@
+import json
+import pytest
+
+from blades.spotting.dedup import (
+    DedupIndex, Duplicate, content_key, header_keys, item_keys
+)
+
+
+def pushed(url: str, external_id: str = None) -> dict:
+    item = {'url': url, 'domain': 'reddit.com'}
+    if external_id:
+        item['external_id'] = external_id
+    return {'item': item}
+
+
+def check(index: DedupIndex, data: dict):
+    index.check(json.dumps(data), item_keys(data))
+
+
+def test_item_keys():
+    assert item_keys(pushed('https://a', 'e1')) == [
+        'url:https://a', 'external_id:reddit.com:e1'
+    ]
+    assert item_keys({'url': 'https://a'}) == ['url:https://a']
+    assert item_keys(['not', 'an item']) == []
+    assert header_keys({
+        'X-Item-Url': 'https://a', 'X-Item-Id': 'e1', 'X-Item-Domain': 'reddit.com'
+    }) == item_keys(pushed('https://a', 'e1'))
+    assert header_keys({}) == []
+
+
+def test_duplicates_are_dropped_until_the_ttl():
+    index = DedupIndex(ttl_seconds=60, memory_bytes=1024, buckets=3)
+    check(index, pushed('https://a', 'e1'))
+    with pytest.raises(Duplicate): # same url
+        check(index, pushed('https://a'))
+    with pytest.raises(Duplicate): # same external_id
+        check(index, pushed('https://b', 'e1'))
+    check(index, pushed('https://c'))
+    index.rotate(index.rotated_at + 61) # every bucket expired
+    check(index, pushed('https://a', 'e1'))
+    assert index.status()['duplicates'] == 2
+
+
+def test_items_without_keys_are_keyed_by_content():
+    index = DedupIndex(memory_bytes=1024)
+    index.check('{"content": "gm"}')
+    index.check('{"content": "gn"}')
+    with pytest.raises(Duplicate) as duplicate:
+        index.check('{"content": "gm"}', [])
+    assert str(duplicate.value) == content_key('{"content": "gm"}')
+
+
+def test_memory_is_fixed():
+    index = DedupIndex(memory_bytes=4096, buckets=4)
+    for i in range(5000):
+        try:
+            check(index, pushed('https://x/{}'.format(i)))
+        except Duplicate:
+            pass
+    status = index.status()
+    assert status['memory_bytes'] == 4096
+    assert status['keys'] + status['duplicates'] == 5000
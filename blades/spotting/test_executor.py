@@ -0,0 +1,140 @@
+import asyncio
+import pytest
+
+from blades.spotting.chunking import Chunker, punctuation_split
+from blades.spotting.executor import InferenceError, InferenceExecutor
+from blades.spotting.registry import ModelRegistry
+
+
+class FakeQueue(list):
+    def put(self, message):
+        self.append(message)
+
+
+def executor(workers: int, dispatch: str = 'least_busy') -> InferenceExecutor:
+    """an executor which workers are queues, spawn does not start processes"""
+    result = InferenceExecutor(ModelRegistry([]), workers, dispatch)
+    result.tasks = [FakeQueue() for __i__ in range(workers)]
+    result.processes = [None] * workers
+    result.in_flight = {worker_id: 0 for worker_id in range(workers)}
+    result.restarts = {worker_id: 0 for worker_id in range(workers)}
+    result.ready_workers = set(range(workers))
+    def spawn(worker_id: int):
+        result.tasks[worker_id] = FakeQueue()
+        result.starting.add(worker_id)
+    result.spawn = spawn
+    return result
+
+
+def test_dispatch():
+    least_busy = executor(3)
+    least_busy.in_flight = {0: 2, 1: 0, 2: 1}
+    assert least_busy.pick() == 1
+    round_robin = executor(3, 'round_robin')
+    round_robin.ready_workers = {0, 2}
+    assert [round_robin.pick() for __i__ in range(4)] == [0, 2, 0, 2]
+
+
+async def run_respawn():
+    pool = executor(2)
+    future = pool.submit(0, 'tag', (['text'], None))
+    pool.respawn(0, exitcode=-9)
+    # sent again to the other (ready) worker
+    assert pool.pending[0].worker_id == 1
+    assert pool.tasks[1] == [('tag', 0, (['text'], None))]
+    assert pool.in_flight == {0: 0, 1: 1} and pool.restarts[0] == 1
+    # the batch kills it's second worker too
+    pool.ready_workers.add(0)
+    pool.respawn(1, exitcode=-9)
+    with pytest.raises(InferenceError):
+        await future
+    assert pool.pending == {} and pool.in_flight == {0: 0, 1: 0}
+
+
+def test_respawn_resends_in_flight_batches():
+    asyncio.run(run_respawn())
+
+
+def failed_start(pool: InferenceExecutor, worker_id: int, payload: str):
+    pool.spawn(worker_id) # respawned, then fails again
+    pool.startup_failed(worker_id, payload)
+
+
+async def run_startup_failures():
+    pool = executor(2)
+    pool.ready_event = asyncio.Event()
+    pool.ready_event.set() # started
+    pool.max_startup_failures = 3
+    failed_start(pool, 1, 'no model')
+    pool.startup_failed(1, 'exit code 1') # it's exit, already counted
+    failed_start(pool, 1, 'no model')
+    assert pool.startup_failures[1] == 2 and 1 not in pool.ready_workers
+    assert pool.respawn_at[1] > 0 and pool.failed_workers == set()
+    future = pool.submit(1, 'tag', (['text'], None))
+    failed_start(pool, 1, 'no model')
+    # given up, it's batches fail and the next ones go to the other worker
+    assert pool.failed_workers == {1} and pool.failure == 'no model'
+    with pytest.raises(InferenceError):
+        await future
+    assert pool.pending == {} and pool.pick() == 0
+    pool.ready_workers.discard(0)
+    for __i__ in range(3):
+        failed_start(pool, 0, 'no model')
+    with pytest.raises(InferenceError):
+        pool.pick()
+
+
+def test_startup_failures_back_off_then_fail():
+    asyncio.run(run_startup_failures())
+
+
+class DeadProcess:
+    exitcode = -9
+
+    def is_alive(self) -> bool:
+        return False
+
+
+async def run_killed_while_loading():
+    pool = executor(1)
+    pool.ready_workers = set()
+    pool.watch_seconds = 0.01
+    pool.ready_event = asyncio.Event() # not started yet
+    pool.spawn(0)
+    pool.processes = [DeadProcess()] # OOM killed before reporting
+    watcher = asyncio.create_task(pool.watch())
+    await asyncio.wait_for(pool.ready_event.wait(), 1)
+    pool.stopping = True
+    await watcher
+    assert pool.failure == 'exit code -9' and pool.starting == set()
+
+
+def test_worker_killed_while_loading_fails_the_start():
+    asyncio.run(run_killed_while_loading())
+
+
+async def run_split():
+    chunker = Chunker(max_tokens=4)
+    chunker.segmenter = punctuation_split
+    chunker.counter = lambda texts: [len(text.split()) for text in texts]
+    in_thread = InferenceExecutor(ModelRegistry([]), 0, chunker=chunker)
+    assert await in_thread.split(['One two. Three four five.', 'Short.']) == [
+        ['One two.', 'Three four five.'], ['Short.']
+    ]
+    # in a worker, which dies : sent again to a ready worker
+    pool = executor(2)
+    pool.chunker = chunker
+    split = asyncio.create_task(pool.split(['a text']))
+    await asyncio.sleep(0)
+    pool.respawn(pool.pending[0].worker_id, exitcode=-9)
+    assert pool.tasks[pool.pending[0].worker_id] == [('split', 0, ['a text'])]
+    # the worker's chunks are counted by the blade's chunker
+    pool.pending.pop(0).future.set_result(([['a', 'text']], 0.5))
+    assert await split == [['a', 'text']]
+    return chunker
+
+
+def test_split_runs_out_of_the_loop():
+    chunker = asyncio.run(run_split())
+    assert chunker.status()['texts'] == 3 and chunker.status()['chunks'] == 5
+    assert chunker.status()['segmentation_seconds'] >= 0.5
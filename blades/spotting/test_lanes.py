@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+
+from blades.spotting.batcher import AdaptiveBatcher, Overloaded
+from blades.spotting.lanes import FairQueue, item_domain, lane_key
+
+SOCIAL = ('10.0.0.1', 'reddit.com')
+NEWS = ('10.0.0.2', 'reuters.com')
+
+
+def test_lane_key():
+    assert lane_key('10.0.0.2', item_domain({'item': {'domain': 'reuters.com'}})) == NEWS
+    assert lane_key(None, item_domain(['not', 'an', 'item'])) == ('', '')
+
+
+def test_weighted_fair_batches():
+    queue = FairQueue(weights={'reuters.com': 3})
+    for i in range(100):
+        queue.push(SOCIAL, 's{}'.format(i), 1)
+    for i in range(10):
+        queue.push(NEWS, 'n{}'.format(i), 1)
+    batch = [item for item, __size__, __at__ in queue.pop(8)]
+    # the news lane gets 3 items for each social one, despite the backlog
+    assert sum(item.startswith('n') for item in batch) == 6
+    assert batch[:3] == ['n0', 'n1', 's0']
+    assert len(queue) == 102
+    lanes = queue.status()['lanes']
+    assert lanes['10.0.0.2/reuters.com']['served'] == 6
+    assert lanes['10.0.0.1/reddit.com']['depth'] == 98
+
+
+def test_idle_lane_does_not_bank_credit():
+    queue = FairQueue()
+    for i in range(10):
+        queue.push(SOCIAL, 's', 1)
+    queue.pop(10)
+    for i in range(4):
+        queue.push(SOCIAL, 's', 1)
+        queue.push(NEWS, 'n', 1)
+    assert [item for item, __s__, __a__ in queue.pop(4)].count('n') == 2
+
+
+def test_backlog_waits_in_lanes():
+    release = asyncio.Event()
+    batches = []
+    async def process(items):
+        batches.append(items)
+        await release.wait()
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=2, max_wait_seconds=60, max_items=10,
+            queue=FairQueue(max_share=0.5), max_running=1
+        )
+        batcher.add('s0', 1, SOCIAL)
+        batcher.add('s1', 1, SOCIAL) # full, running
+        for i in range(2, 7):
+            batcher.add('s{}'.format(i), 1, SOCIAL)
+        with pytest.raises(Overloaded) as overloaded: # over it's share
+            batcher.add('s7', 1, SOCIAL)
+        assert overloaded.value.lane == SOCIAL
+        batcher.add('n0', 1, NEWS) # other lanes are still admitted
+        assert len(batcher.queue) == 6 and len(batcher.running) == 1
+        release.set()
+        await batcher.stop()
+
+    asyncio.run(scenario())
+    assert batches[0] == ['s0', 's1']
+    assert batches[1] == ['s2', 'n0'] # the news item does not wait the backlog
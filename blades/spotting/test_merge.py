@@ -0,0 +1,75 @@
+import random
+import pytest
+
+pytest.importorskip("exorde.models")
+pytest.importorskip("exorde_data")
+
+from exorde.models import (
+    ProtocolItem,
+    ProtocolAnalysis,
+    ProcessedItem,
+    CollectionClientVersion,
+    CollectedAt,
+    CollectionModule,
+    Classification,
+    Keywords,
+    Embedding,
+    SourceType,
+)
+from exorde_data import Url
+from blades.spotting.merge import GROUPS, merge_all
+from blades.spotting.process_batch import merge_chunks
+
+"""
+The vectorized merge must produce the same items as `merge_chunks`
+"""
+
+
+def chunk(rng: random.Random, url: str) -> ProcessedItem:
+    analysis = {
+        group: group_type(rng.random()) if fields is None else group_type(
+            **{field: rng.choice([rng.random(), 0.5]) for field in fields}
+        )
+        for group, (group_type, fields) in GROUPS.items()
+    }
+    return ProcessedItem(
+        item=ProtocolItem(
+            created_at='2023-10-17T00:00:00.00Z',
+            domain='reddit.com',
+            url=Url(url),
+            language='en',
+        ),
+        analysis=ProtocolAnalysis(
+            classification=Classification(
+                label=rng.choice(['finance', 'sports', 'politics']),
+                score=rng.random()
+            ),
+            top_keywords=Keywords(['bitcoin', 'etf']),
+            embedding=Embedding([rng.random() for __i__ in range(384)]),
+            source_type=SourceType(rng.choice(['social', 'news'])),
+            **analysis
+        ),
+        collection_client_version=CollectionClientVersion('exorde:v.test'),
+        collection_module=CollectionModule('unknown'),
+        collected_at=CollectedAt('2023-10-17T00:00:00.00Z'),
+    )
+
+
+def test_merge_all_matches_merge_chunks():
+    rng = random.Random(0)
+    items = [
+        [
+            chunk(rng, 'https://reddit.com/{}'.format(i))
+            for __j__ in range(rng.choice([1, 1, 2, 3, 4, 7]))
+        ]
+        for i in range(50)
+    ]
+    merged = merge_all(items)
+    assert len(merged) == len(items)
+    for chunks, result in zip(items, merged):
+        expected = merge_chunks(chunks)
+        assert set(result.analysis.top_keywords) == set(
+            expected.analysis.top_keywords
+        )
+        result.analysis.top_keywords = expected.analysis.top_keywords
+        assert result == expected
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+
+from blades.spotting.pipeline import Pipeline, Stage
+
+
+def test_stages_run_in_order():
+    async def double(x):
+        return x * 2
+
+    async def scenario():
+        pipeline = Pipeline([
+            Stage('double', double),
+            Stage('increment', lambda x: x + 1, blocking=True),
+        ])
+        pipeline.start()
+        results = await asyncio.gather(*[pipeline.process(i) for i in range(5)])
+        status = pipeline.status()
+        await pipeline.stop()
+        return results, status
+
+    results, status = asyncio.run(scenario())
+    assert results == [1, 3, 5, 7, 9]
+    assert status['double']['processed'] == 5
+    assert status['increment']['latencies']['count'] == 5
+
+
+def test_slow_stage_does_not_hold_the_others():
+    started = []
+    async def fast(x):
+        started.append(x)
+        return x
+
+    async def slow(x):
+        await asyncio.sleep(0.2)
+        return x
+
+    async def scenario():
+        pipeline = Pipeline([
+            Stage('fast', fast),
+            Stage('slow', slow, concurrency=1, queue_size=4),
+        ])
+        pipeline.start()
+        tasks = [asyncio.create_task(pipeline.process(i)) for i in range(3)]
+        await asyncio.sleep(0.05)
+        # every batch went trough the fast stage while the first one uploads
+        assert started == [0, 1, 2]
+        assert pipeline.status()['slow']['depth'] == 2
+        await asyncio.gather(*tasks)
+        await pipeline.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stage_errors_are_raised_to_the_caller():
+    async def fail(x):
+        raise ValueError(x)
+
+    async def scenario():
+        pipeline = Pipeline([Stage('fail', fail)])
+        pipeline.start()
+        with pytest.raises(ValueError):
+            await pipeline.process(1)
+        assert pipeline.status()['fail']['errors'] == 1
+        await pipeline.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,52 @@
+import pytest
+
+from blades.spotting.registry import ModelRegistry, ModelRegistryNotReady, ModelSpec
+from blades.spotting.residency import MB, Residency, UnknownEvictionPolicy
+
+SPECS = [
+    ModelSpec(name, name, 'test', footprint=footprint * MB)
+    for name, footprint in [('a', 300), ('b', 300), ('c', 300)]
+]
+
+
+class CountingRegistry(ModelRegistry):
+    def __init__(self, **kwargs):
+        super().__init__(SPECS, **kwargs)
+        self.loaded = []
+
+    def _load_one(self, spec):
+        self.loaded.append(spec.name)
+        return object()
+
+
+def test_everything_resident_without_budget():
+    registry = CountingRegistry()
+    registry.load()
+    assert registry.loaded == ['a', 'b', 'c']
+    registry.get('c')
+    assert registry.loaded == ['a', 'b', 'c']
+    with pytest.raises(ModelRegistryNotReady):
+        registry.get('unknown')
+
+
+def test_lru_eviction_within_budget():
+    registry = CountingRegistry(memory_budget=700 * MB)
+    registry.load()
+    assert registry.loaded == ['a', 'b']
+    registry.get('a')
+    registry.get('c') # evicts b, the least recently used
+    assert set(registry.models) == {'a', 'c'}
+    assert registry.residency.used <= 700 * MB
+    registry.get('b')
+    assert set(registry.models) == {'c', 'b'}
+    assert registry.residency.evictions == 2
+
+
+def test_cost_eviction():
+    residency = Residency(600 * MB, 'cost')
+    residency.admit('slow', 300 * MB, 10.0)
+    residency.admit('fast', 300 * MB, 1.0)
+    residency.touch('slow')
+    assert residency.victims(300 * MB) == ['fast']
+    with pytest.raises(UnknownEvictionPolicy):
+        Residency(policy='fifo')
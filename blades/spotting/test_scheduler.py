@@ -0,0 +1,71 @@
+import os
+import sys
+import types
+import threading
+import pytest
+
+from blades.spotting import scheduler
+from blades.spotting.scheduler import CyclicHeads, Head, run_heads
+
+
+@pytest.fixture(autouse=True)
+def fresh_process(monkeypatch):
+    """no limit applied yet, a fake torch counting set_num_threads"""
+    calls = []
+    monkeypatch.setattr(scheduler, '_intra_op_threads', None)
+    monkeypatch.delenv('OMP_NUM_THREADS', raising=False)
+    monkeypatch.delenv('TF_NUM_INTRAOP_THREADS', raising=False)
+    monkeypatch.delitem(sys.modules, 'tensorflow', raising=False)
+    monkeypatch.setitem(
+        sys.modules, 'torch', types.SimpleNamespace(set_num_threads=calls.append)
+    )
+    return calls
+
+
+@pytest.mark.parametrize('concurrent_heads', [1, 3])
+def test_dependent_heads_wait_for_their_inputs(concurrent_heads):
+    order = []
+    def head(name, depends_on=(), value=None):
+        def run(inputs):
+            order.append(name)
+            return value if value is not None else inputs
+        return Head(name, run, depends_on)
+
+    results, seconds = run_heads([
+        head('Age', ('tokenize',)),
+        head('Gender', ('tokenize',)),
+        head('tokenize', value=[1, 2]),
+        head('Emotion', value='e'),
+    ], concurrent_heads)
+    assert order.index('tokenize') < order.index('Age')
+    assert order.index('tokenize') < order.index('Gender')
+    assert results['Age'] == results['Gender'] == {'tokenize': [1, 2]}
+    assert set(seconds) == {'Age', 'Gender', 'tokenize', 'Emotion'}
+
+
+def test_independent_heads_run_concurrently():
+    # every head waits for the others, it only passes when they run together
+    barrier = threading.Barrier(3, timeout=5)
+    heads = [
+        Head(name, lambda inputs: barrier.wait() is not None)
+        for name in ('Emotion', 'Irony', 'TextType')
+    ]
+    results, __seconds__ = run_heads(heads, concurrent_heads=3)
+    assert results == {'Emotion': True, 'Irony': True, 'TextType': True}
+
+
+def test_cyclic_heads_raise():
+    with pytest.raises(CyclicHeads):
+        run_heads([
+            Head('a', lambda inputs: 1, ('b',)),
+            Head('b', lambda inputs: 1, ('a',)),
+        ], concurrent_heads=2)
+
+
+def test_threads_are_limited_once_per_process(fresh_process):
+    heads = [Head('Emotion', lambda inputs: 1)]
+    for __i__ in range(3):
+        run_heads(heads, concurrent_heads=2, threads=4)
+    assert fresh_process == [4]
+    assert os.environ['OMP_NUM_THREADS'] == '4'
+    assert os.environ['TF_NUM_INTRAOP_THREADS'] == '4'
@@ -0,0 +1,35 @@
+import os
+import numpy as np
+import pytest
+
+from blades.spotting.registry import ModelSpec
+from blades.spotting.shared_weights import (
+    ALIGNMENT, map_safetensors, share, write_safetensors
+)
+
+
+def test_safetensors_round_trip(tmp_path):
+    arrays = {
+        'embeddings.weight': np.random.rand(7, 3).astype(np.float32),
+        'position_ids': np.arange(5, dtype=np.int64),
+        'bias': np.ones(3, dtype=np.float16),
+    }
+    path = os.path.join(tmp_path, 'weights.safetensors')
+    write_safetensors(path, arrays)
+    mapped = map_safetensors(path)
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(mapped[name], array)
+        assert mapped[name].ctypes.data % ALIGNMENT == 0 # aligned views
+        assert not mapped[name].flags.writeable
+    assert isinstance(mapped['bias'].base, np.memmap)
+
+
+def test_share_torch_module(tmp_path):
+    torch = pytest.importorskip("torch")
+    spec = ModelSpec("Embedding", "test/encoder", "sentence_transformer")
+    model = torch.nn.Linear(4, 2)
+    expected = model(torch.ones(1, 4))
+    assert share(spec, model, str(tmp_path)) == (4 * 2 + 2) * 4
+    replica = torch.nn.Linear(4, 2) # loaded again, the store is reused
+    share(spec, replica, str(tmp_path))
+    torch.testing.assert_close(replica(torch.ones(1, 4)), expected)
@@ -0,0 +1,36 @@
+import sys
+import types
+
+from blades.spotting.registry import ModelSpec
+from blades.spotting.snapshots import resolve_latest
+
+
+def hub(monkeypatch, sha):
+    """a huggingface_hub which model_info answers `sha` (or fails if None)"""
+    class HfApi:
+        def model_info(self, repo_id):
+            if sha is None:
+                raise OSError('offline')
+            return types.SimpleNamespace(sha=sha)
+    monkeypatch.setitem(
+        sys.modules, 'huggingface_hub', types.SimpleNamespace(HfApi=HfApi)
+    )
+
+
+def test_latest_is_pinned_and_resolved_again(tmp_path, monkeypatch):
+    spec = ModelSpec('Emotion', 'org/emotion', 'text-classification')
+    hub(monkeypatch, 'c1')
+    assert resolve_latest(spec, str(tmp_path), 60).revision == 'c1'
+    hub(monkeypatch, 'c2') # a new commit, the remembered one is still fresh
+    assert resolve_latest(spec, str(tmp_path), 60).revision == 'c1'
+    assert resolve_latest(spec, str(tmp_path), 0).revision == 'c2'
+    hub(monkeypatch, None) # offline, keeps the last commit
+    assert resolve_latest(spec, str(tmp_path), 0).revision == 'c2'
+    pinned = ModelSpec('Emotion', 'org/emotion', 'text-classification', revision='v1')
+    assert resolve_latest(pinned, str(tmp_path), 0) is pinned
+
+
+def test_latest_without_hub_stays_unpinned(tmp_path, monkeypatch):
+    spec = ModelSpec('Emotion', 'org/emotion', 'text-classification')
+    hub(monkeypatch, None)
+    assert resolve_latest(spec, str(tmp_path), 60).revision is None
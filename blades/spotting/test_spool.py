@@ -0,0 +1,101 @@
+import os
+import asyncio
+import pytest
+
+from blades.spotting.batcher import AdaptiveBatcher, Overloaded
+from blades.spotting.spool import Spool, HEADER
+
+
+def test_records_survive_a_restart(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=64)
+    records = [spool.append('item {}'.format(i).encode()) for i in range(10)]
+    assert spool.read(records[:2]) == ['item 0', 'item 1']
+    assert len(spool.segments) > 1 # 64 bytes segments hold a few records
+    spool.done(records[:4])
+    # the process dies without closing the spool
+    restarted = Spool(str(tmp_path), segment_bytes=64)
+    pending = restarted.recover()
+    assert restarted.read(pending) == ['item {}'.format(i) for i in range(4, 10)]
+    restarted.done(pending)
+    assert os.listdir(tmp_path) == [] # every segment is released
+
+
+def test_torn_write_is_not_replayed(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b'complete')
+    record = spool.append(b'torn')
+    segment = spool.segments[record.segment]
+    start = record.offset + HEADER.size
+    segment.mm[start:start + 4] = b'tor\x00'
+    restarted = Spool(str(tmp_path))
+    assert restarted.read(restarted.recover()) == ['complete']
+
+
+def test_batcher_replays_the_spool(tmp_path):
+    batches = []
+    async def process(items):
+        batches.append(items)
+
+    async def scenario():
+        crashed = AdaptiveBatcher(
+            process, min_size=10, max_wait_seconds=60, spool=Spool(str(tmp_path))
+        )
+        crashed.add('a')
+        crashed.add('b')
+        batcher = AdaptiveBatcher(
+            process, min_size=10, max_wait_seconds=60, spool=Spool(str(tmp_path))
+        )
+        assert batcher.replay() == 2
+        await batcher.stop()
+        assert batcher.spool.status()['pending'] == 0
+
+    asyncio.run(scenario())
+    assert batches == [['a', 'b']]
+
+
+def test_spooled_items_use_the_spool_budget(tmp_path):
+    done = asyncio.Event()
+    async def process(items):
+        await done.wait()
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=2, max_wait_seconds=60, max_items=1,
+            spool=Spool(str(tmp_path)), max_spool_items=3
+        )
+        batcher.add('a', 1)
+        batcher.add('b', 1) # over max_items, which only counts in memory
+        batcher.add('c', 1)
+        with pytest.raises(Overloaded):
+            batcher.add('d', 1)
+        await asyncio.sleep(0) # the batch of a and b is read
+        assert batcher.spooled_items == 3 and batcher.admitted_items == 2
+        done.set()
+        await batcher.stop()
+        assert batcher.spooled_items == 0 and batcher.admitted_items == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_batches_are_retried(tmp_path):
+    batches = []
+    async def process(items):
+        batches.append(items)
+        if items == ['bad']:
+            raise RuntimeError('bad item')
+
+    async def scenario():
+        batcher = AdaptiveBatcher(
+            process, min_size=1, max_wait_seconds=60,
+            spool=Spool(str(tmp_path)), max_attempts=2
+        )
+        batcher.add('bad')
+        batcher.add('good')
+        while batcher.running or len(batcher.queue):
+            await batcher.stop()
+        assert batcher.retried == 1 and batcher.dropped == 1
+        assert batcher.spool.status()['pending'] == 0
+        assert batcher.spooled_items == 0 and batcher.attempts == {}
+
+    asyncio.run(scenario())
+    assert sorted(batches) == [['bad'], ['bad'], ['good']]
@@ -0,0 +1,145 @@
+import numpy as np
+import pytest
+
+from blades.spotting.stubs import StubRegistry
+from blades.spotting.tag import (
+    InferenceConfiguration, MAX_LENGTH, length_buckets, tag
+)
+
+# The batched, length bucketed and dynamically padded `tag` must score the
+# documents like the original `tag`, which ran every model on one document at
+# a time (`reference_tag` below, over the same stub models).
+#
+# Tolerances : model scores may differ by float32 rounding (a batched matrix
+# product sums in another order), 1e-5. The sentiment is rounded to 2 digits
+# from sub-scores rounded to 3 digits, such a rounding difference may move it
+# by one step, 0.01.
+SCORE_TOLERANCE = 1e-5
+SENTIMENT_TOLERANCE = 0.01 + 1e-9
+
+
+def reference_tag(documents: list[str], registry) -> list[dict]:
+    """the original per-document `tag`, as plain dicts"""
+    tokenizer = registry.get("tokenizer")
+    finvader = registry.finvader()
+    mappings = registry.mappings
+
+    def scores(name: str, text: str) -> dict:
+        return {y["label"]: y["score"] for y in registry.get(name)([text])[0]}
+
+    def distil(name: str, text: str) -> float:
+        prediction = scores(name, text)
+        return round(
+            round(prediction["positive"], 3) - round(prediction["negative"], 3), 3
+        )
+
+    def sentiment(text: str) -> float:
+        gen_distilbert_sentiment = distil("gdb", text)
+        vader_sent = round(
+            registry.get("vader").polarity_scores(text)["compound"], 2
+        )
+        fin_vader_sent = round(finvader(
+            text, use_sentibignomics=True, use_henry=True, indicator='compound'
+        ), 2)
+        compounded_fin_sentiment = round(
+            0.70 * distil("fdb", text) + 0.30 * fin_vader_sent, 2
+        )
+        if abs(compounded_fin_sentiment) >= 0.6:
+            return round(0.30 * gen_distilbert_sentiment + 0.10 * vader_sent + 0.60 * compounded_fin_sentiment, 2)
+        elif abs(compounded_fin_sentiment) >= 0.4:
+            return round(0.40 * gen_distilbert_sentiment + 0.20 * vader_sent + 0.40 * compounded_fin_sentiment, 2)
+        elif abs(compounded_fin_sentiment) >= 0.1:
+            return round(0.60 * gen_distilbert_sentiment + 0.25 * vader_sent + 0.15 * compounded_fin_sentiment, 2)
+        return round(0.60 * gen_distilbert_sentiment + 0.40 * vader_sent, 2)
+
+    def predict(name: str, text: str) -> dict:
+        ids = tokenizer(
+            [text], add_special_tokens=True, max_length=MAX_LENGTH,
+            truncation=True, return_attention_mask=False,
+        )["input_ids"][0]
+        padded = np.array( # padding="max_length"
+            ids + [tokenizer.pad_token_id] * (MAX_LENGTH - len(ids))
+        ).reshape(1, -1)
+        preds = registry.get(name).predict(padded, verbose=0)[0]
+        return {mappings[name][i]: float(preds[i]) for i in range(len(preds))}
+
+    result = []
+    for text in documents:
+        language_score = registry.get("LanguageScore")([text])[0][0]["score"]
+        gender = list(predict("Gender", text).values())
+        age = predict("Age", text)
+        result.append({
+            "language_score": language_score,
+            "sentiment": sentiment(text),
+            "embedding": list(
+                registry.get("Embedding").encode([text])[0].astype(float)
+            ),
+            "gender": {"male": gender[0], "female": gender[1]},
+            "text_type": {
+                "assumption": scores("TextType", text)["Assumption"],
+                "anecdote": scores("TextType", text)["Anecdote"],
+                "none": scores("TextType", text)["None"],
+                "definition": scores("TextType", text)["Definition"],
+                "testimony": scores("TextType", text)["Testimony"],
+                "other": scores("TextType", text)["Other"],
+                "study": scores("TextType", text)["Statistics/Study"],
+            },
+            "emotion": {
+                emotion: score for emotion, score in scores("Emotion", text).items()
+                if emotion != "amusement"
+            },
+            "irony": {
+                "irony": scores("Irony", text)["irony"],
+                "non_irony": scores("Irony", text)["non_irony"],
+            },
+            "age": {
+                "below_twenty": age["<20"],
+                "twenty_thirty": age["20<30"],
+                "thirty_forty": age["30<40"],
+                "forty_more": age[">=40"],
+            },
+        })
+    return result
+
+
+DOCUMENTS = [
+    " ".join("word{}".format((i * 7 + j) % 50) for j in range(1 + (i * 13) % 40))
+    for i in range(23)
+] + ["Bitcoin rallied after the ETF approval.", "gm"]
+
+
+def assert_close(result, expected, field: str):
+    if isinstance(expected, dict):
+        assert set(result) == set(expected), field
+        for key in expected:
+            assert_close(result[key], expected[key], '{}.{}'.format(field, key))
+    elif isinstance(expected, list):
+        assert np.allclose(result, expected, rtol=0, atol=SCORE_TOLERANCE), field
+    else:
+        tolerance = SENTIMENT_TOLERANCE if field == 'sentiment' else SCORE_TOLERANCE
+        assert abs(result - expected) <= tolerance, field
+
+
+@pytest.mark.parametrize("configuration", [
+    InferenceConfiguration(batch_size=1, buckets=1, concurrent_heads=1),
+    InferenceConfiguration(batch_size=4, buckets=3, concurrent_heads=4),
+    InferenceConfiguration(batch_size=32, buckets=1, concurrent_heads=2),
+])
+def test_tag_matches_the_per_document_tag(configuration):
+    registry = StubRegistry()
+    registry.load()
+    expected = reference_tag(DOCUMENTS, registry)
+    result = tag(DOCUMENTS, registry, configuration)
+    assert len(result) == len(expected)
+    for analysis, reference in zip(result, expected):
+        for field, value in reference.items():
+            assert_close(analysis[field], value, field)
+
+
+def test_length_buckets_cover_every_input_once():
+    lengths = [5, 1, 9, 3, 3, 7, 2]
+    batches = length_buckets(lengths, batch_size=2, buckets=2)
+    assert sorted(i for batch in batches for i in batch) == list(range(7))
+    assert all(len(batch) <= 2 for batch in batches)
+    # each bucket holds inputs of similar length
+    assert [lengths[i] for i in batches[0]] == [1, 2]
@@ -0,0 +1,82 @@
+import gzip
+import json
+import asyncio
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from blades.spotting.ipfs_standin import standin_app
+from blades.spotting.uploader import SerializedBatch, Uploader, UploadError, gzip_stream
+
+BATCH = SerializedBatch(
+    items=[json.dumps({'item': {'url': 'https://x.com/{}'.format(i)}}).encode() for i in range(50)],
+    fields={'kind': json.dumps('SPOTTING')},
+)
+
+
+def test_serialized_batch_is_json():
+    assert json.loads(b''.join(BATCH.chunks())) == {
+        'items': [json.loads(item) for item in BATCH.items], 'kind': 'SPOTTING'
+    }
+
+
+def upload(app, **parameters):
+    async def scenario():
+        async with TestServer(app) as server:
+            uploader = Uploader(
+                str(server.make_url('/add')),
+                download_url=str(server.make_url('/ipfs')) + '/{cid}',
+                backoff_seconds=0.01,
+                **parameters
+            )
+            await uploader.start()
+            try:
+                cids = await asyncio.gather(*[uploader.upload(BATCH) for __i__ in range(4)])
+            finally:
+                await uploader.stop()
+            return cids, uploader.status()
+    return asyncio.run(scenario())
+
+
+def test_upload_and_read_back():
+    cids, status = upload(standin_app())
+    assert len(set(cids)) == 1 # same content
+    assert status['uploaded'] == 4 and status['items'] == 200
+
+
+def test_upload_is_retried():
+    __cids__, status = upload(standin_app(failure_rate=0.5), retries=20)
+    assert status['uploaded'] == 4
+
+
+def test_wrong_count_fails():
+    async def add(request):
+        await request.read()
+        return web.json_response({'cid': 'bafy'})
+
+    async def truncated(request):
+        return web.json_response({'items': []})
+
+    app = web.Application()
+    app.router.add_post('/add', add)
+    app.router.add_get('/ipfs/{cid}', truncated)
+    with pytest.raises(UploadError):
+        upload(app, retries=1)
+
+
+def test_items_are_encoded_when_streamed():
+    encoded = []
+    def encode(item):
+        encoded.append(item)
+        return json.dumps(item).encode()
+
+    items = [{'url': 'https://x.com/{}'.format(i)} for i in range(3)]
+    batch = SerializedBatch(items=items, encode=encode)
+    chunks = batch.chunks()
+    assert next(chunks) == b'{"items": [' and encoded == []
+
+    async def compressed():
+        return b''.join([block async for block in gzip_stream(batch.chunks())])
+
+    assert json.loads(gzip.decompress(asyncio.run(compressed()))) == {'items': items}
+    assert encoded == items
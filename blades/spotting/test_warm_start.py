@@ -0,0 +1,24 @@
+from blades.spotting.warm_start import WarmStart
+
+
+def test_phases_and_ready():
+    warm_start = WarmStart(import_seconds=0.5)
+    with warm_start.phase('models'):
+        pass
+    assert not warm_start.ready
+    warm_start.done({'load_seconds': {}})
+    status = warm_start.status()
+    assert status['ready'] and 'models' in status['phases']
+    assert status['ready_seconds'] >= status['phases']['models']
+
+
+def test_failure_keeps_not_ready():
+    warm_start = WarmStart()
+    try:
+        with warm_start.phase('models'):
+            raise RuntimeError('no model')
+    except RuntimeError:
+        warm_start.fail()
+    assert not warm_start.ready
+    assert 'no model' in warm_start.status()['failure']
+    assert 'models' in warm_start.phases
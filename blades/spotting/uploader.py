@@ -0,0 +1,218 @@
+"""
+# Uploader
+
+Spotted batches are uploaded to the IPFS gateway, then downloaded back to
+check the number of items before the transaction is made.
+
+    - one pooled `aiohttp.ClientSession` for every upload (keep-alive)
+    - the batch's items are encoded one by one while they are streamed trough
+      a gzip compressor into a chunked request : neither the encoded items nor
+      the compressed body are held in memory. Encoding and compression run in
+      the loop's default executor, one block of the body at a time
+    - several uploads in flight (the pipeline's upload stage concurrency and
+      the session's connections are `in_flight`)
+    - failed uploads and read-backs with a wrong item count are retried with
+      an exponential backoff (and jitter)
+
+For offline benchmarks, ipfs_standin.py is a local stand-in for the gateway :
+
+    python blades/spotting/ipfs_standin.py --port 8090
+
+    upload_url: http://127.0.0.1:8090/add
+    download_url: http://127.0.0.1:8090/ipfs/{cid}
+"""
+import json
+import time
+import zlib
+import random
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+blade_logger = logging.getLogger('blade')
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """The batch could not be uploaded (and verified) after every retry"""
+
+
+def encode_item(item) -> bytes:
+    """json of an item, already encoded items are kept as they are"""
+    if isinstance(item, bytes):
+        return item
+    return json.dumps(item).encode('utf-8')
+
+
+@dataclass
+class SerializedBatch:
+    """a json object which `items` are encoded one by one, when streamed"""
+    items: list # encoded by `encode` in `chunks`
+    fields: dict = field(default_factory=dict) # every other key, as json
+    encode: Callable[[Any], bytes] = encode_item
+
+    @property
+    def count(self) -> int:
+        return len(self.items)
+
+    def chunks(self) -> Iterator[bytes]:
+        yield b'{"items": ['
+        for index, item in enumerate(self.items):
+            if index:
+                yield b', '
+            yield self.encode(item)
+        yield b']'
+        for key, value in self.fields.items():
+            yield ', {}: {}'.format(json.dumps(key), value).encode('utf-8')
+        yield b'}'
+
+
+def gzip_blocks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """gzip of `chunks`, in blocks of about CHUNK_SIZE bytes"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    pending = []
+    size = 0
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            pending.append(compressed)
+            size += len(compressed)
+        if size >= CHUNK_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+async def gzip_stream(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """`gzip_blocks`, each block encoded and compressed out of the loop"""
+    loop = asyncio.get_running_loop()
+    blocks = gzip_blocks(chunks)
+    while True:
+        block = await loop.run_in_executor(None, next, blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+class Uploader:
+    def __init__(
+        self,
+        upload_url: str,
+        download_url: Optional[str] = None, # with {cid}
+        in_flight: int = 4,
+        retries: int = 5,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 30.0,
+        timeout_seconds: float = 60.0,
+        compression: bool = True,
+    ):
+        self.upload_url = upload_url
+        self.download_url = download_url
+        self.in_flight = in_flight
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout_seconds = timeout_seconds
+        self.compression = compression
+        self.session: Optional[ClientSession] = None
+        self.uploading = 0
+        self.uploaded = 0
+        self.items = 0
+        self.failures = 0 # attempts
+        self.last_latency: Optional[float] = None
+        self.last_cid: Optional[str] = None
+
+    async def start(self):
+        self.session = ClientSession(
+            connector=TCPConnector(limit=self.in_flight),
+            timeout=ClientTimeout(total=self.timeout_seconds),
+        )
+
+    async def stop(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def body(self, batch: SerializedBatch):
+        if self.compression:
+            return gzip_stream(batch.chunks()), {
+                'Content-Encoding': 'gzip',
+                'Content-Type': 'application/json',
+            }
+        data = await asyncio.get_running_loop().run_in_executor(
+            None, b''.join, batch.chunks()
+        )
+        return data, {'Content-Type': 'application/json'}
+
+    async def attempt(self, batch: SerializedBatch) -> str:
+        data, headers = await self.body(batch)
+        async with self.session.post(
+            self.upload_url, data=data, headers=headers
+        ) as response:
+            response.raise_for_status()
+            cid: str = (await response.json(content_type=None))['cid']
+        if self.download_url is None:
+            return cid
+        # read-back
+        async with self.session.get(
+            self.download_url.format(cid=cid)
+        ) as response:
+            response.raise_for_status()
+            count = len((await response.json(content_type=None))['items'])
+        if count != batch.count:
+            raise UploadError('{} has {} items instead of {}'.format(
+                cid, count, batch.count
+            ))
+        return cid
+
+    async def upload(self, batch: SerializedBatch) -> str:
+        """returns the cid of the uploaded batch"""
+        start = time.monotonic()
+        self.uploading += 1
+        try:
+            for retry in range(self.retries + 1):
+                try:
+                    cid = await self.attempt(batch)
+                    break
+                except Exception as error:
+                    self.failures += 1
+                    if retry == self.retries:
+                        raise UploadError(
+                            'upload failed after {} attempts'.format(retry + 1)
+                        ) from error
+                    delay = min(
+                        self.max_backoff_seconds,
+                        self.backoff_seconds * 2 ** retry
+                    ) * random.uniform(0.5, 1)
+                    blade_logger.warning(
+                        'upload failed ({}), retrying in {:.1f}s'.format(
+                            error, delay
+                        )
+                    )
+                    await asyncio.sleep(delay)
+        finally:
+            self.uploading -= 1
+        self.last_latency = time.monotonic() - start
+        self.last_cid = cid
+        self.uploaded += 1
+        self.items += batch.count
+        blade_logger.info('uploaded {} items to {}'.format(batch.count, cid))
+        return cid
+
+    def status(self) -> dict:
+        return {
+            'upload_url': self.upload_url,
+            'in_flight': self.in_flight,
+            'uploading': self.uploading,
+            'uploaded': self.uploaded,
+            'items': self.items,
+            'failures': self.failures,
+            'last_cid': self.last_cid,
+            'last_latency': (
+                round(self.last_latency, 4)
+                if self.last_latency is not None else None
+            ),
+        }
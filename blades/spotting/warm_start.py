@@ -0,0 +1,65 @@
+"""
+# Warm start
+
+The blade's server starts right away, models are loaded in the background by
+a warm-up task ; `/push` and `/push/bulk` answer 503 "not ready" until it is
+done. If it fails the blade exits (the scrapers would retry forever) and
+multi.py starts it again :
+
+    on_startup : components built (no model, no heavy import)
+    warm-up    : models & chunker (executor: workers or thread) -> replay
+                 of the spooled items -> ready
+
+The heavy libraries (torch, transformers, tensorflow) are only imported by the
+registry while warming up, in the inference process. Once ready, a startup
+report is logged with the time of each phase, the import of the blade and of
+each library and the load of each model (and whether it came from a local
+snapshot, see snapshots.py), to spot cold-start regressions.
+"""
+import time
+import logging
+import traceback
+from contextlib import contextmanager
+from typing import Optional
+
+blade_logger = logging.getLogger('blade')
+
+
+class WarmStart:
+    def __init__(self, import_seconds: Optional[float] = None):
+        self.started = time.monotonic()
+        self.import_seconds = import_seconds # of the blade's modules
+        self.phases: dict[str, float] = {}
+        self.ready = False
+        self.ready_seconds: Optional[float] = None
+        self.failure: Optional[str] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.monotonic() - start, 3)
+
+    def fail(self):
+        self.failure = traceback.format_exc()
+        blade_logger.error('warm-up failed\n{}'.format(self.failure))
+
+    def done(self, registry_status: dict):
+        self.ready_seconds = round(time.monotonic() - self.started, 3)
+        self.ready = True
+        report = {**self.status(), 'models': registry_status}
+        blade_logger.info(
+            'ready in {}s'.format(self.ready_seconds),
+            extra={'logtest': {'startup': report}}
+        )
+
+    def status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'import_seconds': self.import_seconds,
+            'phases': self.phases,
+            'ready_seconds': self.ready_seconds,
+            'failure': self.failure,
+        }